@@ -0,0 +1,180 @@
+"""Psyinc на aiogram (asyncio): один процесс держит тысячи ожидающих ответов GPT
+и пересылок без потока на апдейт.
+
+Рабочая точка входа — bot_v03.py (telebot, polling и вебхук): её запускают
+Dockerfile, docker-compose.yml и discloud.config. Этот вариант собирает те же
+сервисы (services/factory.py) из тех же настроек и пока остаётся запасным.
+"""
+import asyncio
+import json
+import logging
+import os
+import signal
+
+from aiogram import Bot, Dispatcher, types
+from aiohttp import web
+
+from filters.admin import AdminFilter
+from handlers.admin import register_admin
+from handlers.echo import register_echo
+from handlers.listener import notify_expired, publish_board, register_listener
+from handlers.self_help import register_self_help
+from handlers.user import register_user
+from middlewares.db import DbMiddleware
+from middlewares.updates import UpdateJournalMiddleware
+from misc.steps import FEEDBACK_TEXT, TICKET_REPLY_TEXT
+from services.async_db import AsyncDatabase
+from services.factory import build_services
+from services.fsm_storage import ChatStoreStorage
+from services.gpt import AsyncGptPipeline
+from services.metrics import REGISTRY
+from services.sender import AsyncOutboundQueue
+from services.sweeper import SWEEP_ERRORS
+from tgbot.config import load_config
+
+logger = logging.getLogger(__name__)
+
+
+def register_all_middlewares(dp):
+    dp.setup_middleware(UpdateJournalMiddleware(dp.bot['updates']))
+    dp.setup_middleware(DbMiddleware())
+
+
+def register_all_filters(dp):
+    dp.filters_factory.bind(AdminFilter)
+
+
+def register_all_handlers(dp):
+    # порядок важен: команды и меню → диалог слушателя → самопомощь → ответ по умолчанию
+    register_admin(dp)
+    register_user(dp)
+    register_listener(dp)
+    register_self_help(dp)
+    register_echo(dp)
+
+
+def create_services(bot: Bot, config):
+    services = build_services(config)
+    bot['updates'] = services.updates
+    bot['auto_match'] = services.matcher.enabled
+    bot['ticket_cards'] = services.ticket_cards
+    bot['board'] = services.board
+    bot['db'] = AsyncDatabase(services.db, services.sessions, services.chat_store, services.routes, services.matcher,
+                              pool_size=config.db.pool_size, metrics_name=config.db.engine)
+    bot['sweeper'] = services.sweeper
+    bot['sender'] = sender = AsyncOutboundQueue(bot)
+    bot['gpt'] = gpt = AsyncGptPipeline(
+        sender,
+        api_key=config.openai_api_key,
+        guard=services.guard,
+        max_concurrency=int(os.getenv("GPT_CONCURRENCY", "50")),
+        edit_interval=float(os.getenv("GPT_EDIT_INTERVAL", "1.0")),
+    )
+    bot['histories'] = services.create_histories(gpt)
+    bot['request_log'] = services.request_log
+    bot['feedback_log'] = services.feedback_log
+
+
+async def run_sweeper(bot: Bot):
+    """ExpirySweeper.sweep() в пуле БД раз в interval, уведомления — через очередь отправки."""
+    sweeper, db = bot['sweeper'], bot['db']
+    while True:
+        await asyncio.sleep(sweeper.interval)
+        try:
+            expired = await db.run("sweep", sweeper.sweep)
+            if expired:
+                await notify_expired(bot, db, expired)
+        except Exception:
+            SWEEP_ERRORS.inc()
+            logger.exception("Sweeper failed")
+
+
+async def run_board(bot: Bot):
+    """Табло очереди: не чаще раза в interval и только если оно изменилось."""
+    board, db = bot['board'], bot['db']
+    await db.run("board", board.rebuild)
+    while True:
+        try:
+            rendered = board.changed()
+            if rendered is not None:
+                await publish_board(bot, db, *rendered)
+                board.published(rendered)
+        except Exception:
+            logger.exception("Queue board update failed")
+        await asyncio.sleep(board.interval)
+
+
+async def replay_pending(dp: Dispatcher):
+    """Апдейты, принятые до падения, но так и не обработанные (UpdateJournal), — заново хэндлерам."""
+    pending = await dp.bot['db'].run("pending_updates", dp.bot['updates'].pending)
+    if not pending:
+        return
+    logger.info("Replaying %d unprocessed updates", len(pending))
+    Bot.set_current(dp.bot)
+    Dispatcher.set_current(dp)
+    await dp.process_updates([types.Update(**json.loads(payload)) for _, payload in pending])
+
+
+async def start_metrics_server(port: int, host: str) -> web.AppRunner:
+    async def metrics(request):
+        return web.Response(body=REGISTRY.render().encode(),
+                            headers={"Content-Type": "text/plain; version=0.0.4; charset=utf-8"})
+
+    app = web.Application()
+    app.router.add_get("/metrics", metrics)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
+
+
+async def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format=u'%(filename)s:%(lineno)d #%(levelname)-8s [%(asctime)s] - %(name)s - %(message)s',
+    )
+    logger.info("Starting bot")
+    config = load_config(".env")
+
+    bot = Bot(token=config.tg_bot.token)
+    bot['config'] = config
+    create_services(bot, config)
+    # состояния FSM — в хранилище чатов рядом с режимом, а не в памяти процесса
+    dp = Dispatcher(bot, storage=ChatStoreStorage(bot['db'], steps=(FEEDBACK_TEXT, TICKET_REPLY_TEXT)))
+    await bot['db'].rebuild_routes()
+
+    register_all_middlewares(dp)
+    register_all_filters(dp)
+    register_all_handlers(dp)
+
+    metrics_port = int(os.getenv("METRICS_PORT", "0"))
+    runner = await start_metrics_server(metrics_port, os.getenv("METRICS_HOST", "127.0.0.1")) if metrics_port else None
+    tasks = [asyncio.create_task(run_sweeper(bot))]
+    if bot['board']:
+        tasks.append(asyncio.create_task(run_board(bot)))
+
+    # docker stop / systemd шлют SIGTERM: останавливаем polling, чтобы дошло до finally
+    asyncio.get_running_loop().add_signal_handler(signal.SIGTERM, dp.stop_polling)
+    try:
+        await bot.delete_webhook()
+        await replay_pending(dp)
+        await dp.start_polling()
+    finally:
+        for task in tasks:
+            task.cancel()
+        if runner is not None:
+            await runner.cleanup()
+        await dp.storage.close()
+        await dp.storage.wait_closed()
+        session = await bot.get_session()
+        await session.close()
+        bot['request_log'].stop()
+        bot['feedback_log'].stop()
+        bot['db'].close()
+
+
+if __name__ == '__main__':
+    try:
+        asyncio.run(main())
+    except (KeyboardInterrupt, SystemExit):
+        logger.error("Bot stopped!")
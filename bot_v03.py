@@ -1,35 +1,38 @@
 # bot_v05.py
+import atexit
+import functools
+import hmac
+import json
 import os
+import signal
+import sys
 import time
-import json
-import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from secrets import token_hex
+
+from services.startup import StartupTimer
+
+# замер запуска — с первой строки модуля; отчёт печатается перед polling и после прогрева
+STARTUP = StartupTimer()
 
 import requests
 import telebot
 from telebot import types, apihelper
-from flask import Flask
-import openai
 from requests.adapters import HTTPAdapter
 from urllib3.util.retry import Retry
 
+# openai и flask импортируются лениво: первый — при первом запросе к GPT,
+# второй — только для вебхука и /metrics
+
 # ------------------ Конфигурация ------------------
 from tgbot.config import load_config
 config = load_config()
 
-app = Flask(__name__)
-bot = telebot.TeleBot(config.tg_bot.token)
-
-# убираем вебхук (на всякий) и даём телеге время «отпустить»
-try:
-    bot.remove_webhook()
-except Exception:
-    pass
-time.sleep(1)
-
-# OpenAI
-openai.api_key = config.openai_api_key
+# без сетевых вызовов: вебхук снимается в __main__, а не при импорте;
+# хэндлеры запускает пул update_pool (dispatch_updates), а не пул telebot —
+# чтобы апдейт отмечался обработанным только после них
+bot = telebot.TeleBot(config.tg_bot.token, threaded=False)
 
 # === СЕТЕВАЯ УСТОЙЧИВОСТЬ ДЛЯ TELEBOT ===
 session = requests.Session()
@@ -47,122 +50,130 @@ apihelper.SESSION = session
 apihelper.READ_TIMEOUT = 40
 apihelper.CONNECT_TIMEOUT = 20
 
-# ------------------ Персистентное состояние (state.json) ------------------
-STATE_FILE = "state.json"
-
-# chat_id -> mode ("listener"/"self_help"/"waiting_listener"/None)
-user_state = {}
-# chat_id -> messages history (для чат-бота)
-user_conversations = {}
-# тикеты для анонимности
-ticket_index = {}   # ticket -> user_id
-user_ticket = {}    # user_id -> ticket
-
-def load_persisted():
-    global user_state, user_conversations, ticket_index, user_ticket
-    if os.path.exists(STATE_FILE):
-        try:
-            with open(STATE_FILE, "r", encoding="utf-8") as f:
-                data = json.load(f)
-            user_state = {int(k): v for k, v in data.get("user_state", {}).items()}
-            user_conversations = {int(k): v for k, v in data.get("user_conversations", {}).items()}
-            ticket_index = {k: int(v) for k, v in data.get("ticket_index", {}).items()}
-            user_ticket = {int(k): v for k, v in data.get("user_ticket", {}).items()}
-        except Exception as e:
-            print(f"⚠️ Не удалось прочитать {STATE_FILE}: {e}")
-
-def save_persisted():
-    try:
-        with open(STATE_FILE, "w", encoding="utf-8") as f:
-            json.dump(
-                {
-                    "user_state": user_state,
-                    "user_conversations": user_conversations,
-                    "ticket_index": ticket_index,
-                    "user_ticket": user_ticket,
-                },
-                f, ensure_ascii=False, indent=2
-            )
-    except Exception as e:
-        print(f"⚠️ Не удалось сохранить {STATE_FILE}: {e}")
-
-load_persisted()
+# ------------------ Сервисы ------------------
+from misc.steps import FEEDBACK_TEXT, TICKET_REPLY_TEXT
+from misc.texts import (ABOUT_TEXT, CHOOSE_DIALOG_TEXT, GPT_BUSY_TEXT, GPT_RATE_LIMIT_TEXT, HELP_TEXT,
+                        LISTENERS_ONLY_TEXT, MULTI_DIALOG_HINT, PRIVATE_CONTENT_TEXT, SESSION_EXPIRED_IDLE_TEXT,
+                        SESSION_EXPIRED_WAITING_TEXT, WELCOME_TEXT)
+from services.board import QueueBoard, board_error
+from services.chat_store import create_fresh_ticket
+from services.db import Database
+from services.event_log import EventLog
+from services.factory import build_services
+from services.gpt import GptBusyError, GptPipeline
+from services.gpt_guard import GptRateLimitError
+from services.history import HistoryManager
+from services.matcher import ListenerMatcher
+from services.metrics import REGISTRY, dependency_metrics, handler_metrics
+from services.routing import CAPTION_CONTENT_TYPES, PRIVATE_CONTENT_TYPES, RELAY_CONTENT_TYPES, RelayRoutes
+from services.sender import PRIORITY_LOW, PRIORITY_RELAY, OutboundQueue
+from services.steps import StepMachine
+from services.sweeper import ExpirySweeper
+from services.updates import UpdateJournal
+
+# ------------------ Сервисы создаёт create_app() (services.factory, общие с bot.py) ------------------
+# исходящие сообщения (очередь с лимитами Telegram)
+sender: OutboundQueue = None
+
+# ------------------ Состояние чатов (SQLite, ленивая загрузка) ------------------
+# соединение на поток, WAL; связанные записи группируем через db.transaction()
+db: Database = None
+
+# режим чата ("listener"/"self_help"/"waiting_listener"/None), тикет и история GPT:
+# в Redis (USE_REDIS, общий для нескольких процессов) или в SQLite с LRU «горячих» чатов
+chat_store = None
+
+# смещение long polling и журнал апдейтов: перезапуск продолжает с места остановки без
+# повторов и без потерь — принятое, но не обработанное до падения, обрабатывается заново
+updates: UpdateJournal = None
+update_pool: ThreadPoolExecutor = None
 
 # ------------------ Админ-чат и админ-группа ------------------
 # ЛС админа (может быть 0 — тогда личку не используем)
 ADMIN_CHAT_ID = int(os.getenv("ADMIN_CHAT_ID", "0"))
 # Группа слушателей (supergroup). Используется для заявок/взятия в работу.
-# Ты давал: -1003083102736
-ADMIN_GROUP_ID = int(os.getenv("ADMIN_GROUP_ID", "-1003083102736"))
-
-# ------------------ База SQLite для анонимных сессий ------------------
-DB_FILE = "psyinc.db"
-_conn = sqlite3.connect(DB_FILE, check_same_thread=False)
-_cur = _conn.cursor()
-
-_cur.execute("""
-CREATE TABLE IF NOT EXISTS sessions (
-    id INTEGER PRIMARY KEY AUTOINCREMENT,
-    ticket TEXT UNIQUE,
-    user_id INTEGER,
-    listener_id INTEGER,
-    status TEXT,            -- waiting | active | closed
-    created_at TEXT
-)
-""")
-_conn.commit()
-
+ADMIN_GROUP_ID = config.tg_bot.admin_group_id
+
+# ------------------ Анонимные сессии (SQLite или PostgreSQL) ------------------
+sessions = None
+DB_METRICS_NAME = config.db.engine  # метка зависимости в метриках
+
+# маршруты открытых сессий в памяти (write-through из db_* ниже); загружаются в фоне
+routes: RelayRoutes = None
+warmed = threading.Event()
+WARMUP_TIMEOUT = 60
+
+def needs_state(func):
+    """Хэндлер, которому нужны маршруты и очередь: ждёт фонового прогрева (обычно уже готово)."""
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        warmed.wait(WARMUP_TIMEOUT)
+        return func(*args, **kwargs)
+    return wrapper
+
+@dependency_metrics(DB_METRICS_NAME, "create_session")
 def db_create_session(ticket: str, user_id: int):
-    _cur.execute(
-        "INSERT INTO sessions (ticket, user_id, status, created_at) VALUES (?, ?, 'waiting', ?)",
-        (ticket, user_id, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
-    )
-    _conn.commit()
+    sessions.create(ticket, user_id, datetime.now().strftime("%Y-%m-%d %H:%M:%S"))
+    routes.open(ticket, user_id)
 
+@dependency_metrics(DB_METRICS_NAME, "assign_listener")
 def db_assign_listener(ticket: str, listener_id: int):
-    _cur.execute("UPDATE sessions SET listener_id=?, status='active' WHERE ticket=?",
-                 (listener_id, ticket))
-    _conn.commit()
-
+    sessions.assign(ticket, listener_id)
+    routes.assign(ticket, listener_id)
+
+@dependency_metrics(DB_METRICS_NAME, "claim_ticket")
+def db_claim_ticket(ticket: str, listener_id: int):
+    """Атомарно отдаёт ожидающую заявку слушателю (compare-and-set одним UPDATE).
+       Возвращает user_id победителю и None проигравшему: заявка уже занята/закрыта
+       или у слушателя есть другая открытая сессия — в том числе в другом процессе."""
+    user_id = sessions.claim(ticket, listener_id, matcher.capacity(listener_id))
+    if user_id is not None:
+        routes.assign(ticket, listener_id)
+    return user_id
+
+@dependency_metrics(DB_METRICS_NAME, "close_session")
 def db_close_session(ticket: str):
-    _cur.execute("UPDATE sessions SET status='closed' WHERE ticket=?",
-                 (ticket,))
-    _conn.commit()
+    sessions.close(ticket)
+    routes.close(ticket)
 
+@dependency_metrics(DB_METRICS_NAME, "get_by_ticket")
 def db_get_by_ticket(ticket: str):
-    _cur.execute("SELECT * FROM sessions WHERE ticket=?", (ticket,))
-    return _cur.fetchone()
+    return sessions.get_by_ticket(ticket)
 
+@dependency_metrics(DB_METRICS_NAME, "active_for_user")
 def db_get_active_session_for_user(user_id: int):
-    _cur.execute("SELECT * FROM sessions WHERE user_id=? AND status!='closed'", (user_id,))
-    return _cur.fetchone()
+    return sessions.active_for_user(user_id)
 
+@dependency_metrics(DB_METRICS_NAME, "active_for_listener")
 def db_get_active_session_for_listener(listener_id: int):
-    _cur.execute("SELECT * FROM sessions WHERE listener_id=? AND status!='closed'", (listener_id,))
-    return _cur.fetchone()
+    return sessions.active_for_listener(listener_id)
+
+@dependency_metrics(DB_METRICS_NAME, "participant")
+def db_get_participant(chat_id: int):
+    """Открытая сессия, где чат — пользователь или слушатель, одним запросом.
+       Возвращает (ticket, role, counterpart_id, status) или None."""
+    return sessions.participant(chat_id)
+
+def rebuild_routes():
+    routes.rebuild(sessions.open_sessions())
 
-# ------------------ Логи (локально на сервере) ------------------
-LOG_FILE = "requests.log"
-if not os.path.exists(LOG_FILE):
-    with open(LOG_FILE, "w", encoding="utf-8") as f:
-        f.write("=== Журнал заявок ===\n\n")
+# автоподбор слушателя (AUTO_MATCH): очередь заявок, доступность и ёмкость слушателей
+# (таблица listeners); выключен — matcher.enabled=False, заявки берут кнопкой
+matcher: ListenerMatcher = None
 
-FEEDBACK_LOG_FILE = "feedback.log"
-if not os.path.exists(FEEDBACK_LOG_FILE):
-    with open(FEEDBACK_LOG_FILE, "w", encoding="utf-8") as f:
-        f.write("=== Отзывы пользователей ===\n\n")
+# ------------------ Логи (локально на сервере, JSON Lines) ------------------
+# запись в фоне пачками; при переполнении очереди события отбрасываются (счётчик dropped)
+request_log: EventLog = None
+feedback_log: EventLog = None
 
 def log_request(request_type: str, user):
-    try:
-        username = user.username or "нет"
-        full_name = f"{user.first_name or ''} {user.last_name or ''}".strip()
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        log_entry = f"[{timestamp}] Тип: {request_type} | Имя: {full_name} | Username: @{username} | Chat ID: {user.id}\n"
-        with open(LOG_FILE, "a", encoding="utf-8") as f:
-            f.write(log_entry)
-        print(f"✅ {log_entry.strip()}")
-    except Exception as e:
-        print(f"⚠️ Ошибка при записи лога: {e}")
+    request_log.log(
+        "request",
+        type=request_type,
+        name=f"{user.first_name or ''} {user.last_name or ''}".strip(),
+        username=user.username,
+        chat_id=user.id,
+    )
 
 # ------------------ Клавиатуры ------------------
 def main_menu_kb() -> types.ReplyKeyboardMarkup:
@@ -181,259 +192,333 @@ def exit_kb() -> types.ReplyKeyboardMarkup:
 def remove_kb() -> types.ReplyKeyboardRemove:
     return types.ReplyKeyboardRemove()
 
-# ------------------ Тексты ------------------
-welcome_text = (
-    "Приветствую!\n\n"
-    "Psyinc — это бот эмоциональной онлайн-поддержки. "
-    "Выберите, что вам нужно, или напишите /help.\n\n"
-    "Автор — Александр Гуртопов, канал "
-    "<a href='https://t.me/+qyO1cAXLfgRhMTNi'>Под коробкой</a>."
-)
+# ------------------ Многошаговые диалоги ------------------
+# ожидаемый шаг (отзыв, ответ по тикету) хранится в chat_store рядом с режимом:
+# переживает перезапуск, виден всем процессам; таблица обработчиков — STEP_HANDLERS
+steps: StepMachine = None
 
-about_text = (
-    "Psyinc — бот эмоциональной поддержки.\n\n"
-    "Версия: 1.0-beta\n"
-    "Автор: Александр Гуртопов (@bugseekerok)\n"
-    "Канал: <a href='https://t.me/+qyO1cAXLfgRhMTNi'>Под коробкой</a>"
-)
+def awaits_step(message) -> bool:
+    # /start и /cancel сбрасывают шаг, а не уходят в него как текст
+    if telebot.util.extract_command(message.text) in ('start', 'cancel'):
+        return False
+    return steps.pending(message.chat.id)
+
+# первым из хэндлеров: ответ на шаг важнее команд и меню, как у next_step_handler
+@bot.message_handler(func=awaits_step)
+@handler_metrics("on_step")
+def on_step(message):
+    if not steps.dispatch(message):
+        on_text(message)
 
 # ------------------ Команды ------------------
 @bot.message_handler(commands=['start'])
+@handler_metrics("cmd_start")
 def cmd_start(message):
     chat_id = message.chat.id
-    user_state.pop(chat_id, None)
-    save_persisted()
-    bot.send_message(chat_id, welcome_text, parse_mode='html', reply_markup=main_menu_kb())
+    steps.leave(chat_id)
+    chat_store.set_mode(chat_id, None)
+    sender.send_message(chat_id, WELCOME_TEXT, parse_mode='html', reply_markup=main_menu_kb())
 
 @bot.message_handler(commands=['help'])
+@handler_metrics("cmd_help")
 def cmd_help(message):
-    help_text = (
-        "Команды:\n"
-        "/start — главное меню\n"
-        "/info — о возможностях\n"
-        "/about — о боте\n"
-        "/feedback — оставить отзыв\n"
-        "/settings — настройки\n"
-        "/cancel — выйти из текущего режима\n"
-        "/reset — сбросить историю чат-бота\n"
-        "/getchatid — узнать ID текущего чата (видно только вам)"
-    )
-    bot.send_message(message.chat.id, help_text)
+    sender.send_message(message.chat.id, HELP_TEXT)
 
 @bot.message_handler(commands=['about'])
+@handler_metrics("cmd_about")
 def cmd_about(message):
-    bot.send_message(message.chat.id, about_text, parse_mode='html')
+    sender.send_message(message.chat.id, ABOUT_TEXT, parse_mode='html')
 
 @bot.message_handler(commands=['settings'])
+@handler_metrics("cmd_settings")
 def cmd_settings(message):
-    bot.send_message(message.chat.id, "Настройки пока не реализованы.", reply_markup=main_menu_kb())
+    sender.send_message(message.chat.id, "Настройки пока не реализованы.", reply_markup=main_menu_kb())
 
 @bot.message_handler(commands=['feedback'])
+@handler_metrics("cmd_feedback")
 def cmd_feedback(message):
-    bot.send_message(message.chat.id, "Пожалуйста, введите свой отзыв:", reply_markup=remove_kb())
-    bot.register_next_step_handler(message, process_feedback)
+    sender.send_message(message.chat.id, "Пожалуйста, введите свой отзыв:", reply_markup=remove_kb())
+    steps.enter(message.chat.id, FEEDBACK_TEXT)
 
+@handler_metrics("process_feedback")
 def process_feedback(message):
     try:
-        username = message.from_user.username or "нет"
-        full_name = f"{message.from_user.first_name or ''} {message.from_user.last_name or ''}".strip()
         feedback_text = (message.text or "").strip()
-        timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        log_entry = (
-            f"[{timestamp}] Имя: {full_name} | Username: @{username} | Chat ID: {message.chat.id}\n"
-            f"Отзыв: {feedback_text}\n\n"
+        feedback_log.log(
+            "feedback",
+            name=f"{message.from_user.first_name or ''} {message.from_user.last_name or ''}".strip(),
+            username=message.from_user.username,
+            chat_id=message.chat.id,
+            text=feedback_text,
         )
-        with open(FEEDBACK_LOG_FILE, "a", encoding="utf-8") as f:
-            f.write(log_entry)
-        print(f"💬 Отзыв сохранён: {full_name} — {feedback_text[:60]}...")
 
         # Дополнительно шлём в группу слушателей (без раскрытия личности пользователя)
         if ADMIN_GROUP_ID:
-            bot.send_message(
+            sender.send_message(
                 ADMIN_GROUP_ID,
                 f"📬 <b>Новый отзыв</b>\n\n"
                 f"💬 {feedback_text}",
-                parse_mode='HTML'
+                parse_mode='HTML',
+                priority=PRIORITY_LOW
             )
 
-        bot.send_message(message.chat.id, "Спасибо за обратную связь! Ваш отзыв сохранён 💚", reply_markup=main_menu_kb())
+        sender.send_message(message.chat.id, "Спасибо за обратную связь! Ваш отзыв сохранён 💚", reply_markup=main_menu_kb())
     except Exception as e:
-        bot.send_message(message.chat.id, f"⚠️ Ошибка при сохранении отзыва: {e}", reply_markup=main_menu_kb())
+        sender.send_message(message.chat.id, f"⚠️ Ошибка при сохранении отзыва: {e}", reply_markup=main_menu_kb())
 
 @bot.message_handler(commands=['reset'])
+@handler_metrics("cmd_reset")
 def cmd_reset(message):
-    user_conversations[message.chat.id] = []
-    save_persisted()
-    bot.send_message(message.chat.id, "История чат-бота сброшена.", reply_markup=main_menu_kb())
+    chat_store.clear_history(message.chat.id)
+    sender.send_message(message.chat.id, "История чат-бота сброшена.", reply_markup=main_menu_kb())
 
 @bot.message_handler(commands=['cancel'])
+@handler_metrics("cmd_cancel")
 def cmd_cancel(message):
     chat_id = message.chat.id
-    user_state.pop(chat_id, None)
-    save_persisted()
-    bot.send_message(chat_id, "Диалог завершён. Чем ещё помочь?", reply_markup=main_menu_kb())
+    steps.leave(chat_id)
+    chat_store.set_mode(chat_id, None)
+    sender.send_message(chat_id, "Диалог завершён. Чем ещё помочь?", reply_markup=main_menu_kb())
 
 @bot.message_handler(commands=['getchatid'])
+@handler_metrics("cmd_getchatid")
 def cmd_getchatid(message):
     # Сообщение видно только отправителю (reply) — не в группу
-    bot.reply_to(message, f"Chat ID (видно только вам): {message.chat.id}")
+    sender.send_message(message.chat.id, f"Chat ID (видно только вам): {message.chat.id}",
+                        reply_to_message_id=message.message_id)
 
 # ------------------ /info ------------------
 @bot.message_handler(commands=['get_info', 'info'])
+@handler_metrics("cmd_get_info")
 def cmd_get_info(message):
     markup = types.InlineKeyboardMarkup()
     markup.row(
         types.InlineKeyboardButton("Да", callback_data="info_yes"),
         types.InlineKeyboardButton("Нет", callback_data="info_no"),
     )
-    bot.send_message(message.chat.id, "Хотите узнать о возможностях?", reply_markup=markup)
+    sender.send_message(message.chat.id, "Хотите узнать о возможностях?", reply_markup=markup)
 
 @bot.callback_query_handler(func=lambda call: call.data in ('info_yes', 'info_no'))
+@handler_metrics("cb_info")
 def cb_info(call):
     if call.data == 'info_yes':
-        bot.send_message(call.message.chat.id, "Чем вам помочь?", reply_markup=main_menu_kb())
+        sender.send_message(call.message.chat.id, "Чем вам помочь?", reply_markup=main_menu_kb())
     else:
-        bot.send_message(call.message.chat.id, "Хорошего вам дня! 😉", reply_markup=main_menu_kb())
-
-# ------------------ Самопомощь (системный промпт) ------------------
-SELF_HELP_SYSTEM_PROMPT = (
-    "Ты — доброжелательный помощник по темам психологии, психотерапии, психиатрии и эмоциональной самопомощи.\n"
-    "Отвечай ТОЛЬКО в рамках этих тем. Если вопрос пользователя выходит за рамки (техника, финансы, политика, бытовое), "
-    "мягко верни к теме переживаний и задай уточняющий вопрос о самочувствии/эмоциях/ситуации.\n"
-    "Не ставь диагнозы и не давай медицинских назначений. Напоминай, что ответы не заменяют очную консультацию. "
-    "Если слышишь признаки неотложного риска, попроси немедленно обратиться к местным экстренным службам/горячей линии и к врачу. "
-    "Пиши коротко, тепло и простым языком; предлагай безопасные техники самопомощи."
-)
+        sender.send_message(call.message.chat.id, "Хорошего вам дня! 😉", reply_markup=main_menu_kb())
 
-def ensure_self_help_preamble(chat_id: int):
-    history = user_conversations.setdefault(chat_id, [])
-    if not history or history[0].get("role") != "system":
-        history.insert(0, {"role": "system", "content": SELF_HELP_SYSTEM_PROMPT})
-        user_conversations[chat_id] = history
-        save_persisted()
+# ------------------ Самопомощь (GPT-пул) ------------------
+gpt: GptPipeline = None
 
-# ------------------ Анонимизация: тикеты ------------------
-def _new_ticket_id() -> str:
-    # короткий, но уникальный: L-XXXXXX (hex)
-    return f"L-{token_hex(3).upper()}"
+# окно истории в пределах бюджета токенов + фоновое саммари старых реплик
+histories: HistoryManager = None
 
+def on_self_help_answer(chat_id: int, answer: str):
+    chat_store.append_message(chat_id, "assistant", answer)
+    histories.maybe_compact(chat_id)
+
+# ------------------ Анонимизация: тикеты ------------------
 def get_or_create_ticket(user_id: int) -> str:
-    t = user_ticket.get(user_id)
-    if t and ticket_index.get(t) == user_id:
-        return t
-    t = _new_ticket_id()
-    while t in ticket_index:
-        t = _new_ticket_id()
-    ticket_index[t] = user_id
-    user_ticket[user_id] = t
-    save_persisted()
-    return t
+    return chat_store.get_ticket(user_id) or create_fresh_ticket(chat_store, user_id)
 
 def create_fresh_ticket_for_user(user_id: int) -> str:
     """Всегда создаёт новый ticket для новой заявки пользователя.
        Старую привязку удаляем, чтобы не конфликтовать с UNIQUE(ticket)."""
-    old = user_ticket.get(user_id)
-    if old:
-        ticket_index.pop(old, None)
+    return create_fresh_ticket(chat_store, user_id)
 
-    t = _new_ticket_id()
-    while t in ticket_index:
-        t = _new_ticket_id()
+# ------------------ Табло очереди в группе ------------------
+# одно закреплённое сообщение со всеми ожидающими заявками вместо карточки на каждую;
+# карточки (TICKET_CARDS=1) остаются запасным вариантом; board — None при QUEUE_BOARD=0
+board: QueueBoard = None
+cards_enabled = False
 
-    user_ticket[user_id] = t
-    ticket_index[t] = user_id
-    save_persisted()
-    return t
+def publish_board(text: str, tickets: list):
+    markup = types.InlineKeyboardMarkup()
+    for ticket in tickets:
+        markup.add(types.InlineKeyboardButton(f"🎧 Взять {ticket}", callback_data=f"take_{ticket}"))
+    if board.message_id:
+        try:
+            sender.edit_message_text(text, ADMIN_GROUP_ID, board.message_id, reply_markup=markup,
+                                     priority=PRIORITY_LOW).result()
+            return
+        except Exception as e:
+            reason = board_error(e)
+            if reason == "not_modified":
+                return
+            if reason != "gone":
+                raise
+    # табло ещё нет или его удалили — новое сообщение, закрепляем без уведомления
+    message = sender.send_message(ADMIN_GROUP_ID, text, reply_markup=markup, priority=PRIORITY_LOW).result()
+    board.set_message(message.message_id)
+    sender.call("pin_chat_message", ADMIN_GROUP_ID, ADMIN_GROUP_ID, message.message_id,
+                disable_notification=True, priority=PRIORITY_LOW)
 
 # ------------------ Режим «слушатель» ------------------
 def start_listener(message):
     chat_id = message.chat.id
 
     # если уже есть активная сессия — не создаём новую
-    existing = db_get_active_session_for_user(chat_id)
-    if existing:
-        bot.send_message(
+    sync_routes(chat_id)
+    if routes.get(chat_id):
+        sender.send_message(
             chat_id,
             "У вас уже есть активная заявка/диалог. Дождитесь отклика слушателя.",
             reply_markup=exit_kb()
         )
         return
 
-    user_state[chat_id] = "waiting_listener"
-    save_persisted()
     log_request("слушатель", message.from_user)
 
-    # ВАЖНО: новый ticket на каждую заявку
-    ticket = create_fresh_ticket_for_user(chat_id)
-
-    # подстраховка от редких гонок/коллизий
+    # режим, тикет и сессия: одним коммитом, только когда всё в SQLite. Redis (USE_REDIS)
+    # и PostgreSQL (DB_ENGINE=postgres) в транзакцию db не входят — если сессия не
+    # создалась, режим ожидания снимаем сами, чтобы чат не завис в нём без заявки
     try:
-        db_create_session(ticket, chat_id)
-    except sqlite3.IntegrityError:
-        # если вдруг занято, генерим ещё раз
-        ticket = create_fresh_ticket_for_user(chat_id)
-        db_create_session(ticket, chat_id)
+        with db.transaction():
+            chat_store.set_mode(chat_id, "waiting_listener")
 
-    # уведомляем группу слушателей
-    try:
-        markup = types.InlineKeyboardMarkup()
-        markup.add(types.InlineKeyboardButton("🎧 Взять в работу", callback_data=f"take_{ticket}"))
-        bot.send_message(
-            ADMIN_GROUP_ID,
-            f"📩 <b>Новая заявка</b>\n"
-            f"🆔 Тикет: <code>{ticket}</code>\n"
-            f"Пользователь ожидает слушателя.\n\n"
-            f"Нажмите «Взять в работу», чтобы подключиться анонимно.",
-            parse_mode="HTML",
-            reply_markup=markup
-        )
-    except Exception as e:
-        # даже если в группу не отправилось, пользователю всё равно подтверждаем
-        print(f"⚠️ Ошибка при отправке заявки в группу: {e}")
+            # ВАЖНО: новый ticket на каждую заявку
+            ticket = create_fresh_ticket_for_user(chat_id)
+
+            # подстраховка от редких гонок/коллизий
+            try:
+                db_create_session(ticket, chat_id)
+            except sessions.IntegrityError:
+                # если вдруг занято, генерим ещё раз
+                ticket = create_fresh_ticket_for_user(chat_id)
+                db_create_session(ticket, chat_id)
+    except Exception:
+        chat_store.set_mode(chat_id, None)
+        raise
+    matcher.enqueue(ticket)
+    if board:
+        board.add(ticket)
+
+    # карточка заявки в группе (при табло — только если включены TICKET_CARDS);
+    # кнопка остаётся ручным переопределением автоподбора
+    if cards_enabled:
+        try:
+            markup = types.InlineKeyboardMarkup()
+            markup.add(types.InlineKeyboardButton("🎧 Взять в работу", callback_data=f"take_{ticket}"))
+            card = sender.send_message(
+                ADMIN_GROUP_ID,
+                f"📩 <b>Новая заявка</b>\n"
+                f"🆔 Тикет: <code>{ticket}</code>\n"
+                f"Пользователь ожидает слушателя.\n\n"
+                f"Нажмите «Взять в работу», чтобы подключиться анонимно.",
+                parse_mode="HTML",
+                reply_markup=markup,
+                priority=PRIORITY_LOW
+            )
+            card.add_done_callback(lambda f: remember_card(ticket, f))
+        except Exception as e:
+            # даже если в группу не отправилось, пользователю всё равно подтверждаем
+            print(f"⚠️ Ошибка при отправке заявки в группу: {e}")
 
-    bot.send_message(
+    sender.send_message(
         chat_id,
         "✅ Заявка отправлена. Когда слушатель подключится, начнётся анонимный диалог.",
         reply_markup=exit_kb()
     )
-    chat_id = message.chat.id
-    # если уже есть активная сессия — не создаём новую
-    existing = db_get_active_session_for_user(chat_id)
-    if existing:
-        bot.send_message(chat_id, "У вас уже есть активная заявка/диалог. Дождитесь отклика слушателя.", reply_markup=exit_kb())
-        return
+    run_matcher()
 
-    user_state[chat_id] = "waiting_listener"
-    save_persisted()
-    log_request("слушатель", message.from_user)
+# ------------------ Автоподбор слушателя ------------------
+# карточки заявок в группе: ticket -> (chat_id, message_id), чтобы отметить автоназначение
+ticket_cards = {}
 
-    ticket = get_or_create_ticket(chat_id)
-    db_create_session(ticket, chat_id)
+def remember_card(ticket: str, future):
+    if not future.exception() and routes.is_waiting(ticket):
+        ticket_cards[ticket] = (ADMIN_GROUP_ID, future.result().message_id)
 
-    # уведомляем группу слушателей
-    try:
-        markup = types.InlineKeyboardMarkup()
-        markup.add(types.InlineKeyboardButton("🎧 Взять в работу", callback_data=f"take_{ticket}"))
-        bot.send_message(
-            ADMIN_GROUP_ID,
-            f"📩 <b>Новая заявка</b>\n"
-            f"🆔 Тикет: <code>{ticket}</code>\n"
-            f"Пользователь ожидает слушателя.\n\n"
-            f"Нажмите «Взять в работу», чтобы подключиться анонимно.",
-            parse_mode="HTML",
-            reply_markup=markup
+def run_matcher():
+    """Раздаёт ожидающие заявки доступным слушателям (если включён AUTO_MATCH)."""
+    if not matcher.enabled:
+        return
+    for ticket, user_id, listener_id in matcher.match():
+        sender.send_message(user_id, "👂 Слушатель подключился. Всё анонимно.", reply_markup=exit_kb())
+        sender.send_message(
+            listener_id,
+            f"💬 Вам назначена заявка {ticket}. Общайтесь анонимно."
+            + (MULTI_DIALOG_HINT if routes.load(listener_id) > 1 else ""),
+            reply_markup=exit_kb()
         )
-    except Exception as e:
-        print(f"⚠️ Ошибка при отправке заявки в группу: {e}")
+        card = ticket_cards.pop(ticket, None)
+        if card:
+            sender.edit_message_text(f"✅ Заявка {ticket} назначена автоматически.", *card, priority=PRIORITY_LOW)
 
-    bot.send_message(
+def is_group_listener(user_id: int) -> bool:
+    try:
+        member = bot.get_chat_member(ADMIN_GROUP_ID, user_id)
+    except Exception:
+        return False
+    return member.status in ("creator", "administrator", "member")
+
+@bot.message_handler(commands=['listen'])
+@handler_metrics("cmd_listen")
+@needs_state
+def cmd_listen(message):
+    chat_id = message.chat.id
+    if message.chat.type != "private" or not is_group_listener(message.from_user.id):
+        return sender.send_message(chat_id, LISTENERS_ONLY_TEXT)
+    parts = (message.text or "").split()
+    capacity = int(parts[1]) if len(parts) > 1 and parts[1].isdigit() else None
+    capacity = matcher.set_available(chat_id, True, capacity)
+    sender.send_message(
         chat_id,
-        "✅ Заявка отправлена. Когда слушатель подключится, начнётся анонимный диалог.",
-        reply_markup=exit_kb()
+        f"🟢 Вы на связи. Одновременных диалогов: до {capacity}."
+        + ("" if matcher.enabled else "\nАвтоподбор выключен — заявки берутся кнопкой в группе.")
     )
+    run_matcher()
+
+@bot.message_handler(commands=['pause'])
+@handler_metrics("cmd_pause")
+@needs_state
+def cmd_pause(message):
+    if message.chat.type != "private" or not is_group_listener(message.from_user.id):
+        return sender.send_message(message.chat.id, LISTENERS_ONLY_TEXT)
+    matcher.set_available(message.chat.id, False)
+    sender.send_message(message.chat.id, "⏸ Новые заявки вам не назначаются. Текущие диалоги продолжаются.")
+
+# ------------------ Чистка зависших сессий, режимов и историй ------------------
+sweeper: ExpirySweeper = None
+
+def on_sessions_expired(expired: list):
+    for ticket, user_id, listener_id in expired:
+        if listener_id is None:
+            sender.send_message(user_id, SESSION_EXPIRED_WAITING_TEXT, reply_markup=main_menu_kb(),
+                                priority=PRIORITY_LOW)
+            card = ticket_cards.pop(ticket, None)
+            if card:
+                sender.edit_message_text(f"⌛ Заявка {ticket} истекла.", *card, priority=PRIORITY_LOW)
+            continue
+        sender.send_message(user_id, SESSION_EXPIRED_IDLE_TEXT, reply_markup=main_menu_kb(), priority=PRIORITY_LOW)
+        rest = routes.load(listener_id)
+        sender.send_message(listener_id, f"⌛ Диалог {ticket} давно без сообщений и завершён автоматически.",
+                            reply_markup=exit_kb() if rest else main_menu_kb(), priority=PRIORITY_LOW)
+    run_matcher()  # у слушателей освободились места
 
 # ------------------ Текст из пользовательского чата ------------------
+def sync_routes(chat_id: int):
+    """Маршруты чата, давно не сверявшиеся с базой, — из sessions (сессию мог открыть,
+       назначить или закрыть другой процесс бота)."""
+    routes.refresh(chat_id, sessions.open_for_chat)
+
+def select_route(message):
+    """Маршрут сообщения: reply на пересланное сообщение — его диалог, иначе — текущий. У слушателя
+       с несколькими диалогами без reply и явного выбора — None (см. RelayRoutes.resolve)."""
+    sync_routes(message.chat.id)
+    reply = message.reply_to_message
+    ticket = routes.ticket_for_message(message.chat.id, reply.message_id) if reply is not None else None
+    return routes.resolve(message.chat.id, ticket)
+
+def ask_dialog(chat_id: int):
+    """Несколько диалогов и не указано, какой: просим ответить на сообщение или выбрать кнопкой."""
+    markup = types.InlineKeyboardMarkup()
+    for ticket in routes.tickets(chat_id):
+        markup.add(types.InlineKeyboardButton(f"💬 Диалог {ticket}", callback_data=f"dlg_{ticket}"))
+    sender.send_message(chat_id, CHOOSE_DIALOG_TEXT, reply_markup=markup)
+
 @bot.message_handler(content_types=['text'])
+@handler_metrics("on_text")
+@needs_state
 def on_text(message):
     text = (message.text or "").strip()
     chat_id = message.chat.id
@@ -444,28 +529,30 @@ def on_text(message):
 
     # 1) Завершить диалог: СНАЧАЛА сбросить режим и закрыть возможную сессию
     if text == '❌ Завершить диалог':
-        # сбрасываем любой режим (в т.ч. self_help)
-        user_state.pop(chat_id, None)
-        save_persisted()
-
-        # закрываем активную анонимную сессию, если чат — участник
-        session = db_get_active_session_for_user(chat_id) or db_get_active_session_for_listener(chat_id)
-        if session:
-            _, ticket, user_id, listener_id, status, _ = session
-            db_close_session(ticket)
-            try:
-                if user_id:
-                    bot.send_message(user_id, "❌ Диалог завершён.", reply_markup=main_menu_kb())
-            except Exception:
-                pass
-            try:
-                # если вторая сторона есть и это не тот же чат
-                if listener_id and listener_id != user_id:
-                    bot.send_message(listener_id, "❌ Диалог завершён.", reply_markup=main_menu_kb())
-            except Exception:
-                pass
+        # сбрасываем любой режим (в т.ч. self_help) и закрываем активную
+        # анонимную сессию, если чат — участник; одним коммитом, когда всё в SQLite
+        # у слушателя с несколькими диалогами закрывается тот, на чьё сообщение ответили, или выбранный
+        route = select_route(message)
+        if route is None and routes.load(chat_id):
+            return ask_dialog(chat_id)
+        with db.transaction():
+            if routes.load(chat_id) <= 1:
+                chat_store.set_mode(chat_id, None)
+            if route:
+                db_close_session(route.ticket)
+
+        if route:
+            ticket_cards.pop(route.ticket, None)
+            counterpart_id = route.counterpart
+            rest = routes.load(chat_id)
+            sender.send_message(chat_id, f"❌ Диалог {route.ticket} завершён." if rest else "❌ Диалог завершён.",
+                                reply_markup=exit_kb() if rest else main_menu_kb())
+            # если вторая сторона есть и это не тот же чат
+            if counterpart_id and counterpart_id != chat_id:
+                sender.send_message(counterpart_id, "❌ Диалог завершён.", reply_markup=main_menu_kb())
+            run_matcher()  # у слушателя освободилось место
         else:
-            bot.send_message(chat_id, "Диалог завершён.", reply_markup=main_menu_kb())
+            sender.send_message(chat_id, "Диалог завершён.", reply_markup=main_menu_kb())
         return
 
     # 2) Пункты меню — ПРИОРИТЕТНЕЕ текущего state
@@ -473,89 +560,114 @@ def on_text(message):
         return start_listener(message)
 
     if text.startswith('Мне нужен специалист'):
-        return bot.send_message(
+        return sender.send_message(
             chat_id,
             "🔒 Опция «специалист» пока в разработке и будет доступна позже.",
             reply_markup=main_menu_kb()
         )
 
     if text == 'Мне нужен чат-бот':
-        user_state[chat_id] = "self_help"
-        ensure_self_help_preamble(chat_id)
-        return bot.send_message(
+        # системный промпт в историю не копируем — его добавляет histories.build_messages
+        chat_store.set_mode(chat_id, "self_help")
+        return sender.send_message(
             chat_id,
             "Что вас беспокоит? Пишите — я отвечу в рамках психологической поддержки.",
             reply_markup=exit_kb()
         )
 
     # 3) Роутинг по активной анонимной сессии (если есть)
-    session_u = db_get_active_session_for_user(chat_id)
-    session_l = db_get_active_session_for_listener(chat_id)
-    session = session_u or session_l
-    if session:
-        _, ticket, user_id, listener_id, status, _ = session
-        if status == "closed":
-            bot.send_message(chat_id, "Диалог уже завершён.", reply_markup=main_menu_kb())
-            return
-        if chat_id == user_id and listener_id:
-            bot.send_message(listener_id, f"👤 Пользователь: {text}", reply_markup=exit_kb())
-        elif chat_id == listener_id and user_id:
-            bot.send_message(user_id, f"🎧 Слушатель: {text}", reply_markup=exit_kb())
+    route = select_route(message)
+    if route is None and routes.load(chat_id):
+        return ask_dialog(chat_id)
+    if route:
+        routes.touch(route.ticket)
+        if route.role == "user" and route.counterpart:
+            # у слушателя несколько диалогов — подписываем тикет и запоминаем сообщение для reply
+            label = f"👤 Пользователь ({route.ticket})" if routes.load(route.counterpart) > 1 else "👤 Пользователь"
+            future = sender.send_message(route.counterpart, f"{label}: {text}", reply_markup=exit_kb(),
+                                         priority=PRIORITY_RELAY)
+            future.add_done_callback(
+                lambda f: f.exception() or routes.remember(route.counterpart, f.result().message_id, route.ticket)
+            )
+        elif route.role == "listener" and route.counterpart:
+            sender.send_message(route.counterpart, f"🎧 Слушатель: {text}", reply_markup=exit_kb(),
+                                priority=PRIORITY_RELAY)
         else:
-            bot.send_message(chat_id, "Ожидаем подключение второй стороны…", reply_markup=exit_kb())
+            sender.send_message(chat_id, "Ожидаем подключение второй стороны…", reply_markup=exit_kb())
         return
 
     # 4) Роутинг по режимам (после меню)
-    state = user_state.get(chat_id)
+    state = chat_store.get_mode(chat_id)
     if state == "self_help":
         return handle_self_help(message)
 
     # 5) Дефолт
-    bot.send_message(chat_id, "Я не знаю, что сказать..", reply_markup=main_menu_kb())
+    sender.send_message(chat_id, "Я не знаю, что сказать..", reply_markup=main_menu_kb())
+
+# ------------------ Медиа в анонимном диалоге ------------------
+@bot.message_handler(content_types=RELAY_CONTENT_TYPES + PRIVATE_CONTENT_TYPES)
+@handler_metrics("on_media")
+@needs_state
+def on_media(message):
+    chat_id = message.chat.id
+    route = select_route(message)
+    if route is None and routes.load(chat_id):
+        return ask_dialog(chat_id)
+    if not route:
+        return  # вне диалога медиа, как и раньше, не обрабатываем
+    routes.touch(route.ticket)
+    if message.content_type in PRIVATE_CONTENT_TYPES:
+        return sender.send_message(chat_id, PRIVATE_CONTENT_TEXT, reply_markup=exit_kb())
+    if not route.counterpart:
+        return sender.send_message(chat_id, "Ожидаем подключение второй стороны…", reply_markup=exit_kb())
+
+    # copy_message — без подписи «Переслано от»; у слушателя с несколькими диалогами
+    # подписываем тикет в подписи (где она есть) и запоминаем копию для reply
+    kwargs = {}
+    several = route.role == "user" and routes.load(route.counterpart) > 1
+    if several and message.content_type in CAPTION_CONTENT_TYPES:
+        kwargs["caption"] = f"👤 Пользователь ({route.ticket})" + (f": {message.caption}" if message.caption else "")
+    future = sender.copy_message(route.counterpart, chat_id, message.message_id, reply_markup=exit_kb(),
+                                 priority=PRIORITY_RELAY, **kwargs)
+    if route.role == "user":
+        future.add_done_callback(
+            lambda f: f.exception() or routes.remember(route.counterpart, f.result().message_id, route.ticket)
+        )
 
 # ------------------ Слушатель берёт заявку (в группе) ------------------
 @bot.callback_query_handler(func=lambda call: call.data.startswith('take_'))
+@handler_metrics("cb_take")
+@needs_state
 def cb_take(call):
     try:
         listener_id = call.from_user.id
         ticket = call.data.split('_', 1)[1]
 
-        # у слушателя не должно быть другой активной
-        if db_get_active_session_for_listener(listener_id):
-            bot.answer_callback_query(call.id, "❌ У вас уже есть активный диалог.")
+        # одна проверка-и-запись в базе: из одновременных нажатий выигрывает одно
+        user_id = db_claim_ticket(ticket, listener_id)
+        if user_id is None:
+            # причину берём из памяти, без повторных запросов
+            if routes.load(listener_id) >= matcher.capacity(listener_id):
+                bot.answer_callback_query(call.id, "❌ У вас уже максимум активных диалогов.")
+            else:
+                bot.answer_callback_query(call.id, "⚠️ Заявка уже занята или закрыта.")
             return
+        _ticket = ticket
+        ticket_cards.pop(_ticket, None)
 
-        row = db_get_by_ticket(ticket)
-        if not row:
-            bot.answer_callback_query(call.id, "⚠️ Заявка не найдена.")
-            return
-
-        _, _ticket, user_id, assigned_listener, status, _ = row
-        if status != "waiting":
-            bot.answer_callback_query(call.id, "⚠️ Заявка уже занята или закрыта.")
-            return
-
-        db_assign_listener(ticket, listener_id)
-
-        # Обновляем сообщение в группе (чтобы не нажимали повторно)
-        try:
-            bot.edit_message_text(
+        # Обновляем карточку в группе (чтобы не нажимали повторно); табло перерисуется само
+        if not board or call.message.id != board.message_id:
+            sender.edit_message_text(
                 f"✅ Заявка {_ticket} принята слушателем {call.from_user.first_name or '—'}.",
                 call.message.chat.id,
-                call.message.id
+                call.message.id,
+                priority=PRIORITY_LOW
             )
-        except Exception:
-            pass
 
-        # уведомляем стороны
-        try:
-            bot.send_message(user_id, "👂 Слушатель подключился. Всё анонимно.", reply_markup=exit_kb())
-        except Exception as e:
-            print(f"⚠️ Не удалось уведомить пользователя: {e}")
-        try:
-            bot.send_message(listener_id, f"💬 Вы подключены к пользователю (тикет {_ticket}). Общайтесь анонимно.", reply_markup=exit_kb())
-        except Exception as e:
-            print(f"⚠️ Не удалось уведомить слушателя: {e}")
+        # уведомляем стороны (ошибки доставки логирует очередь)
+        sender.send_message(user_id, "👂 Слушатель подключился. Всё анонимно.", reply_markup=exit_kb())
+        hint = MULTI_DIALOG_HINT if routes.load(listener_id) > 1 else ""
+        sender.send_message(listener_id, f"💬 Вы подключены к пользователю (тикет {_ticket}). Общайтесь анонимно.{hint}", reply_markup=exit_kb())
 
         bot.answer_callback_query(call.id, "Готово. Вы подключены.")
     except Exception as e:
@@ -564,77 +676,267 @@ def cb_take(call):
         except Exception:
             pass
 
+# ------------------ Слушатель выбирает диалог (несколько открытых) ------------------
+@bot.callback_query_handler(func=lambda call: call.data.startswith('dlg_'))
+@handler_metrics("cb_dialog")
+@needs_state
+def cb_dialog(call):
+    ticket = call.data.split('_', 1)[1]
+    sync_routes(call.message.chat.id)
+    if routes.select(call.message.chat.id, ticket) is None:
+        return bot.answer_callback_query(call.id, "Этот диалог уже завершён.")
+    bot.answer_callback_query(call.id, f"Сообщения без «Ответить» теперь уходят в диалог {ticket}.")
+
 # ------------------ Ответ через тикет (опционально для тебя) ------------------
 # Если захочешь — оставляю вспомогательный маршрут, чтобы модерация могла
 # адресно ответить тикету (не используется слушателями по умолчанию).
 @bot.callback_query_handler(func=lambda call: call.data.startswith('replyt_'))
+@handler_metrics("cb_reply_ticket")
 def cb_reply_ticket(call):
     try:
         ticket = call.data.split('_', 1)[1]
         row = db_get_by_ticket(ticket)
         if not row:
-            return bot.send_message(call.message.chat.id, "⚠️ Заявка не найдена (возможно завершена).")
-        bot.send_message(call.message.chat.id, f"✍️ Введите сообщение для заявки {ticket}")
-        bot.register_next_step_handler(call.message, lambda msg: forward_admin_reply_ticket(msg, ticket))
+            return sender.send_message(call.message.chat.id, "⚠️ Заявка не найдена (возможно завершена).")
+        sender.send_message(call.message.chat.id, f"✍️ Введите сообщение для заявки {ticket}")
+        steps.enter(call.message.chat.id, TICKET_REPLY_TEXT, ticket=ticket)
     except Exception as e:
-        bot.send_message(call.message.chat.id, f"⚠️ Ошибка: {e}")
+        sender.send_message(call.message.chat.id, f"⚠️ Ошибка: {e}")
 
+@handler_metrics("forward_admin_reply_ticket")
 def forward_admin_reply_ticket(message, ticket: str):
     row = db_get_by_ticket(ticket)
     if not row:
-        return bot.send_message(message.chat.id, "⚠️ Не удалось найти получателя (тикет неактуален).")
+        return sender.send_message(message.chat.id, "⚠️ Не удалось найти получателя (тикет неактуален).")
     _, _ticket, user_id, listener_id, status, _ = row
 
     # тут можно выбрать адресата: по умолчанию пользователь
     target_id = user_id
-    try:
-        bot.send_message(
-            target_id,
-            f"💬 <b>Сообщение по заявке {_ticket}:</b>\n\n{message.text}",
-            parse_mode='HTML',
-            reply_markup=exit_kb()
-        )
-        bot.send_message(message.chat.id, f"✅ Сообщение отправлено (заявка {_ticket})")
-    except Exception as e:
-        bot.send_message(message.chat.id, f"⚠️ Ошибка при отправке: {e}")
+    future = sender.send_message(
+        target_id,
+        f"💬 <b>Сообщение по заявке {_ticket}:</b>\n\n{message.text}",
+        parse_mode='HTML',
+        reply_markup=exit_kb()
+    )
+
+    def report(f):
+        if f.exception():
+            sender.send_message(message.chat.id, f"⚠️ Ошибка при отправке: {f.exception()}")
+        else:
+            sender.send_message(message.chat.id, f"✅ Сообщение отправлено (заявка {_ticket})")
+    future.add_done_callback(report)
+
+STEP_HANDLERS = {
+    FEEDBACK_TEXT: process_feedback,
+    TICKET_REPLY_TEXT: forward_admin_reply_ticket,
+}
 
 # ------------------ Самопомощь (GPT) ------------------
+@handler_metrics("handle_self_help")
 def handle_self_help(message):
     chat_id = message.chat.id
-    ensure_self_help_preamble(chat_id)
-    history = user_conversations.setdefault(chat_id, [])
-    history.append({"role": "user", "content": message.text})
-    save_persisted()
+    chat_store.append_message(chat_id, "user", message.text)
 
+    # ответ стримится в отдельном пуле — поток обработчика сразу свободен
     try:
-        response = openai.ChatCompletion.create(
-            model="gpt-4o-mini",
-            messages=history,
-            temperature=0.8,
-            max_tokens=500
+        gpt.submit(
+            chat_id,
+            build_messages=lambda: histories.build_messages(chat_id),
+            on_answer=lambda answer: on_self_help_answer(chat_id, answer),
+            reply_markup=exit_kb(),
         )
-        answer = response['choices'][0]['message']['content'].strip()
-        history.append({"role": "assistant", "content": answer})
-        save_persisted()
-        bot.send_message(chat_id, answer, reply_markup=exit_kb())
+    except GptRateLimitError:
+        sender.send_message(chat_id, GPT_RATE_LIMIT_TEXT, reply_markup=exit_kb())
+    except GptBusyError:
+        sender.send_message(chat_id, GPT_BUSY_TEXT, reply_markup=exit_kb())
+
+# ------------------ Метрики (/metrics) ------------------
+def metrics():
+    return REGISTRY.render(), 200, {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"}
+
+def start_metrics_server(port: int, host: str):
+    """/metrics — отдельный Flask в фоне на своём адресе: на публичный порт вебхука
+       метрики не попадают (по умолчанию METRICS_HOST=127.0.0.1)."""
+    from flask import Flask
+
+    app = Flask(__name__ + ".metrics")
+    app.add_url_rule("/metrics", "metrics", metrics)
+    threading.Thread(
+        target=lambda: app.run(host=host, port=port, threaded=True, use_reloader=False),
+        name="metrics-http", daemon=True,
+    ).start()
+
+def maybe_start_metrics():
+    metrics_port = int(os.getenv("METRICS_PORT", "0"))
+    if metrics_port:
+        with STARTUP.stage("metrics_http"):
+            start_metrics_server(metrics_port, os.getenv("METRICS_HOST", "127.0.0.1"))
+
+# ------------------ Приём апдейтов ------------------
+def handle_update(update):
+    try:
+        bot.process_new_updates([update])
     except Exception as e:
-        bot.send_message(chat_id, f"⚠️ Ошибка при обращении к OpenAI: {e}", reply_markup=exit_kb())
+        # ошибки хэндлеров — в лог; упавший апдейт не повторяем
+        print(f"⚠️ Ошибка хэндлера: {e}")
+    finally:
+        updates.done(update.update_id)
+
+def dispatch_updates(batch, payloads):
+    """Новые апдейты — в пул хэндлеров; payloads (исходный JSON) хранится, пока хэндлеры не закончат."""
+    for update in updates.accept(batch, payloads):
+        update_pool.submit(handle_update, update)
+
+def replay_pending():
+    """Апдейты, принятые до падения, но так и не обработанные, — заново в пул."""
+    pending = updates.pending()
+    if pending:
+        print(f"↩️ Необработанных апдейтов с прошлого запуска: {len(pending)}")
+        dispatch_updates([types.Update.de_json(payload) for _, payload in pending],
+                         [payload for _, payload in pending])
+
+# ------------------ Вебхук (Flask) ------------------
+WEBHOOK_PATH = "/telegram/webhook"
+
+def telegram_webhook():
+    from flask import abort, request
+
+    # без секрета любой POST выдал бы себя за любой чат — run_webhook без него не стартует
+    secret = config.tg_bot.webhook_secret.encode()
+    token = request.headers.get("X-Telegram-Bot-Api-Secret-Token", "").encode()
+    if not secret or not hmac.compare_digest(token, secret):
+        abort(403)
+    payload = request.get_data(as_text=True)
+    update = types.Update.de_json(payload)
+    if update is None:
+        abort(400)
+    # хэндлеры исполняются в update_pool — Telegram сразу получает 200 (апдейт уже
+    # в журнале); повтор того же апдейта (Telegram не дождался ответа) отбрасывается
+    dispatch_updates([update], [payload])
+    return ""
+
+def create_flask_app():
+    """Flask нужен только вебхуку — импортируем, когда он включён."""
+    from flask import Flask
+
+    app = Flask(__name__)
+    app.add_url_rule(WEBHOOK_PATH, "telegram_webhook", telegram_webhook, methods=["POST"])
+    return app
+
+def run_webhook():
+    tg = config.tg_bot
+    if not tg.webhook_secret:
+        raise SystemExit("WEBHOOK_SECRET не задан: без него вебхук принимает апдейты от кого угодно")
+    app = create_flask_app()
+    if tg.webhook_register:
+        with STARTUP.stage("webhook"):
+            bot.set_webhook(
+                url=tg.webhook_url.rstrip("/") + WEBHOOK_PATH,
+                secret_token=tg.webhook_secret,
+            )
+    maybe_start_metrics()
+    print(STARTUP.report("До приёма апдейтов"))
+    print(f"🤖 Psyinc запущен (webhook): {tg.webhook_url}, порт {tg.webhook_port}")
+    replay_pending()
+    app.run(host="0.0.0.0", port=tg.webhook_port, threaded=True)
+
+# ------------------ Сборка приложения ------------------
+def create_app():
+    """Поднимает сервисы по этапам (время каждого — в STARTUP). Маршруты, очередь
+       автоподбора и табло догружаются в фоне (warm_up), пока бот уже принимает апдейты;
+       хэндлеры, которым они нужны, ждут warmed (needs_state)."""
+    global sender, db, chat_store, sessions, routes, matcher, request_log, feedback_log
+    global gpt, histories, board, cards_enabled, sweeper, steps, updates, update_pool
+
+    STARTUP.mark("imports", STARTUP.since_start())
+
+    services = build_services(config, stage=STARTUP.stage)
+    db, chat_store, sessions, updates = services.db, services.chat_store, services.sessions, services.updates
+    routes, matcher, board, sweeper = services.routes, services.matcher, services.board, services.sweeper
+    cards_enabled = services.ticket_cards
+    request_log, feedback_log = services.request_log, services.feedback_log
+    # при выходе — дописать очереди журналов (SIGTERM тоже завершает через SystemExit)
+    atexit.register(feedback_log.stop)
+    atexit.register(request_log.stop)
+
+    with STARTUP.stage("telebot"):
+        steps = StepMachine(chat_store, STEP_HANDLERS)
+        update_pool = ThreadPoolExecutor(max_workers=int(os.getenv("UPDATE_WORKERS", "2")),
+                                         thread_name_prefix="updates")
+        sender = OutboundQueue(bot)
+        sender.start()
+        gpt = GptPipeline(
+            sender,
+            api_key=config.openai_api_key,
+            guard=services.guard,
+            busy_text=GPT_BUSY_TEXT,
+            max_workers=int(os.getenv("GPT_WORKERS", "8")),
+            edit_interval=float(os.getenv("GPT_EDIT_INTERVAL", "1.0")),
+        )
+        histories = services.create_histories(gpt)
 
-# ------------------ Запуск ------------------
-if __name__ == '__main__':
+    threading.Thread(target=warm_up, name="warm-up", daemon=True).start()
+
+def warm_up():
+    """Фоновый прогрев: маршруты открытых сессий, очередь автоподбора, табло; затем фоновые задачи."""
     try:
-        bot.remove_webhook()
-        time.sleep(1)
-    except Exception:
-        pass
+        with STARTUP.stage("warm_routes"):
+            rebuild_routes()
+            matcher.rebuild()
+        if board:
+            with STARTUP.stage("warm_board"):
+                board.rebuild()
+    except Exception as e:
+        print(f"⚠️ Ошибка прогрева состояния: {e}")
+    finally:
+        warmed.set()
+    if board:
+        board.start(publish_board)
+    sweeper.start(on_sessions_expired)
+    print(STARTUP.report("Прогрев завершён"))
 
-    print("🤖 Psyinc запущен: анонимные чаты (SQLite), GPT, логи, устойчивость сети")
+# ------------------ Запуск ------------------
+def poll_updates(timeout: int = 30, long_polling_timeout: int = 25):
+    """Long polling вместо infinity_polling(skip_pending=True): продолжает со
+       смещения из UpdateJournal, а не выбрасывает накопившееся за перезапуск.
+       Повторы и сообщения старше UPDATE_MAX_AGE отсеивает accept(); смещение
+       сохраняется, когда пачка уже в журнале, — недоделанное к падению
+       обработается заново (replay_pending). Ошибка любого шага (сеть, база
+       занята) — пауза и повтор с того же смещения, приём не прекращается."""
+    offset, replayed = updates.offset(), False
     while True:
         try:
-            # если доступно infinity_polling:
-            bot.infinity_polling(timeout=30, long_polling_timeout=25, skip_pending=True)
-            # если нет — используй:
-            # bot.polling(none_stop=True, interval=1, timeout=30, long_polling_timeout=25)
+            if not replayed:
+                replay_pending()
+                replayed = True
+            # исходный JSON нужен журналу — берём его из apihelper, а не из bot.get_updates
+            raw = apihelper.get_updates(bot.token, offset, None, timeout, None, long_polling_timeout)
+            if not raw:
+                continue
+            payloads = [json.dumps(item, ensure_ascii=False) for item in raw]
+            dispatch_updates([types.Update.de_json(item) for item in raw], payloads)
+            offset = raw[-1]["update_id"] + 1
+            updates.checkpoint(offset)
         except Exception as e:
             print(f"[Polling restart] {e}")
             time.sleep(5)
+
+if __name__ == '__main__':
+    # docker stop / systemd шлют SIGTERM: выходим через SystemExit, чтобы отработал atexit
+    signal.signal(signal.SIGTERM, lambda *_: sys.exit(0))
+    create_app()
+    if config.tg_bot.webhook_url:
+        run_webhook()
+        raise SystemExit
+
+    # вебхук снимаем один раз и без паузы: конфликт 409 переживёт повтор в poll_updates()
+    with STARTUP.stage("webhook"):
+        try:
+            bot.remove_webhook()
+        except Exception:
+            pass
+
+    maybe_start_metrics()
+    print(STARTUP.report("До приёма апдейтов"))
+    print("🤖 Psyinc запущен: анонимные чаты (SQLite), GPT, логи, устойчивость сети")
+    poll_updates()
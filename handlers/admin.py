@@ -1,10 +1,51 @@
 from aiogram import Dispatcher
-from aiogram.types import Message
+from aiogram.dispatcher import FSMContext
+from aiogram.types import CallbackQuery, Message
 
+from keyboards.menu import exit_kb
+from misc.states import TicketReply
+from services.async_db import AsyncDatabase
+from services.metrics import handler_metrics
 
-async def admin_start(message: Message):
-    await message.reply("Hello, admin!")
+
+# ------------------ Ответ через тикет ------------------
+# модерация может адресно написать пользователю заявки, не зная его chat_id
+@handler_metrics("cb_reply_ticket")
+async def admin_reply_ticket(call: CallbackQuery, db: AsyncDatabase, state: FSMContext):
+    sender = call.bot['sender']
+    ticket = call.data.split('_', 1)[1]
+    await call.answer()
+    if not await db.get_by_ticket(ticket):
+        await sender.send_message(call.message.chat.id, "⚠️ Заявка не найдена (возможно завершена).")
+        return
+    await TicketReply.text.set()
+    await state.update_data(ticket=ticket)
+    await sender.send_message(call.message.chat.id, f"✍️ Введите сообщение для заявки {ticket}")
+
+
+@handler_metrics("forward_admin_reply_ticket")
+async def admin_reply_ticket_text(message: Message, db: AsyncDatabase, state: FSMContext):
+    sender = message.bot['sender']
+    ticket = (await state.get_data()).get("ticket")
+    await state.finish()
+    row = await db.get_by_ticket(ticket)
+    if not row:
+        await sender.send_message(message.chat.id, "⚠️ Не удалось найти получателя (тикет неактуален).")
+        return
+    _, _ticket, user_id, listener_id, status, _ = row
+    try:
+        await sender.send_message(
+            user_id,
+            f"💬 <b>Сообщение по заявке {_ticket}:</b>\n\n{message.text}",
+            parse_mode='HTML',
+            reply_markup=exit_kb()
+        )
+    except Exception as e:
+        await sender.send_message(message.chat.id, f"⚠️ Ошибка при отправке: {e}")
+        return
+    await sender.send_message(message.chat.id, f"✅ Сообщение отправлено (заявка {_ticket})")
 
 
 def register_admin(dp: Dispatcher):
-    dp.register_message_handler(admin_start, commands=["start"], state="*", is_admin=True)
+    dp.register_callback_query_handler(admin_reply_ticket, text_startswith="replyt_", is_admin=True)
+    dp.register_message_handler(admin_reply_ticket_text, state=TicketReply.text, is_admin=True)
@@ -1,28 +1,17 @@
-from aiogram import types, Dispatcher
-from aiogram.dispatcher import FSMContext
-from aiogram.utils.markdown import hcode
+from aiogram import Dispatcher, types
 
+from keyboards.menu import main_menu_kb
+from services.metrics import handler_metrics
 
-async def bot_echo(message: types.Message):
-    text = [
-        "Эхо без состояния.",
-        "Сообщение:",
-        message.text
-    ]
-
-    await message.answer('\n'.join(text))
 
-
-async def bot_echo_all(message: types.Message, state: FSMContext):
-    state_name = await state.get_state()
-    text = [
-        f'Эхо в состоянии {hcode(state_name)}',
-        'Содержание сообщения:',
-        hcode(message.text)
-    ]
-    await message.answer('\n'.join(text))
+@handler_metrics("fallback")
+async def bot_echo(message: types.Message):
+    # Команды без своего хендлера молча пропускаем, как и раньше
+    if message.is_command():
+        return
+    await message.bot['sender'].send_message(message.chat.id, "Я не знаю, что сказать..",
+                                             reply_markup=main_menu_kb())
 
 
 def register_echo(dp: Dispatcher):
     dp.register_message_handler(bot_echo)
-    dp.register_message_handler(bot_echo_all, state="*", content_types=types.ContentTypes.ANY)
@@ -0,0 +1,305 @@
+from aiogram import Dispatcher
+from aiogram.types import CallbackQuery, Message
+
+from keyboards.menu import dialogs_kb, exit_kb, main_menu_kb, queue_board_kb, take_ticket_kb
+from misc.texts import (BTN_END_DIALOG, BTN_LISTENER, CHOOSE_DIALOG_TEXT, LISTENERS_ONLY_TEXT, MULTI_DIALOG_HINT,
+                        PRIVATE_CONTENT_TEXT, SESSION_EXPIRED_IDLE_TEXT, SESSION_EXPIRED_WAITING_TEXT)
+from services.async_db import AsyncDatabase
+from services.board import board_error
+from services.metrics import handler_metrics
+from services.routing import CAPTION_CONTENT_TYPES, PRIVATE_CONTENT_TYPES, RELAY_CONTENT_TYPES
+from services.sender import PRIORITY_LOW, PRIORITY_RELAY
+
+
+def reply_ticket(message: Message, db: AsyncDatabase):
+    """Тикет диалога, на пересланное сообщение которого ответили (reply), или None."""
+    reply = message.reply_to_message
+    return db.routes.ticket_for_message(message.chat.id, reply.message_id) if reply else None
+
+
+def current_route(message: Message, db: AsyncDatabase):
+    """Маршрут сообщения: reply на пересланное сообщение — его диалог, иначе — текущий. У слушателя
+       с несколькими диалогами без reply и явного выбора — None (см. RelayRoutes.resolve)."""
+    return db.routes.resolve(message.chat.id, reply_ticket(message, db))
+
+
+async def ask_dialog(message: Message, db: AsyncDatabase):
+    """Несколько диалогов и не указано, какой: просим ответить на сообщение или выбрать кнопкой."""
+    await message.bot['sender'].send_message(message.chat.id, CHOOSE_DIALOG_TEXT,
+                                             reply_markup=dialogs_kb(db.routes.tickets(message.chat.id)))
+
+
+async def run_matcher(bot, db: AsyncDatabase):
+    """Раздаёт ожидающие заявки доступным слушателям (если включён AUTO_MATCH)."""
+    if not bot['auto_match']:
+        return
+    sender = bot['sender']
+    for ticket, user_id, listener_id in await db.match():
+        await sender.send_message(user_id, "👂 Слушатель подключился. Всё анонимно.", reply_markup=exit_kb())
+        hint = MULTI_DIALOG_HINT if db.routes.load(listener_id) > 1 else ""
+        await sender.send_message(listener_id, f"💬 Вам назначена заявка {ticket}. Общайтесь анонимно.{hint}",
+                                  reply_markup=exit_kb())
+
+
+async def notify_expired(bot, db: AsyncDatabase, expired: list):
+    """Уведомляет стороны сессий, закрытых ExpirySweeper."""
+    sender = bot['sender']
+    for ticket, user_id, listener_id in expired:
+        if listener_id is None:
+            await sender.send_message(user_id, SESSION_EXPIRED_WAITING_TEXT, reply_markup=main_menu_kb(),
+                                      priority=PRIORITY_LOW)
+            continue
+        await sender.send_message(user_id, SESSION_EXPIRED_IDLE_TEXT, reply_markup=main_menu_kb(),
+                                  priority=PRIORITY_LOW)
+        await sender.send_message(listener_id, f"⌛ Диалог {ticket} давно без сообщений и завершён автоматически.",
+                                  reply_markup=exit_kb() if db.routes.load(listener_id) else main_menu_kb(),
+                                  priority=PRIORITY_LOW)
+    await run_matcher(bot, db)
+
+
+async def publish_board(bot, db: AsyncDatabase, text: str, tickets: list):
+    """Правит закреплённое табло очереди; если его нет или удалили — создаёт и закрепляет новое."""
+    sender, board = bot['sender'], bot['board']
+    if board.message_id:
+        try:
+            await sender.edit_message_text(text, board.chat_id, board.message_id,
+                                           reply_markup=queue_board_kb(tickets), priority=PRIORITY_LOW)
+            return
+        except Exception as e:
+            reason = board_error(e)
+            if reason == "not_modified":
+                return
+            if reason != "gone":
+                raise
+    message = await sender.send_message(board.chat_id, text, reply_markup=queue_board_kb(tickets),
+                                        priority=PRIORITY_LOW)
+    await db.run("set_board", board.set_message, message.message_id)
+    try:
+        await sender.call("pin_chat_message", board.chat_id, board.chat_id, message.message_id,
+                          disable_notification=True, priority=PRIORITY_LOW)
+    except Exception:
+        pass  # без прав на закрепление табло просто не закреплено
+
+
+async def in_dialog(message: Message) -> bool:
+    """Фильтр: у чата есть открытая анонимная сессия (поиск в памяти, сверка с базой раз в
+       ROUTES_TTL). Команды не пересылаем."""
+    if message.is_command():
+        return False
+    db = message.bot['db']
+    await db.sync_routes(message.chat.id)
+    return db.routes.get(message.chat.id) is not None
+
+
+@handler_metrics("start_listener")
+async def listener_request(message: Message, db: AsyncDatabase):
+    bot = message.bot
+    sender = bot['sender']
+    chat_id = message.chat.id
+
+    # если уже есть активная сессия — не создаём новую
+    await db.sync_routes(chat_id)
+    if db.routes.get(chat_id):
+        await sender.send_message(chat_id, "У вас уже есть активная заявка/диалог. Дождитесь отклика слушателя.",
+                                  reply_markup=exit_kb())
+        return
+
+    user = message.from_user
+    bot['request_log'].log(
+        "request",
+        type="слушатель",
+        name=f"{user.first_name or ''} {user.last_name or ''}".strip(),
+        username=user.username,
+        chat_id=user.id,
+    )
+    ticket = await db.open_ticket(chat_id)
+    if bot['board']:
+        bot['board'].add(ticket)
+
+    # карточка в группе (при табло — только с TICKET_CARDS); даже если не отправилась, пользователю подтверждаем
+    if bot['ticket_cards']:
+        try:
+            await sender.send_message(
+                bot['config'].tg_bot.admin_group_id,
+                f"📩 <b>Новая заявка</b>\n"
+                f"🆔 Тикет: <code>{ticket}</code>\n"
+                f"Пользователь ожидает слушателя.\n\n"
+                f"Нажмите «Взять в работу», чтобы подключиться анонимно.",
+                parse_mode="HTML",
+                reply_markup=take_ticket_kb(ticket),
+                priority=PRIORITY_LOW
+            )
+        except Exception as e:
+            print(f"⚠️ Ошибка при отправке заявки в группу: {e}")
+
+    await sender.send_message(
+        chat_id,
+        "✅ Заявка отправлена. Когда слушатель подключится, начнётся анонимный диалог.",
+        reply_markup=exit_kb()
+    )
+    await run_matcher(bot, db)
+
+
+@handler_metrics("end_dialog")
+async def listener_end_dialog(message: Message, db: AsyncDatabase):
+    # сбрасываем любой режим (в т.ч. self_help) и закрываем активную сессию, если чат — участник
+    sender = message.bot['sender']
+    chat_id = message.chat.id
+    # у слушателя с несколькими диалогами закрывается тот, на чьё сообщение ответили, или выбранный
+    route = await db.end_dialog(chat_id, reply_ticket(message, db))
+    if route is None and db.routes.load(chat_id):
+        await ask_dialog(message, db)
+        return
+    if route is None:
+        await sender.send_message(chat_id, "Диалог завершён.", reply_markup=main_menu_kb())
+        return
+    if db.routes.load(chat_id):
+        await sender.send_message(chat_id, f"❌ Диалог {route.ticket} завершён.", reply_markup=exit_kb())
+    else:
+        await sender.send_message(chat_id, "❌ Диалог завершён.", reply_markup=main_menu_kb())
+    if route.counterpart and route.counterpart != chat_id:
+        await sender.send_message(route.counterpart, "❌ Диалог завершён.", reply_markup=main_menu_kb())
+    await run_matcher(message.bot, db)  # у слушателя освободилось место
+
+
+@handler_metrics("relay")
+async def listener_relay(message: Message, db: AsyncDatabase):
+    sender = message.bot['sender']
+    route = current_route(message, db)
+    if route is None:
+        if db.routes.load(message.chat.id):
+            await ask_dialog(message, db)
+        return  # иначе сессию закрыли между фильтром и хендлером
+    db.routes.touch(route.ticket)
+    if not route.counterpart:
+        await sender.send_message(message.chat.id, "Ожидаем подключение второй стороны…", reply_markup=exit_kb())
+        return
+    if route.role == "listener":
+        await sender.send_message(route.counterpart, f"🎧 Слушатель: {message.text}", reply_markup=exit_kb(),
+                                  priority=PRIORITY_RELAY)
+        return
+    # у слушателя несколько диалогов — подписываем тикет и запоминаем сообщение для reply
+    label = f"👤 Пользователь ({route.ticket})" if db.routes.load(route.counterpart) > 1 else "👤 Пользователь"
+    sent = await sender.send_message(route.counterpart, f"{label}: {message.text}", reply_markup=exit_kb(),
+                                     priority=PRIORITY_RELAY)
+    db.routes.remember(route.counterpart, sent.message_id, route.ticket)
+
+
+@handler_metrics("relay_media")
+async def listener_relay_media(message: Message, db: AsyncDatabase):
+    sender = message.bot['sender']
+    route = current_route(message, db)
+    if route is None:
+        if db.routes.load(message.chat.id):
+            await ask_dialog(message, db)
+        return
+    db.routes.touch(route.ticket)
+    if message.content_type in PRIVATE_CONTENT_TYPES:
+        await sender.send_message(message.chat.id, PRIVATE_CONTENT_TEXT, reply_markup=exit_kb())
+        return
+    if not route.counterpart:
+        await sender.send_message(message.chat.id, "Ожидаем подключение второй стороны…", reply_markup=exit_kb())
+        return
+    # copy_message — без «Переслано от» и без скачивания файла к нам
+    kwargs = {}
+    several = route.role == "user" and db.routes.load(route.counterpart) > 1
+    if several and message.content_type in CAPTION_CONTENT_TYPES:
+        kwargs["caption"] = f"👤 Пользователь ({route.ticket})" + (f": {message.caption}" if message.caption else "")
+    sent = await sender.copy_message(route.counterpart, message.chat.id, message.message_id,
+                                     reply_markup=exit_kb(), priority=PRIORITY_RELAY, **kwargs)
+    if route.role == "user":
+        db.routes.remember(route.counterpart, sent.message_id, route.ticket)
+
+
+@handler_metrics("cb_take")
+async def listener_take(call: CallbackQuery, db: AsyncDatabase):
+    sender = call.bot['sender']
+    listener_id = call.from_user.id
+    ticket = call.data.split('_', 1)[1]
+
+    # одна проверка-и-запись в базе: из одновременных нажатий выигрывает одно
+    user_id = await db.claim(ticket, listener_id)
+    if user_id is None:
+        if db.routes.load(listener_id) >= db.matcher.capacity(listener_id):
+            await call.answer("❌ У вас уже максимум активных диалогов.")
+        else:
+            await call.answer("⚠️ Заявка уже занята или закрыта.")
+        return
+
+    await call.answer("Готово. Вы подключены.")
+    await sender.send_message(user_id, "👂 Слушатель подключился. Всё анонимно.", reply_markup=exit_kb())
+    hint = MULTI_DIALOG_HINT if db.routes.load(listener_id) > 1 else ""
+    await sender.send_message(listener_id,
+                              f"💬 Вы подключены к пользователю (тикет {ticket}). Общайтесь анонимно.{hint}",
+                              reply_markup=exit_kb())
+
+    # карточка в группе — после сторон диалога: у группы свой, более строгий лимит;
+    # табло не трогаем — оно перерисуется само
+    board = call.bot['board']
+    if board and call.message.message_id == board.message_id:
+        return
+    try:
+        await sender.edit_message_text(
+            f"✅ Заявка {ticket} принята слушателем {call.from_user.first_name or '—'}.",
+            call.message.chat.id,
+            call.message.message_id,
+            priority=PRIORITY_LOW
+        )
+    except Exception:
+        pass
+
+
+@handler_metrics("cb_dialog")
+async def listener_choose_dialog(call: CallbackQuery, db: AsyncDatabase):
+    ticket = call.data.split('_', 1)[1]
+    await db.sync_routes(call.message.chat.id)
+    if db.routes.select(call.message.chat.id, ticket) is None:
+        await call.answer("Этот диалог уже завершён.")
+        return
+    await call.answer(f"Сообщения без «Ответить» теперь уходят в диалог {ticket}.")
+
+
+async def is_group_listener(message: Message) -> bool:
+    """Фильтр: личный чат и отправитель состоит в группе слушателей."""
+    if message.chat.type != "private":
+        return False
+    try:
+        member = await message.bot.get_chat_member(message.bot['config'].tg_bot.admin_group_id, message.from_user.id)
+    except Exception:
+        return False
+    return member.status in ("creator", "administrator", "member")
+
+
+@handler_metrics("cmd_listen")
+async def listener_listen(message: Message, db: AsyncDatabase):
+    args = message.get_args()
+    capacity = await db.set_listener(message.chat.id, True, int(args) if args.isdigit() else None)
+    note = "" if message.bot['auto_match'] else "\nАвтоподбор выключен — заявки берутся кнопкой в группе."
+    await message.bot['sender'].send_message(message.chat.id,
+                                             f"🟢 Вы на связи. Одновременных диалогов: до {capacity}.{note}")
+    await run_matcher(message.bot, db)
+
+
+@handler_metrics("cmd_pause")
+async def listener_pause(message: Message, db: AsyncDatabase):
+    await db.set_listener(message.chat.id, False)
+    await message.bot['sender'].send_message(message.chat.id,
+                                             "⏸ Новые заявки вам не назначаются. Текущие диалоги продолжаются.")
+
+
+@handler_metrics("cmd_listen_denied")
+async def listener_denied(message: Message):
+    await message.bot['sender'].send_message(message.chat.id, LISTENERS_ONLY_TEXT)
+
+
+def register_listener(dp: Dispatcher):
+    dp.register_message_handler(listener_listen, is_group_listener, commands=["listen"])
+    dp.register_message_handler(listener_pause, is_group_listener, commands=["pause"])
+    dp.register_message_handler(listener_denied, commands=["listen", "pause"])
+    dp.register_message_handler(listener_end_dialog, text=BTN_END_DIALOG)
+    dp.register_message_handler(listener_request, text=BTN_LISTENER)
+    dp.register_callback_query_handler(listener_take, text_startswith="take_")
+    dp.register_callback_query_handler(listener_choose_dialog, text_startswith="dlg_")
+    dp.register_message_handler(listener_relay, in_dialog, content_types=["text"])
+    dp.register_message_handler(listener_relay_media, in_dialog,
+                                content_types=RELAY_CONTENT_TYPES + PRIVATE_CONTENT_TYPES)
@@ -0,0 +1,50 @@
+from aiogram import Dispatcher
+from aiogram.types import Message
+
+from keyboards.menu import exit_kb
+from services.async_db import AsyncDatabase
+from misc.texts import GPT_BUSY_TEXT, GPT_RATE_LIMIT_TEXT
+from services.gpt_guard import GptBusyError, GptRateLimitError, GptUnavailableError
+from services.metrics import handler_metrics
+
+
+async def in_self_help(message: Message) -> bool:
+    """Фильтр: чат в режиме самопомощи (режим читается через пул БД). Команды — не вопрос к GPT."""
+    if message.is_command():
+        return False
+    return await message.bot['db'].get_mode(message.chat.id) == "self_help"
+
+
+@handler_metrics("handle_self_help")
+async def self_help_message(message: Message, db: AsyncDatabase):
+    bot = message.bot
+    chat_id = message.chat.id
+    histories = bot['histories']
+    await db.append_message(chat_id, "user", message.text)
+
+    # ожидание ответа — корутина, а не поток: тысячи таких чатов держит один event loop
+    try:
+        answer = await bot['gpt'].answer(
+            chat_id,
+            build_messages=lambda: db.run("build_messages", histories.build_messages, chat_id),
+            reply_markup=exit_kb(),
+        )
+    except GptRateLimitError:
+        await bot['sender'].send_message(chat_id, GPT_RATE_LIMIT_TEXT, reply_markup=exit_kb())
+        return
+    except GptBusyError:
+        await bot['sender'].send_message(chat_id, GPT_BUSY_TEXT, reply_markup=exit_kb())
+        return
+    except GptUnavailableError:
+        # OpenAI сейчас недоступен (предохранитель) — заготовленный ответ самопомощи
+        await bot['sender'].send_message(chat_id, bot['gpt'].guard.fallback(), reply_markup=exit_kb())
+        return
+    except Exception:
+        return  # ошибка уже показана в сообщении-заглушке
+
+    await db.append_message(chat_id, "assistant", answer)
+    histories.maybe_compact(chat_id)
+
+
+def register_self_help(dp: Dispatcher):
+    dp.register_message_handler(self_help_message, in_self_help, content_types=["text"])
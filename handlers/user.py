@@ -1,10 +1,143 @@
 from aiogram import Dispatcher
-from aiogram.types import Message
+from aiogram.dispatcher import FSMContext
+from aiogram.types import CallbackQuery, Message
 
+from keyboards.menu import exit_kb, info_kb, main_menu_kb, remove_kb
+from misc.states import FeedbackForm
+from misc.texts import ABOUT_TEXT, BTN_CHAT_BOT, HELP_TEXT, WELCOME_TEXT
+from services.async_db import AsyncDatabase
+from services.metrics import handler_metrics
+from services.sender import PRIORITY_LOW
 
-async def user_start(message: Message):
-    await message.reply("Hello, user!")
+
+@handler_metrics("cmd_start")
+async def user_start(message: Message, db: AsyncDatabase, state: FSMContext):
+    await state.finish()
+    await db.set_mode(message.chat.id, None)
+    await message.bot['sender'].send_message(message.chat.id, WELCOME_TEXT, parse_mode='HTML',
+                                             reply_markup=main_menu_kb())
+
+
+@handler_metrics("cmd_help")
+async def user_help(message: Message):
+    await message.bot['sender'].send_message(message.chat.id, HELP_TEXT)
+
+
+@handler_metrics("cmd_about")
+async def user_about(message: Message):
+    await message.bot['sender'].send_message(message.chat.id, ABOUT_TEXT, parse_mode='HTML')
+
+
+@handler_metrics("cmd_settings")
+async def user_settings(message: Message):
+    await message.bot['sender'].send_message(message.chat.id, "Настройки пока не реализованы.",
+                                             reply_markup=main_menu_kb())
+
+
+@handler_metrics("cmd_reset")
+async def user_reset(message: Message, db: AsyncDatabase):
+    await db.clear_history(message.chat.id)
+    await message.bot['sender'].send_message(message.chat.id, "История чат-бота сброшена.",
+                                             reply_markup=main_menu_kb())
+
+
+@handler_metrics("cmd_cancel")
+async def user_cancel(message: Message, db: AsyncDatabase, state: FSMContext):
+    await state.finish()
+    await db.set_mode(message.chat.id, None)
+    await message.bot['sender'].send_message(message.chat.id, "Диалог завершён. Чем ещё помочь?",
+                                             reply_markup=main_menu_kb())
+
+
+@handler_metrics("cmd_getchatid")
+async def user_getchatid(message: Message):
+    # Сообщение видно только отправителю (reply) — не в группу
+    await message.bot['sender'].send_message(message.chat.id, f"Chat ID (видно только вам): {message.chat.id}",
+                                             reply_to_message_id=message.message_id)
+
+
+@handler_metrics("cmd_get_info")
+async def user_info(message: Message):
+    await message.bot['sender'].send_message(message.chat.id, "Хотите узнать о возможностях?",
+                                             reply_markup=info_kb())
+
+
+@handler_metrics("cb_info")
+async def user_info_answer(call: CallbackQuery):
+    text = "Чем вам помочь?" if call.data == 'info_yes' else "Хорошего вам дня! 😉"
+    await call.bot['sender'].send_message(call.message.chat.id, text, reply_markup=main_menu_kb())
+    await call.answer()
+
+
+# ------------------ Отзыв ------------------
+@handler_metrics("cmd_feedback")
+async def user_feedback(message: Message):
+    await FeedbackForm.text.set()
+    await message.bot['sender'].send_message(message.chat.id, "Пожалуйста, введите свой отзыв:",
+                                             reply_markup=remove_kb())
+
+
+@handler_metrics("process_feedback")
+async def user_feedback_text(message: Message, state: FSMContext):
+    await state.finish()
+    bot = message.bot
+    feedback_text = (message.text or "").strip()
+    bot['feedback_log'].log(
+        "feedback",
+        name=f"{message.from_user.first_name or ''} {message.from_user.last_name or ''}".strip(),
+        username=message.from_user.username,
+        chat_id=message.chat.id,
+        text=feedback_text,
+    )
+
+    # Дополнительно шлём в группу слушателей (без раскрытия личности пользователя)
+    group_id = bot['config'].tg_bot.admin_group_id
+    if group_id:
+        try:
+            await bot['sender'].send_message(group_id, f"📬 <b>Новый отзыв</b>\n\n💬 {feedback_text}",
+                                             parse_mode='HTML', priority=PRIORITY_LOW)
+        except Exception:
+            pass  # уже залогировано очередью; отзыв сохранён в журнале
+
+    await bot['sender'].send_message(message.chat.id, "Спасибо за обратную связь! Ваш отзыв сохранён 💚",
+                                     reply_markup=main_menu_kb())
+
+
+# ------------------ Пункты меню ------------------
+@handler_metrics("menu_specialist")
+async def user_specialist(message: Message):
+    await message.bot['sender'].send_message(
+        message.chat.id,
+        "🔒 Опция «специалист» пока в разработке и будет доступна позже.",
+        reply_markup=main_menu_kb()
+    )
+
+
+@handler_metrics("menu_chat_bot")
+async def user_chat_bot(message: Message, db: AsyncDatabase):
+    # системный промпт общий — его добавляет HistoryManager.build_messages
+    await db.set_mode(message.chat.id, "self_help")
+    await message.bot['sender'].send_message(
+        message.chat.id,
+        "Что вас беспокоит? Пишите — я отвечу в рамках психологической поддержки.",
+        reply_markup=exit_kb()
+    )
 
 
 def register_user(dp: Dispatcher):
     dp.register_message_handler(user_start, commands=["start"], state="*")
+    dp.register_message_handler(user_cancel, commands=["cancel"], state="*")
+    dp.register_message_handler(user_help, commands=["help"])
+    dp.register_message_handler(user_about, commands=["about"])
+    dp.register_message_handler(user_settings, commands=["settings"])
+    dp.register_message_handler(user_reset, commands=["reset"])
+    dp.register_message_handler(user_getchatid, commands=["getchatid"])
+    dp.register_message_handler(user_info, commands=["get_info", "info"])
+    dp.register_callback_query_handler(user_info_answer, text=["info_yes", "info_no"])
+
+    dp.register_message_handler(user_feedback, commands=["feedback"])
+    dp.register_message_handler(user_feedback_text, state=FeedbackForm.text)
+
+    # пункты меню приоритетнее текущего диалога
+    dp.register_message_handler(user_specialist, text_startswith="Мне нужен специалист")
+    dp.register_message_handler(user_chat_bot, text=BTN_CHAT_BOT)
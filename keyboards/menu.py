@@ -0,0 +1,50 @@
+from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup, ReplyKeyboardMarkup, ReplyKeyboardRemove
+
+from misc.texts import BTN_CHAT_BOT, BTN_END_DIALOG, BTN_LISTENER, BTN_SPECIALIST
+
+
+def main_menu_kb() -> ReplyKeyboardMarkup:
+    kb = ReplyKeyboardMarkup(resize_keyboard=True)
+    kb.row(BTN_LISTENER)
+    kb.row(BTN_SPECIALIST)
+    kb.row(BTN_CHAT_BOT)
+    return kb
+
+
+def exit_kb() -> ReplyKeyboardMarkup:
+    kb = ReplyKeyboardMarkup(resize_keyboard=True, selective=True)
+    kb.row(BTN_END_DIALOG)
+    return kb
+
+
+def remove_kb() -> ReplyKeyboardRemove:
+    return ReplyKeyboardRemove()
+
+
+def info_kb() -> InlineKeyboardMarkup:
+    kb = InlineKeyboardMarkup()
+    kb.row(
+        InlineKeyboardButton("Да", callback_data="info_yes"),
+        InlineKeyboardButton("Нет", callback_data="info_no"),
+    )
+    return kb
+
+
+def take_ticket_kb(ticket: str) -> InlineKeyboardMarkup:
+    kb = InlineKeyboardMarkup()
+    kb.add(InlineKeyboardButton("🎧 Взять в работу", callback_data=f"take_{ticket}"))
+    return kb
+
+
+def dialogs_kb(tickets: list) -> InlineKeyboardMarkup:
+    kb = InlineKeyboardMarkup()
+    for ticket in tickets:
+        kb.add(InlineKeyboardButton(f"💬 Диалог {ticket}", callback_data=f"dlg_{ticket}"))
+    return kb
+
+
+def queue_board_kb(tickets: list) -> InlineKeyboardMarkup:
+    kb = InlineKeyboardMarkup()
+    for ticket in tickets:
+        kb.add(InlineKeyboardButton(f"🎧 Взять {ticket}", callback_data=f"take_{ticket}"))
+    return kb
@@ -0,0 +1,35 @@
+import logging
+
+from aiogram.dispatcher.handler import CancelHandler
+from aiogram.dispatcher.middlewares import BaseMiddleware
+
+logger = logging.getLogger(__name__)
+
+
+class UpdateJournalMiddleware(BaseMiddleware):
+    """Повторно доставленные и устаревшие апдейты не доходят до хэндлеров (services/updates.py).
+
+    Смещение aiogram ведёт сам: start_polling без skip_updates продолжает
+    с первого не подтверждённого Telegram апдейта. Обработанным апдейт
+    отмечается после хэндлеров; принятые, но не обработанные к падению
+    апдейты main() отдаёт хэндлерам заново (replay_pending).
+    """
+
+    def __init__(self, journal):
+        super().__init__()
+        self.journal = journal
+
+    async def on_pre_process_update(self, update, data):
+        db = update.bot.get('db')
+        try:
+            fresh = await db.run("accept_update", self.journal.accept, [update], [update.as_json()])
+        except Exception:
+            # журнал недоступен (база занята) — лучше возможный повтор, чем потерянное сообщение
+            logger.exception("Update journal accept failed")
+            return
+        if not fresh:
+            raise CancelHandler()
+
+    async def on_post_process_update(self, update, results, data):
+        # вызывается и после исключения в хэндлере: упавший апдейт не повторяем
+        await update.bot.get('db').run("update_done", self.journal.done, update.update_id)
@@ -0,0 +1,9 @@
+from aiogram.dispatcher.filters.state import State, StatesGroup
+
+
+class FeedbackForm(StatesGroup):
+    text = State()
+
+
+class TicketReply(StatesGroup):
+    text = State()
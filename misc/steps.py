@@ -0,0 +1,5 @@
+from services.steps import Step
+
+# шаги диалогов bot_v03.py (telebot); имена — как у состояний aiogram в misc/states.py
+FEEDBACK_TEXT = Step("FeedbackForm:text", ttl=15 * 60)
+TICKET_REPLY_TEXT = Step("TicketReply:text", ttl=30 * 60)
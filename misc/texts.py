@@ -0,0 +1,74 @@
+# Тексты и промпты — общие для bot_v03.py (telebot) и bot.py (aiogram)
+
+BTN_LISTENER = 'Мне нужен слушатель'
+BTN_SPECIALIST = 'Мне нужен специалист 🔒'
+BTN_CHAT_BOT = 'Мне нужен чат-бот'
+BTN_END_DIALOG = '❌ Завершить диалог'
+
+WELCOME_TEXT = (
+    "Приветствую!\n\n"
+    "Psyinc — это бот эмоциональной онлайн-поддержки. "
+    "Выберите, что вам нужно, или напишите /help.\n\n"
+    "Автор — Александр Гуртопов, канал "
+    "<a href='https://t.me/+qyO1cAXLfgRhMTNi'>Под коробкой</a>."
+)
+
+ABOUT_TEXT = (
+    "Psyinc — бот эмоциональной поддержки.\n\n"
+    "Версия: 1.0-beta\n"
+    "Автор: Александр Гуртопов (@bugseekerok)\n"
+    "Канал: <a href='https://t.me/+qyO1cAXLfgRhMTNi'>Под коробкой</a>"
+)
+
+HELP_TEXT = (
+    "Команды:\n"
+    "/start — главное меню\n"
+    "/info — о возможностях\n"
+    "/about — о боте\n"
+    "/feedback — оставить отзыв\n"
+    "/settings — настройки\n"
+    "/cancel — выйти из текущего режима\n"
+    "/reset — сбросить историю чат-бота\n"
+    "/getchatid — узнать ID текущего чата (видно только вам)\n\n"
+    "Для слушателей:\n"
+    "/listen [N] — принимать заявки автоматически (до N диалогов сразу)\n"
+    "/pause — не назначать новые заявки"
+)
+
+# сессии, закрытые фоновой чисткой (services/sweeper.py)
+SESSION_EXPIRED_WAITING_TEXT = (
+    "⌛ Свободный слушатель так и не нашёлся, заявка закрыта. "
+    "Попробуйте ещё раз — «Мне нужен слушатель»."
+)
+SESSION_EXPIRED_IDLE_TEXT = "⌛ Диалог давно без сообщений и завершён автоматически."
+
+# у слушателя несколько диалогов: сообщение без reply и без выбора никуда не отправляется
+CHOOSE_DIALOG_TEXT = (
+    "У вас несколько диалогов, и непонятно, к какому это относится — ничего не отправлено. "
+    "Ответьте («Ответить») на сообщение пользователя или выберите диалог ниже и повторите."
+)
+LISTENERS_ONLY_TEXT = "Команда доступна слушателям из группы (в личном чате с ботом)."
+MULTI_DIALOG_HINT = "\nЧтобы писать в нужный диалог, используйте «Ответить» на его сообщение или выберите диалог."
+
+PRIVATE_CONTENT_TEXT = "📵 Контакты и геопозицию в анонимном диалоге не пересылаем — это раскрыло бы вас."
+
+SELF_HELP_SYSTEM_PROMPT = (
+    "Ты — доброжелательный помощник по темам психологии, психотерапии, психиатрии и эмоциональной самопомощи.\n"
+    "Отвечай ТОЛЬКО в рамках этих тем. Если вопрос пользователя выходит за рамки (техника, финансы, политика, бытовое), "
+    "мягко верни к теме переживаний и задай уточняющий вопрос о самочувствии/эмоциях/ситуации.\n"
+    "Не ставь диагнозы и не давай медицинских назначений. Напоминай, что ответы не заменяют очную консультацию. "
+    "Если слышишь признаки неотложного риска, попроси немедленно обратиться к местным экстренным службам/горячей линии и к врачу. "
+    "Пиши коротко, тепло и простым языком; предлагай безопасные техники самопомощи."
+)
+
+# ответы самопомощи без GPT (services/gpt_guard.py): лимиты и недоступность OpenAI
+GPT_BUSY_TEXT = "⏳ Сейчас много запросов, попробуйте чуть позже."
+GPT_RATE_LIMIT_TEXT = "⏳ Вы пишете быстрее, чем я успеваю отвечать. Подождите минуту и напишите снова."
+SELF_HELP_FALLBACK_TEXTS = (
+    "Я сейчас не могу ответить развёрнуто, но я с вами. Попробуйте медленно вдохнуть на 4 счёта, "
+    "задержать дыхание на 4 и выдохнуть на 6. Повторите несколько раз — а потом напишите мне снова.",
+    "Сейчас у меня сбой, и ответить полноценно не получается. Если тревожно, попробуйте заземление: "
+    "назовите 5 вещей, которые видите, 4 — которые слышите, 3 — которые можете потрогать.",
+    "Не получается ответить прямо сейчас. Если хочется поговорить с живым человеком — выберите "
+    "«Мне нужен слушатель» в меню. Если вам угрожает опасность, звоните 112.",
+)
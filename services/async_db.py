@@ -0,0 +1,131 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+from services.chat_store import create_fresh_ticket
+from services.metrics import DEPENDENCY_ERRORS, DEPENDENCY_LATENCY
+
+
+class AsyncDatabase:
+    """Доступ к хранилищам из async-хэндлеров (aiogram).
+
+    SessionStore и ChatStore синхронные, поэтому вызовы уходят в пул из
+    pool_size потоков: у каждого потока своё соединение (Database для
+    SQLite, ThreadedConnectionPool для PostgreSQL) — это и есть пул
+    соединений, а event loop не ждёт диск и сеть. Таблица маршрутов
+    routes обновляется write-through, как db_* в bot_v03.py.
+    """
+
+    def __init__(self, db, sessions, chat_store, routes, matcher=None, pool_size: int = 10,
+                 metrics_name: str = "sqlite"):
+        self.db = db
+        self.sessions = sessions
+        self.chat_store = chat_store
+        self.routes = routes
+        self.matcher = matcher
+        self.metrics_name = metrics_name
+        self._executor = ThreadPoolExecutor(max_workers=pool_size, thread_name_prefix="db")
+
+    async def run(self, operation: str, func, *args):
+        """func(*args) в пуле БД; длительность — в psyinc_dependency_seconds."""
+        loop = asyncio.get_running_loop()
+        start = time.perf_counter()
+        try:
+            return await loop.run_in_executor(self._executor, func, *args)
+        except Exception:
+            DEPENDENCY_ERRORS.labels(self.metrics_name, operation).inc()
+            raise
+        finally:
+            DEPENDENCY_LATENCY.labels(self.metrics_name, operation).observe(time.perf_counter() - start)
+
+    # ---------- анонимные сессии ----------
+    def _open_ticket(self, chat_id: int) -> str:
+        # одним коммитом, только когда всё в SQLite; Redis и PostgreSQL в транзакцию
+        # не входят — если сессия не создалась, режим ожидания снимаем сами
+        try:
+            with self.db.transaction():
+                self.chat_store.set_mode(chat_id, "waiting_listener")
+                ticket = create_fresh_ticket(self.chat_store, chat_id)
+                created_at = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+                try:
+                    self.sessions.create(ticket, chat_id, created_at)
+                except self.sessions.IntegrityError:
+                    # редкая коллизия тикета — ещё одна попытка
+                    ticket = create_fresh_ticket(self.chat_store, chat_id)
+                    self.sessions.create(ticket, chat_id, created_at)
+        except Exception:
+            self.chat_store.set_mode(chat_id, None)
+            raise
+        self.routes.open(ticket, chat_id)
+        if self.matcher is not None:
+            self.matcher.enqueue(ticket)
+        return ticket
+
+    async def open_ticket(self, chat_id: int) -> str:
+        """Новая заявка пользователя: режим waiting_listener, свежий тикет, сессия."""
+        return await self.run("create_session", self._open_ticket, chat_id)
+
+    async def claim(self, ticket: str, listener_id: int):
+        """Compare-and-set, как db_claim_ticket: user_id победителю, иначе None."""
+        capacity = self.matcher.capacity(listener_id) if self.matcher is not None else 1
+        user_id = await self.run("claim_ticket", self.sessions.claim, ticket, listener_id, capacity)
+        if user_id is not None:
+            self.routes.assign(ticket, listener_id)
+        return user_id
+
+    async def sync_routes(self, chat_id: int):
+        """Маршруты чата, давно не сверявшиеся с базой, — из sessions (сессию мог открыть,
+           назначить или закрыть другой процесс бота)."""
+        if self.routes.stale(chat_id):
+            await self.run("open_for_chat", self.routes.refresh, chat_id, self.sessions.open_for_chat)
+
+    def _end_dialog(self, chat_id: int, ticket: str = None):
+        self.routes.refresh(chat_id, self.sessions.open_for_chat)
+        route = self.routes.resolve(chat_id, ticket)
+        if route is None and self.routes.load(chat_id):
+            return None  # несколько диалогов и ни один не указан — хэндлер спросит, какой
+        with self.db.transaction():
+            if self.routes.load(chat_id) <= 1:
+                self.chat_store.set_mode(chat_id, None)
+            if route:
+                self.sessions.close(route.ticket)
+        if route:
+            self.routes.close(route.ticket)
+        return route
+
+    async def end_dialog(self, chat_id: int, ticket: str = None):
+        """Закрывает сессию чата (указанную reply или единственную/выбранную) и сбрасывает режим;
+           возвращает Route или None."""
+        return await self.run("close_session", self._end_dialog, chat_id, ticket)
+
+    async def match(self) -> list:
+        """Автоподбор: [(ticket, user_id, listener_id)] новых назначений."""
+        return await self.run("match", self.matcher.match)
+
+    async def set_listener(self, listener_id: int, available: bool, capacity: int = None) -> int:
+        return await self.run("set_listener", self.matcher.set_available, listener_id, available, capacity)
+
+    async def get_by_ticket(self, ticket: str):
+        return await self.run("get_by_ticket", self.sessions.get_by_ticket, ticket)
+
+    async def rebuild_routes(self):
+        self.routes.rebuild(await self.run("open_sessions", self.sessions.open_sessions))
+        if self.matcher is not None:
+            await self.run("listeners", self.matcher.rebuild)
+
+    # ---------- состояние чатов ----------
+    async def get_mode(self, chat_id: int):
+        return await self.run("get_mode", self.chat_store.get_mode, chat_id)
+
+    async def set_mode(self, chat_id: int, mode):
+        await self.run("set_mode", self.chat_store.set_mode, chat_id, mode)
+
+    async def append_message(self, chat_id: int, role: str, content: str):
+        await self.run("append_message", self.chat_store.append_message, chat_id, role, content)
+
+    async def clear_history(self, chat_id: int):
+        await self.run("clear_history", self.chat_store.clear_history, chat_id)
+
+    def close(self):
+        self._executor.shutdown(wait=True)
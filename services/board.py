@@ -0,0 +1,123 @@
+import threading
+import time
+from datetime import datetime
+
+from services.db import Database
+
+
+class QueueBoard:
+    """Закреплённое в группе слушателей табло очереди вместо сообщения на заявку.
+
+    Табло — одно сообщение: ожидающие заявки со временем ожидания и
+    кнопками «Взять». Оно перерисовывается не чаще раза в interval секунд
+    (все изменения за интервал — одной правкой) и не правится, если текст
+    и кнопки не изменились. Сам вызов Telegram делает publish(text,
+    tickets) вызывающей стороны (telebot или aiogram); id сообщения табло
+    хранится в SQLite, чтобы после перезапуска править то же сообщение.
+    """
+
+    def __init__(self, db: Database, routes, sessions, chat_id: int, interval: float = 15.0, max_rows: int = 20):
+        self.db = db
+        self.routes = routes
+        self.sessions = sessions
+        self.chat_id = chat_id
+        self.interval = interval
+        self.max_rows = max_rows
+        self.edits = 0
+        self.skipped = 0
+        self._lock = threading.Lock()
+        self._since = {}      # ticket -> time() создания заявки
+        self._rendered = None  # (text, tickets) последней отправленной версии
+        self._thread = None
+        db.execute("CREATE TABLE IF NOT EXISTS queue_board (chat_id INTEGER PRIMARY KEY, message_id INTEGER)")
+        row = db.fetchone("SELECT message_id FROM queue_board WHERE chat_id=?", (chat_id,))
+        self.message_id = row[0] if row else None
+
+    def rebuild(self):
+        since = {}
+        for ticket, created_at in self.sessions.waiting():
+            try:
+                since[ticket] = datetime.strptime(created_at, "%Y-%m-%d %H:%M:%S").timestamp()
+            except (TypeError, ValueError):
+                since[ticket] = time.time()
+        with self._lock:
+            self._since = since
+
+    def add(self, ticket: str):
+        with self._lock:
+            self._since[ticket] = time.time()
+
+    def set_message(self, message_id):
+        self.message_id = message_id
+        self.db.execute(
+            "INSERT INTO queue_board (chat_id, message_id) VALUES (?, ?) "
+            "ON CONFLICT(chat_id) DO UPDATE SET message_id=excluded.message_id",
+            (self.chat_id, message_id)
+        )
+
+    # ---------- отрисовка ----------
+    def render(self, now: float = None):
+        """(text, tickets) — текст табло и тикеты для кнопок."""
+        now = time.time() if now is None else now
+        with self._lock:
+            # взятые и закрытые заявки выпадают из табло
+            for ticket in [t for t in self._since if not self.routes.is_waiting(t)]:
+                del self._since[ticket]
+            waiting = sorted(self._since.items(), key=lambda item: item[1])
+        if not waiting:
+            return "📋 Очередь пуста — все заявки разобраны 💚", []
+
+        shown = waiting[:self.max_rows]
+        lines = [f"📋 Ожидают слушателя: {len(waiting)}", ""]
+        lines += [f"{n}. {ticket} — ждёт {_wait(now - since)}" for n, (ticket, since) in enumerate(shown, 1)]
+        if len(waiting) > len(shown):
+            lines.append(f"…и ещё {len(waiting) - len(shown)}")
+        return "\n".join(lines), [ticket for ticket, _ in shown]
+
+    def changed(self):
+        """Новая версия табло или None, если публиковать нечего."""
+        rendered = self.render()
+        if rendered == self._rendered and self.message_id:
+            self.skipped += 1
+            return None
+        return rendered
+
+    def published(self, rendered):
+        self._rendered = rendered
+        self.edits += 1
+
+    # ---------- поток (bot_v03.py) ----------
+    def start(self, publish):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, args=(publish,), name="queue-board", daemon=True)
+            self._thread.start()
+
+    def _loop(self, publish):
+        while True:
+            try:
+                rendered = self.changed()
+                if rendered is not None:
+                    publish(*rendered)
+                    self.published(rendered)
+            except Exception as e:
+                print(f"⚠️ Табло очереди: {e}")
+            time.sleep(self.interval)
+
+
+def board_error(error: Exception):
+    """Разбор ошибки правки табло: "not_modified" (текст тот же), "gone" (сообщение удалено) или None."""
+    text = str(error).lower()
+    if "not modified" in text:
+        return "not_modified"
+    if "not found" in text or "message_id_invalid" in text or "can't be edited" in text:
+        return "gone"
+    return None
+
+
+def _wait(seconds: float) -> str:
+    minutes = int(seconds // 60)
+    if minutes < 1:
+        return "меньше минуты"
+    if minutes < 60:
+        return f"{minutes} мин"
+    return f"{minutes // 60} ч {minutes % 60} мин"
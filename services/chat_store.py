@@ -0,0 +1,358 @@
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from secrets import token_hex
+
+from services.compact_history import CompactHistory
+from services.db import Database
+from services.state_store import JournaledStateStore
+
+# как часто сообщения чата обновляют chats.active_at (секунды)
+ACTIVITY_INTERVAL = 60
+
+
+class ChatData:
+    __slots__ = ("mode", "ticket", "history", "summary", "touched", "step")
+
+    def __init__(self, mode=None, ticket=None, history=None, summary=None, step=None):
+        self.mode = mode
+        self.ticket = ticket
+        self.step = step  # (имя шага, данные, time() окончания) или None
+        # реплики без системного промпта (он общий, см. CompactHistory)
+        self.history = history if isinstance(history, CompactHistory) else CompactHistory.from_messages(history or ())
+        self.summary = summary
+        self.touched = 0.0  # time() последней записи active_at
+
+
+class ChatStore:
+    """Режимы чатов, тикеты и история GPT в SQLite.
+
+    Данные чата читаются из базы только при первом обращении (когда чат
+    прислал апдейт) и держатся в ограниченном LRU-кэше «горячих» чатов.
+    Все изменения пишутся сразу в базу и в кэш (write-through).
+    Там же — ожидаемый шаг многошагового диалога (services/steps.py):
+    имя, данные в JSON и срок, до которого шаг ждёт ответа.
+    chats.active_at — последняя активность чата (не чаще раза в
+    ACTIVITY_INTERVAL), по ней evict_idle() чистит брошенные режимы и истории.
+    """
+
+    def __init__(self, db: Database, cache_size: int = 1000):
+        self.db = db
+        self.cache_size = cache_size
+        self._lock = threading.RLock()
+        self._cache = OrderedDict()  # chat_id -> ChatData
+        self._create_schema()
+
+    def _create_schema(self):
+        self.db.executescript("""
+        CREATE TABLE IF NOT EXISTS chats (
+            chat_id INTEGER PRIMARY KEY,
+            mode TEXT,
+            updated_at TEXT
+        );
+        CREATE TABLE IF NOT EXISTS tickets (
+            ticket TEXT PRIMARY KEY,
+            user_id INTEGER NOT NULL UNIQUE
+        );
+        CREATE TABLE IF NOT EXISTS messages (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            role TEXT NOT NULL,
+            content TEXT NOT NULL
+        );
+        CREATE INDEX IF NOT EXISTS idx_messages_chat ON messages(chat_id, id);
+        """)
+        # краткое содержание вытесненной из окна части разговора
+        self.db.ensure_column("chats", "summary", "TEXT")
+        if self.db.ensure_column("chats", "active_at", "TEXT"):
+            # уже существующим чатам отсчёт простоя начинается с обновления
+            self.db.execute("UPDATE chats SET active_at=?", (_now(),))
+        self.db.execute("CREATE INDEX IF NOT EXISTS idx_chats_active ON chats(active_at)")
+        # ожидаемый шаг диалога; частичный индекс — только по чатам с шагом, для чистки просроченных
+        self.db.ensure_column("chats", "step", "TEXT")
+        self.db.ensure_column("chats", "step_data", "TEXT")
+        self.db.ensure_column("chats", "step_until", "TEXT")
+        self.db.execute("CREATE INDEX IF NOT EXISTS idx_chats_step ON chats(step_until) WHERE step IS NOT NULL")
+
+    # ---------- кэш ----------
+    def _load(self, chat_id: int) -> ChatData:
+        row = self.db.fetchone("SELECT mode, summary, step, step_data, step_until FROM chats WHERE chat_id=?",
+                               (chat_id,))
+        mode, summary, step, step_data, step_until = row if row else (None,) * 5
+        row = self.db.fetchone("SELECT ticket FROM tickets WHERE user_id=?", (chat_id,))
+        ticket = row[0] if row else None
+        rows = self.db.fetchall("SELECT role, content FROM messages WHERE chat_id=? ORDER BY id", (chat_id,))
+        history = CompactHistory(rows)
+        if len(history) < len(rows):
+            # копия системного промпта из старых версий — в базе она больше не нужна
+            self.db.execute("DELETE FROM messages WHERE chat_id=? AND role='system'", (chat_id,))
+        if step is not None:
+            step = (step, json.loads(step_data or "{}"), _timestamp(step_until))
+        return ChatData(mode, ticket, history, summary, step)
+
+    def get(self, chat_id: int) -> ChatData:
+        with self._lock:
+            data = self._cache.get(chat_id)
+            if data is not None:
+                self._cache.move_to_end(chat_id)
+                return data
+        # читаем из базы без глобальной блокировки; если кто-то успел раньше — берём его копию
+        loaded = self._load(chat_id)
+        with self._lock:
+            data = self._cache.setdefault(chat_id, loaded)
+            self._cache.move_to_end(chat_id)
+            if len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+            return data
+
+    def cache_stats(self) -> dict:
+        """Сколько чатов и реплик GPT сейчас в памяти."""
+        chats = list(self._cache.values())
+        return {"chats": len(chats), "messages": sum(len(c.history) for c in chats),
+                "history_bytes": sum(c.history.nbytes() for c in chats)}
+
+    # ---------- режим ----------
+    def get_mode(self, chat_id: int):
+        return self.get(chat_id).mode
+
+    def set_mode(self, chat_id: int, mode):
+        data = self.get(chat_id)
+        if data.mode == mode:
+            return
+        now = _now()
+        self.db.execute(
+            "INSERT INTO chats (chat_id, mode, updated_at, active_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(chat_id) DO UPDATE SET mode=excluded.mode, updated_at=excluded.updated_at, "
+            "active_at=excluded.active_at",
+            (chat_id, mode, now, now)
+        )
+        data.mode = mode
+        data.touched = time.time()
+
+    def _touch(self, chat_id: int, data: ChatData):
+        if time.time() - data.touched < ACTIVITY_INTERVAL:
+            return
+        self.db.execute(
+            "INSERT INTO chats (chat_id, active_at) VALUES (?, ?) "
+            "ON CONFLICT(chat_id) DO UPDATE SET active_at=excluded.active_at",
+            (chat_id, _now())
+        )
+        data.touched = time.time()
+
+    # ---------- тикеты ----------
+    def get_ticket(self, user_id: int):
+        return self.get(user_id).ticket
+
+    def ticket_owner(self, ticket: str):
+        row = self.db.fetchone("SELECT user_id FROM tickets WHERE ticket=?", (ticket,))
+        return row[0] if row else None
+
+    def bind_ticket(self, user_id: int, ticket: str):
+        """Привязывает новый тикет к пользователю, старая привязка удаляется."""
+        data = self.get(user_id)
+        with self.db.transaction() as conn:
+            conn.execute("DELETE FROM tickets WHERE user_id=?", (user_id,))
+            conn.execute("INSERT INTO tickets (ticket, user_id) VALUES (?, ?)", (ticket, user_id))
+        data.ticket = ticket
+
+    # ---------- история GPT ----------
+    def get_history(self, chat_id: int) -> list:
+        """Реплики для запроса к GPT — список словарей собирается при каждом вызове."""
+        return self.get(chat_id).history.messages()
+
+    def append_message(self, chat_id: int, role: str, content: str):
+        data = self.get(chat_id)
+        with self.db.transaction():
+            self.db.execute(
+                "INSERT INTO messages (chat_id, role, content) VALUES (?, ?, ?)",
+                (chat_id, role, content)
+            )
+            self._touch(chat_id, data)
+        data.history.append(role, content)
+
+    def set_history(self, chat_id: int, messages: list):
+        data = self.get(chat_id)
+        history = CompactHistory.from_messages(messages)
+        with self.db.transaction() as conn:
+            conn.execute("DELETE FROM messages WHERE chat_id=?", (chat_id,))
+            conn.executemany(
+                "INSERT INTO messages (chat_id, role, content) VALUES (?, ?, ?)",
+                [(chat_id, m["role"], m["content"]) for m in history.messages()]
+            )
+        data.history = history
+
+    def clear_history(self, chat_id: int):
+        with self.db.transaction():
+            self.set_history(chat_id, [])
+            self.set_summary(chat_id, None)
+
+    def get_summary(self, chat_id: int):
+        return self.get(chat_id).summary
+
+    def set_summary(self, chat_id: int, summary):
+        data = self.get(chat_id)
+        now = _now()
+        self.db.execute(
+            "INSERT INTO chats (chat_id, summary, updated_at, active_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(chat_id) DO UPDATE SET summary=excluded.summary, updated_at=excluded.updated_at",
+            (chat_id, summary, now, now)
+        )
+        data.summary = summary
+
+    def fold_into_summary(self, chat_id: int, summary: str, old: list):
+        """Новое саммари и удаление свёрнутых реплик old — одним коммитом. Только если история
+           всё ещё начинается с old: пока GPT писал саммари, чат могли сбросить (/reset)."""
+        if not old:
+            return
+        data = self.get(chat_id)
+        with self.db.transaction() as conn:
+            rows = conn.execute(
+                "SELECT id, role, content FROM messages WHERE chat_id=? AND role!='system' ORDER BY id LIMIT ?",
+                (chat_id, len(old))
+            ).fetchall()
+            if [(role, content) for _, role, content in rows] != [(m["role"], m["content"]) for m in old]:
+                return
+            self.set_summary(chat_id, summary)
+            conn.execute("DELETE FROM messages WHERE chat_id=? AND role!='system' AND id<=?", (chat_id, rows[-1][0]))
+        data.history = data.history.without_oldest(len(old))
+
+    # ---------- шаг диалога ----------
+    def get_step(self, chat_id: int):
+        """(имя, данные) ожидаемого шага или None, если шага нет или он просрочен."""
+        step = self.get(chat_id).step
+        if step is None or step[2] <= time.time():
+            return None
+        return step[0], dict(step[1])
+
+    def set_step(self, chat_id: int, name: str, data: dict, ttl: float):
+        data_json = json.dumps(data, ensure_ascii=False)
+        until = time.time() + ttl
+        chat = self.get(chat_id)
+        now = _now()
+        self.db.execute(
+            "INSERT INTO chats (chat_id, step, step_data, step_until, updated_at, active_at) VALUES (?, ?, ?, ?, ?, ?) "
+            "ON CONFLICT(chat_id) DO UPDATE SET step=excluded.step, step_data=excluded.step_data, "
+            "step_until=excluded.step_until, updated_at=excluded.updated_at, active_at=excluded.active_at",
+            (chat_id, name, data_json, _format(until), now, now)
+        )
+        chat.step = (name, json.loads(data_json), until)
+        chat.touched = time.time()
+
+    def clear_step(self, chat_id: int):
+        chat = self.get(chat_id)
+        if chat.step is None:
+            return  # обычный апдейт — без записи в базу
+        self.db.execute("UPDATE chats SET step=NULL, step_data=NULL, step_until=NULL WHERE chat_id=?", (chat_id,))
+        chat.step = None
+
+    def expire_steps(self, before: str) -> int:
+        """Снимает шаги, срок которых истёк до before; возвращает их число."""
+        with self.db.transaction() as conn:
+            expired = [chat_id for chat_id, in conn.execute(
+                "SELECT chat_id FROM chats WHERE step IS NOT NULL AND step_until<?", (before,)
+            )]
+            conn.executemany("UPDATE chats SET step=NULL, step_data=NULL, step_until=NULL WHERE chat_id=?",
+                             [(chat_id,) for chat_id in expired])
+        with self._lock:
+            for chat_id in expired:
+                chat = self._cache.get(chat_id)
+                if chat is not None:
+                    chat.step = None
+        return len(expired)
+
+    # ---------- чистка ----------
+    def evict_idle(self, mode_before: str, history_before: str, keep=()) -> tuple:
+        """Сбрасывает режим чатов без активности с mode_before; у чатов без активности
+           с history_before удаляет историю GPT, саммари и строку чата. keep — чаты,
+           которые не трогаем (открытые сессии). Возвращает (режимов, историй)."""
+        with self.db.transaction() as conn:
+            modes = [chat_id for chat_id, in conn.execute(
+                "SELECT chat_id FROM chats WHERE mode IS NOT NULL AND active_at<?", (mode_before,)
+            ) if chat_id not in keep]
+            stale = [(chat_id, has_history) for chat_id, has_history in conn.execute(
+                "SELECT chat_id, summary IS NOT NULL "
+                "OR EXISTS (SELECT 1 FROM messages m WHERE m.chat_id=chats.chat_id) "
+                "FROM chats WHERE active_at<?", (history_before,)
+            ) if chat_id not in keep]
+            conn.executemany("UPDATE chats SET mode=NULL WHERE chat_id=?", [(chat_id,) for chat_id in modes])
+            conn.executemany("DELETE FROM messages WHERE chat_id=?", [(chat_id,) for chat_id, _ in stale])
+            conn.executemany("DELETE FROM chats WHERE chat_id=?", [(chat_id,) for chat_id, _ in stale])
+        # из памяти — тоже; при следующем апдейте чат перечитается из базы
+        with self._lock:
+            for chat_id in modes:
+                self._cache.pop(chat_id, None)
+            for chat_id, _ in stale:
+                self._cache.pop(chat_id, None)
+        return len(modes), sum(1 for _, has_history in stale if has_history)
+
+
+def new_ticket_id() -> str:
+    # короткий, но уникальный: L-XXXXXX (hex)
+    return f"L-{token_hex(3).upper()}"
+
+
+def create_fresh_ticket(store, user_id: int) -> str:
+    """Новый свободный ticket, привязанный к пользователю (старая привязка снимается)."""
+    ticket = new_ticket_id()
+    while store.ticket_owner(ticket) is not None:
+        ticket = new_ticket_id()
+    store.bind_ticket(user_id, ticket)
+    return ticket
+
+
+def _now() -> str:
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _format(timestamp: float) -> str:
+    return datetime.fromtimestamp(timestamp).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def _timestamp(value) -> float:
+    try:
+        return datetime.strptime(value, "%Y-%m-%d %H:%M:%S").timestamp()
+    except (TypeError, ValueError):
+        return 0.0  # нечитаемый срок — шаг считается просроченным
+
+
+def migrate_state_json(store: ChatStore, state_file: str) -> bool:
+    """Разовый перенос state.json (+ журнал) в SQLite. Исходники переименовываются в *.migrated."""
+    journal = state_file + ".journal"
+    if not os.path.exists(state_file) and not os.path.exists(journal):
+        return False
+
+    legacy = JournaledStateStore(
+        state_file,
+        key_types={"user_state": int, "user_conversations": int, "ticket_index": str, "user_ticket": int},
+    )
+    data = legacy.load(open_journal=False)
+
+    with store.db.transaction() as conn:
+        conn.executemany(
+            "INSERT OR REPLACE INTO chats (chat_id, mode, updated_at, active_at) VALUES (?, ?, ?, ?)",
+            [(chat_id, mode, _now(), _now()) for chat_id, mode in data["user_state"].items()]
+        )
+        conn.executemany(
+            "INSERT OR REPLACE INTO tickets (ticket, user_id) VALUES (?, ?)",
+            [(ticket, user_id) for user_id, ticket in data["user_ticket"].items()
+             if data["ticket_index"].get(ticket) == user_id]
+        )
+        for chat_id, history in data["user_conversations"].items():
+            conn.execute("DELETE FROM messages WHERE chat_id=?", (chat_id,))
+            conn.executemany(
+                "INSERT INTO messages (chat_id, role, content) VALUES (?, ?, ?)",
+                # копию системного промпта не переносим — он общий для всех чатов
+                [(chat_id, m.get("role"), m.get("content") or "") for m in history if m.get("role") != "system"]
+            )
+    with store._lock:
+        store._cache.clear()
+
+    for path in (state_file, journal, legacy.old_journal_path):
+        if os.path.exists(path):
+            os.replace(path, path + ".migrated")
+    print(f"✅ {state_file} перенесён в SQLite: {len(data['user_state'])} режимов, "
+          f"{len(data['user_conversations'])} историй")
+    return True
@@ -0,0 +1,80 @@
+from array import array
+
+# коды ролей реплик; системный промпт в истории не хранится — он общий
+# для всех чатов и добавляется в запрос HistoryManager.build_messages
+ROLES = ("user", "assistant")
+ROLE_CODES = {role: code for code, role in enumerate(ROLES)}
+
+
+class CompactHistory:
+    """История GPT одного чата в компактном виде.
+
+    Вместо списка словарей {"role", "content"} — три плоских буфера:
+    коды ролей (array 'B', байт на реплику), концы реплик (array 'I') и
+    тексты всех реплик подряд в одном bytearray (UTF-8). На реплику
+    уходит ~5 байт сверх самого текста вместо dict + str (~270 байт).
+    Список словарей для API собирается только в момент запроса —
+    messages(). Изменение только append(); остальное возвращает новую
+    историю, чтобы параллельное чтение видело целую версию.
+    """
+
+    __slots__ = ("_roles", "_ends", "_text")
+
+    def __init__(self, turns=()):
+        """turns — пары (role, content); системные сообщения (старый формат) пропускаются."""
+        roles, ends, parts = [], [], []
+        size = 0
+        for role, content in turns:
+            if role in ROLE_CODES:
+                data = content.encode("utf-8")
+                size += len(data)
+                roles.append(ROLE_CODES[role])
+                ends.append(size)
+                parts.append(data)
+        # одним куском: буферы без запаса на рост, в отличие от поштучного append()
+        self._roles = array("B", roles)
+        self._ends = array("I", ends)
+        self._text = bytearray(b"".join(parts))
+
+    @classmethod
+    def from_messages(cls, messages) -> "CompactHistory":
+        return cls((m["role"], m["content"]) for m in messages)
+
+    def append(self, role: str, content: str):
+        code = ROLE_CODES.get(role)
+        if code is None:
+            raise ValueError(f"Неизвестная роль реплики: {role}")
+        # сначала текст, потом конец и роль: len() растёт, когда реплика уже целиком записана
+        self._text += content.encode("utf-8")
+        self._ends.append(len(self._text))
+        self._roles.append(code)
+
+    def __len__(self) -> int:
+        return len(self._roles)
+
+    def messages(self) -> list:
+        """Реплики в формате chat completion — новые словари на каждый вызов."""
+        result = []
+        start = 0
+        for i in range(len(self._roles)):
+            end = self._ends[i]
+            result.append({"role": ROLES[self._roles[i]], "content": self._text[start:end].decode("utf-8")})
+            start = end
+        return result
+
+    def without_oldest(self, count: int) -> "CompactHistory":
+        """Новая история без count самых старых реплик."""
+        count = min(max(count, 0), len(self))
+        history = CompactHistory()
+        if count == len(self):
+            return history
+        cut = self._ends[count - 1] if count else 0
+        history._roles = self._roles[count:]
+        history._ends = array("I", [end - cut for end in self._ends[count:]])
+        history._text = self._text[cut:]
+        return history
+
+    def nbytes(self) -> int:
+        """Размер буферов (без заголовков объектов) — для метрик."""
+        return (len(self._text) + self._roles.itemsize * len(self._roles)
+                + self._ends.itemsize * len(self._ends))
@@ -0,0 +1,96 @@
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+
+class Database:
+    """Доступ к SQLite: своё соединение на каждый поток, WAL и короткие транзакции.
+
+    Вне transaction() каждый запрос коммитится сам (autocommit). Внутри —
+    все записи потока уходят одним коммитом; вложенные transaction()
+    присоединяются к внешней.
+    """
+
+    IntegrityError = sqlite3.IntegrityError
+
+    def __init__(self, path: str, busy_timeout_ms: int = 5000, synchronous: str = "NORMAL"):
+        self.path = path
+        self.busy_timeout_ms = busy_timeout_ms
+        self.synchronous = synchronous
+        self._local = threading.local()
+
+    def connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, isolation_level=None, timeout=self.busy_timeout_ms / 1000)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute(f"PRAGMA synchronous={self.synchronous}")
+            conn.execute(f"PRAGMA busy_timeout={int(self.busy_timeout_ms)}")
+            self._local.conn = conn
+            self._local.depth = 0
+        return conn
+
+    @contextmanager
+    def transaction(self):
+        conn = self.connection()
+        if self._local.depth:
+            self._local.depth += 1
+            try:
+                yield conn
+            finally:
+                self._local.depth -= 1
+            return
+
+        # IMMEDIATE — сразу берём блокировку записи, без апгрейда посреди транзакции
+        conn.execute("BEGIN IMMEDIATE")
+        self._local.depth = 1
+        try:
+            yield conn
+        except BaseException:
+            self._local.depth = 0
+            conn.execute("ROLLBACK")
+            raise
+        self._local.depth = 0
+        conn.execute("COMMIT")
+
+    def execute(self, sql: str, params=()) -> sqlite3.Cursor:
+        return self.connection().execute(sql, params)
+
+    def executemany(self, sql: str, seq) -> sqlite3.Cursor:
+        return self.connection().executemany(sql, seq)
+
+    def executescript(self, script: str):
+        self.connection().executescript(script)
+
+    def execute_statements(self, script: str):
+        """Скрипт по одному выражению. В отличие от executescript (тот сначала коммитит
+           открытую транзакцию), внутри transaction() весь скрипт — часть этой транзакции."""
+        conn = self.connection()
+        statement = ""
+        for line in script.splitlines(keepends=True):
+            statement += line
+            if sqlite3.complete_statement(statement):
+                conn.execute(statement)
+                statement = ""
+        if statement.strip():
+            conn.execute(statement)
+
+    def fetchone(self, sql: str, params=()):
+        return self.connection().execute(sql, params).fetchone()
+
+    def fetchall(self, sql: str, params=()) -> list:
+        return self.connection().execute(sql, params).fetchall()
+
+    def ensure_column(self, table: str, column: str, decl: str) -> bool:
+        """ALTER TABLE ... ADD COLUMN, если колонки ещё нет (для уже созданных баз); True — добавлена."""
+        columns = {row[1] for row in self.fetchall(f"PRAGMA table_info({table})")}
+        if column in columns:
+            return False
+        self.execute(f"ALTER TABLE {table} ADD COLUMN {column} {decl}")
+        return True
+
+    def close(self):
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
@@ -0,0 +1,152 @@
+import glob
+import gzip
+import json
+import os
+import queue
+import shutil
+import threading
+import time
+from datetime import datetime
+
+# после неудачной ротации файл пишется дальше как есть, следующая попытка — через столько секунд
+ROTATE_RETRY = 60.0
+
+
+class EventLog:
+    """Журнал событий в формате JSON Lines с фоновой записью.
+
+    log() только кладёт событие в ограниченную очередь; поток-писатель
+    сбрасывает их пачками. Если очередь полна, событие отбрасывается и
+    растёт счётчик dropped — обработчики никогда не ждут диск. Файл
+    ротируется по размеру или возрасту, старые части сжимаются gzip.
+    При остановке процесса stop() дописывает очередь и закрывает файл.
+    """
+
+    def __init__(self, path: str, max_queue: int = 10000, batch_size: int = 500, flush_interval: float = 1.0,
+                 max_bytes: int = 10 * 1024 * 1024, max_age: float = 24 * 3600, backups: int = 10,
+                 compress: bool = True):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.backups = backups
+        self.compress = compress
+
+        self.dropped = 0
+        self.written = 0
+        self.rotate_errors = 0
+        self._queue = queue.Queue(maxsize=max_queue)
+        self._thread = None
+        self._stopping = threading.Event()
+        self._file = None
+        self._opened_at = 0.0
+        self._rotate_retry_at = 0.0
+
+    def log(self, event: str, **fields) -> bool:
+        fields["event"] = event
+        fields["ts"] = datetime.now().isoformat(timespec="seconds")
+        try:
+            self._queue.put_nowait(fields)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    # ---------- писатель ----------
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name=f"event-log:{self.path}", daemon=True)
+            self._thread.start()
+
+    def stop(self, timeout: float = 10.0):
+        """Дописывает всё, что уже в очереди, и закрывает файл; события после stop() не пишутся."""
+        self._stopping.set()
+        if self._thread is not None:
+            try:
+                self._queue.put_nowait(None)  # будим писателя, ждущего событий; полная очередь — он и так занят
+            except queue.Full:
+                pass
+            self._thread.join(timeout)
+            if self._thread.is_alive():
+                print(f"⚠️ {self.path}: за {timeout:.0f} с не дописано событий: {self._queue.qsize()}")
+                return
+        else:
+            self._drain()
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+    def _open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self._file = open(self.path, "a", encoding="utf-8")
+        self._opened_at = time.time()
+
+    def _loop(self):
+        while not self._stopping.is_set():
+            batch = []
+            try:
+                batch.append(self._queue.get(timeout=self.flush_interval))
+                while len(batch) < self.batch_size:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            batch = [e for e in batch if e is not None]
+            if batch:
+                self._write(batch)
+            if self._file is not None and time.time() >= self._rotate_retry_at:
+                try:
+                    if self._should_rotate():
+                        self._rotate()
+                except Exception as e:
+                    # поток-писатель не должен умирать: иначе очередь копится, а в файл не пишется ничего
+                    self.rotate_errors += 1
+                    self._rotate_retry_at = time.time() + ROTATE_RETRY
+                    print(f"⚠️ Не удалось ротировать {self.path}: {e}")
+        self._drain()
+
+    def _drain(self):
+        while True:
+            batch = []
+            try:
+                while len(batch) < self.batch_size:
+                    batch.append(self._queue.get_nowait())
+            except queue.Empty:
+                pass
+            if not batch:
+                return
+            self._write([e for e in batch if e is not None])
+
+    def _write(self, batch: list):
+        try:
+            if self._file is None:
+                self._open()
+            self._file.write("".join(json.dumps(e, ensure_ascii=False, default=str) + "\n" for e in batch))
+            self._file.flush()
+            self.written += len(batch)
+        except Exception as e:
+            self.dropped += len(batch)
+            print(f"⚠️ Не удалось записать {self.path}: {e}")
+
+    def _should_rotate(self) -> bool:
+        return self._file.tell() >= self.max_bytes or time.time() - self._opened_at >= self.max_age
+
+    def _rotate(self):
+        self._file.close()
+        self._file = None
+        if not os.path.getsize(self.path):
+            return
+        rotated = f"{self.path}.{datetime.now():%Y%m%d-%H%M%S-%f}"
+        os.replace(self.path, rotated)
+        if self.compress:
+            with open(rotated, "rb") as src, gzip.open(rotated + ".gz", "wb") as dst:
+                shutil.copyfileobj(src, dst)
+            os.remove(rotated)
+        for old in sorted(glob.glob(f"{glob.escape(self.path)}.*"))[:-self.backups]:
+            os.remove(old)
+
+    def stats(self) -> dict:
+        return {"queued": self._queue.qsize(), "written": self.written, "dropped": self.dropped,
+                "rotate_errors": self.rotate_errors}
@@ -0,0 +1,132 @@
+import os
+from contextlib import nullcontext
+from dataclasses import dataclass
+
+from misc.texts import SELF_HELP_FALLBACK_TEXTS, SELF_HELP_SYSTEM_PROMPT
+from services.board import QueueBoard
+from services.chat_store import ChatStore, migrate_state_json
+from services.db import Database
+from services.event_log import EventLog
+from services.gpt_guard import OpenAIGuard
+from services.history import HistoryManager
+from services.matcher import ListenerMatcher
+from services.metrics import REGISTRY, Gauge
+from services.redis_state import RedisChatStore
+from services.routing import RelayRoutes
+from services.session_store import SessionStore, create_session_store
+from services.sweeper import ExpirySweeper
+from services.updates import UpdateJournal
+
+DB_FILE = "psyinc.db"
+STATE_FILE = "state.json"  # старый формат, переносится в SQLite при первом запуске
+
+
+@dataclass
+class Services:
+    """Общие сервисы обеих точек входа: bot_v03.py (telebot) и bot.py (aiogram).
+       Отправка сообщений и пул GPT у каждой свои (потоки или event loop)."""
+
+    db: Database
+    chat_store: object  # ChatStore | RedisChatStore
+    sessions: SessionStore
+    updates: UpdateJournal
+    routes: RelayRoutes
+    matcher: ListenerMatcher
+    auto_match: bool
+    board: QueueBoard      # None — табло выключено (QUEUE_BOARD=0)
+    ticket_cards: bool     # карточка на каждую заявку в группе
+    sweeper: ExpirySweeper
+    guard: OpenAIGuard
+    request_log: EventLog
+    feedback_log: EventLog
+
+    def create_histories(self, gpt) -> HistoryManager:
+        return HistoryManager(self.chat_store, gpt, SELF_HELP_SYSTEM_PROMPT,
+                              budget=int(os.getenv("HISTORY_TOKEN_BUDGET", "3000")))
+
+
+def build_services(config, stage=None) -> Services:
+    """Сервисы по настройкам из tgbot.config и .env; stage(name) — замер этапа (StartupTimer.stage)."""
+    stage = stage or (lambda name: nullcontext())
+
+    with stage("storage"):
+        db = Database(DB_FILE)
+        if config.tg_bot.use_redis:
+            chat_store = RedisChatStore(config.tg_bot.redis_url,
+                                        ttl=int(os.getenv("REDIS_STATE_TTL", str(30 * 24 * 3600))))
+        else:
+            chat_store = ChatStore(db, cache_size=int(os.getenv("CHAT_CACHE_SIZE", "1000")))
+            migrate_state_json(chat_store, STATE_FILE)
+        sessions = create_session_store(config.db, db)
+        updates = UpdateJournal(db, max_age=float(os.getenv("UPDATE_MAX_AGE", str(15 * 60))))
+
+    with stage("services"):
+        routes = RelayRoutes(ttl=float(os.getenv("ROUTES_TTL", "5")))
+        auto_match = os.getenv("AUTO_MATCH", "0") == "1"
+        matcher = ListenerMatcher(
+            sessions, routes,
+            default_capacity=int(os.getenv("LISTENER_CAPACITY", "1")),
+            max_capacity=int(os.getenv("LISTENER_MAX_CAPACITY", "3")),
+            enabled=auto_match,
+        )
+        # табло очереди в группе вместо карточки на заявку; карточки — запасной вариант
+        queue_board = os.getenv("QUEUE_BOARD", "1") == "1"
+        board = QueueBoard(db, routes, sessions, config.tg_bot.admin_group_id,
+                           interval=float(os.getenv("BOARD_INTERVAL", "15"))) if queue_board else None
+        sweeper = ExpirySweeper(
+            sessions, chat_store, routes,
+            wait_timeout=float(os.getenv("SESSION_WAIT_TIMEOUT", str(24 * 3600))),
+            idle_timeout=float(os.getenv("SESSION_IDLE_TIMEOUT", str(6 * 3600))),
+            mode_timeout=float(os.getenv("MODE_IDLE_TIMEOUT", str(24 * 3600))),
+            history_ttl=float(os.getenv("HISTORY_TTL", str(30 * 24 * 3600))),
+            interval=float(os.getenv("SWEEP_INTERVAL", "300")),
+        )
+        # лимиты и предохранитель запросов к OpenAI: отказ — сразу, без ожидания
+        guard = OpenAIGuard(
+            max_in_flight=int(os.getenv("GPT_MAX_IN_FLIGHT", "32")),
+            chat_rate=float(os.getenv("GPT_CHAT_RATE", "6")) / 60,
+            chat_burst=float(os.getenv("GPT_CHAT_BURST", "3")),
+            timeout=float(os.getenv("GPT_TIMEOUT", "30")),
+            stream_timeout=float(os.getenv("GPT_STREAM_TIMEOUT", "90")),
+            failure_threshold=int(os.getenv("GPT_FAILURE_THRESHOLD", "5")),
+            cooldown=float(os.getenv("GPT_COOLDOWN", "30")),
+            fallback_texts=SELF_HELP_FALLBACK_TEXTS,
+        )
+        # журналы пишутся в фоне; точка входа вызывает stop() при выходе
+        request_log = EventLog("logs/requests.jsonl")
+        feedback_log = EventLog("logs/feedback.jsonl")
+        request_log.start()
+        feedback_log.start()
+
+    services = Services(
+        db=db, chat_store=chat_store, sessions=sessions, updates=updates, routes=routes, matcher=matcher,
+        auto_match=auto_match, board=board,
+        ticket_cards=os.getenv("TICKET_CARDS", "0" if queue_board else "1") == "1",
+        sweeper=sweeper, guard=guard, request_log=request_log, feedback_log=feedback_log,
+    )
+    register_gauges(services)
+    return services
+
+
+def register_gauges(services: Services):
+    routes, chat_store, board, guard = services.routes, services.chat_store, services.board, services.guard
+    REGISTRY.register(Gauge("psyinc_sessions_waiting", "Заявки, ожидающие слушателя", func=routes.waiting_count))
+    REGISTRY.register(Gauge("psyinc_listeners_available", "Слушатели на связи (автоподбор)",
+                            func=services.matcher.available_count))
+    REGISTRY.register(Gauge("psyinc_sessions_active", "Активные анонимные диалоги", func=routes.active_count))
+    REGISTRY.register(Gauge("psyinc_route_hits", "Попадания в таблицу маршрутов", func=lambda: routes.hits))
+    REGISTRY.register(Gauge("psyinc_route_misses", "Промахи таблицы маршрутов", func=lambda: routes.misses))
+    REGISTRY.register(Gauge("psyinc_cached_chats", "Чаты в памяти", func=lambda: chat_store.cache_stats()["chats"]))
+    REGISTRY.register(Gauge("psyinc_cached_messages", "Реплики GPT в памяти",
+                            func=lambda: chat_store.cache_stats()["messages"]))
+    REGISTRY.register(Gauge("psyinc_cached_history_bytes", "Буферы историй GPT в памяти, байт",
+                            func=lambda: chat_store.cache_stats()["history_bytes"]))
+    if board:
+        REGISTRY.register(Gauge("psyinc_board_edits", "Правки табло очереди", func=lambda: board.edits))
+        REGISTRY.register(Gauge("psyinc_board_skipped", "Пропущенные правки табло (без изменений)",
+                                func=lambda: board.skipped))
+    REGISTRY.register(Gauge("psyinc_gpt_in_flight", "Запросы к OpenAI в работе", func=lambda: guard.in_flight))
+    REGISTRY.register(Gauge("psyinc_gpt_circuit_open", "Предохранитель OpenAI разомкнут (1) или замкнут (0)",
+                            func=lambda: float(guard.state != OpenAIGuard.CLOSED)))
+    REGISTRY.register(Gauge("psyinc_event_log_dropped", "Отброшенные события журнала",
+                            func=lambda: services.request_log.dropped + services.feedback_log.dropped))
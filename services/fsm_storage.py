@@ -0,0 +1,88 @@
+import typing
+
+from aiogram.dispatcher.storage import BaseStorage
+
+# шаг без указанного ttl ждёт ответа столько секунд
+DEFAULT_STEP_TTL = 30 * 60
+# чей шаг в группе (там chat != user) — служебное поле в данных шага
+_USER_KEY = "_user"
+
+
+class ChatStoreStorage(BaseStorage):
+    """FSM aiogram в хранилище чатов вместо MemoryStorage.
+
+    Состояние и данные лежат в шаге чата (ChatStore — колонки chats.step*,
+    RedisChatStore — поля хэша), там же, где шаги StepMachine в bot_v03.py:
+    переживают перезапуск, видны всем процессам и снимаются по сроку. Ключ —
+    чат; в группе в данных запоминается пользователь, и состояние видно
+    только ему. Срок берётся из Step с тем же именем (misc/steps.py).
+    Вызовы хранилища идут в пул БД (AsyncDatabase.run).
+    """
+
+    def __init__(self, db, steps=()):
+        self.db = db
+        self._ttl = {step.name: step.ttl for step in steps}
+
+    async def close(self):
+        pass
+
+    async def wait_closed(self):
+        pass
+
+    async def _load(self, chat, user):
+        chat, user = map(int, self.check_address(chat=chat, user=user))
+        step = await self.db.run("get_step", self.db.chat_store.get_step, chat)
+        if step is None:
+            return chat, user, None, {}
+        state, data = step
+        if data.pop(_USER_KEY, user) != user:
+            return chat, user, None, {}
+        return chat, user, state or None, data
+
+    async def _save(self, chat: int, user: int, state, data: dict):
+        if state is None and not data:
+            await self.db.run("clear_step", self.db.chat_store.clear_step, chat)
+            return
+        if chat != user:
+            data = {**data, _USER_KEY: user}
+        ttl = self._ttl.get(state, DEFAULT_STEP_TTL)
+        await self.db.run("set_step", self.db.chat_store.set_step, chat, state or "", data, ttl)
+
+    async def get_state(self, *, chat: typing.Union[str, int, None] = None,
+                        user: typing.Union[str, int, None] = None,
+                        default: typing.Optional[str] = None) -> typing.Optional[str]:
+        _, _, state, _ = await self._load(chat, user)
+        return state if state is not None else self.resolve_state(default)
+
+    async def get_data(self, *, chat: typing.Union[str, int, None] = None,
+                       user: typing.Union[str, int, None] = None,
+                       default: typing.Optional[dict] = None) -> typing.Dict:
+        _, _, _, data = await self._load(chat, user)
+        return data
+
+    async def set_state(self, *, chat: typing.Union[str, int, None] = None,
+                        user: typing.Union[str, int, None] = None,
+                        state: typing.AnyStr = None):
+        chat, user, _, data = await self._load(chat, user)
+        await self._save(chat, user, self.resolve_state(state), data)
+
+    async def set_data(self, *, chat: typing.Union[str, int, None] = None,
+                       user: typing.Union[str, int, None] = None,
+                       data: typing.Dict = None):
+        chat, user, state, _ = await self._load(chat, user)
+        await self._save(chat, user, state, dict(data or {}))
+
+    async def update_data(self, *, chat: typing.Union[str, int, None] = None,
+                          user: typing.Union[str, int, None] = None,
+                          data: typing.Dict = None, **kwargs):
+        chat, user, state, current = await self._load(chat, user)
+        current.update(data or {}, **kwargs)
+        await self._save(chat, user, state, current)
+
+    async def reset_state(self, *, chat: typing.Union[str, int, None] = None,
+                          user: typing.Union[str, int, None] = None,
+                          with_data: typing.Optional[bool] = True):
+        chat, user, state, data = await self._load(chat, user)
+        if state is None and not data:
+            return  # шага нет или он чужой (в группе) — не трогаем
+        await self._save(chat, user, None, {} if with_data else data)
@@ -0,0 +1,274 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from services.gpt_guard import GptBusyError, GptUnavailableError, OpenAIGuard
+from services.metrics import DEPENDENCY_ERRORS, DEPENDENCY_LATENCY, dependency_metrics
+
+def _openai(api_key: str = None):
+    """openai импортируется при первом запросе, а не при старте бота (~0.3 с)."""
+    import openai
+
+    if api_key:
+        openai.api_key = api_key
+    return openai
+
+
+class GptPipeline:
+    """Запросы к OpenAI в отдельном ограниченном пуле.
+
+    Обработчики telebot только ставят задачу и сразу освобождаются.
+    Задачи одного чата выполняются строго по очереди; ответ стримится
+    в сообщение-заглушку через edit_message_text не чаще edit_interval.
+    Сообщения уходят через очередь исходящих (OutboundQueue). Каждый
+    вызов OpenAI проходит через guard (OpenAIGuard): лимит на чат
+    проверяется в submit(), слот и предохранитель — перед запросом; если
+    OpenAI не спрашиваем, чат сразу получает busy_text или заготовку.
+    """
+
+    def __init__(self, sender, model: str = "gpt-4o-mini", temperature: float = 0.8, max_tokens: int = 500,
+                 max_workers: int = 8, max_pending: int = 200, edit_interval: float = 1.0,
+                 placeholder: str = "💭 …", api_key: str = None, guard: OpenAIGuard = None,
+                 busy_text: str = "⏳ Сейчас много запросов, попробуйте чуть позже."):
+        self.sender = sender
+        self.api_key = api_key
+        self.guard = guard if guard is not None else OpenAIGuard()
+        self.busy_text = busy_text
+        self.model = model
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        self.max_pending = max_pending
+        self.edit_interval = edit_interval
+        self.placeholder = placeholder
+
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="gpt")
+        self._lock = threading.Lock()
+        self._queues = {}   # chat_id -> deque задач, первая — выполняется
+        self._pending = 0
+
+    def submit(self, chat_id: int, build_messages, on_answer, reply_markup=None) -> Future:
+        """build_messages() вызывается перед запросом (история на момент старта),
+           on_answer(text) — после успешного ответа. GptRateLimitError — чат
+           превысил свой лимит, GptBusyError — очередь заполнена."""
+        self.guard.check_chat(chat_id)
+        future = Future()
+        job = (chat_id, build_messages, on_answer, reply_markup, future)
+        with self._lock:
+            if self._pending >= self.max_pending:
+                raise GptBusyError("GPT queue is full")
+            self._pending += 1
+            queue = self._queues.setdefault(chat_id, deque())
+            queue.append(job)
+            start = len(queue) == 1
+        if start:
+            self._executor.submit(self._run, job)
+        return future
+
+    def _run(self, job):
+        chat_id, build_messages, on_answer, reply_markup, future = job
+        try:
+            answer = self._complete(chat_id, build_messages(), reply_markup)
+            on_answer(answer)
+            future.set_result(answer)
+        except Exception as e:
+            future.set_exception(e)
+        finally:
+            with self._lock:
+                self._pending -= 1
+                queue = self._queues[chat_id]
+                queue.popleft()
+                next_job = queue[0] if queue else None
+                if next_job is None:
+                    del self._queues[chat_id]
+            if next_job is not None:
+                self._executor.submit(self._run, next_job)
+
+    def _complete(self, chat_id: int, messages: list, reply_markup) -> str:
+        try:
+            with self.guard.call():
+                return self._stream(chat_id, messages, reply_markup)
+        except GptUnavailableError:
+            # предохранитель разомкнут — OpenAI не спрашиваем, отвечаем заготовкой
+            self.sender.send_message(chat_id, self.guard.fallback(), reply_markup=reply_markup)
+            raise
+        except GptBusyError:
+            self.sender.send_message(chat_id, self.busy_text, reply_markup=reply_markup)
+            raise
+
+    def _stream(self, chat_id: int, messages: list, reply_markup) -> str:
+        placeholder = self.sender.send_message(chat_id, self.placeholder, reply_markup=reply_markup).result()
+        text = ""
+        shown = ""
+        last_edit = time.monotonic()
+        start = time.perf_counter()
+        deadline = self.guard.deadline()
+        first_token = True
+        try:
+            stream = _openai(self.api_key).ChatCompletion.create(
+                model=self.model,
+                messages=messages,
+                temperature=self.temperature,
+                max_tokens=self.max_tokens,
+                stream=True,
+                request_timeout=self.guard.timeout,
+            )
+            for chunk in stream:
+                self.guard.check_deadline(deadline)
+                delta = chunk["choices"][0].get("delta", {}).get("content")
+                if not delta:
+                    continue
+                if first_token:
+                    DEPENDENCY_LATENCY.labels("openai", "first_token").observe(time.perf_counter() - start)
+                    first_token = False
+                text += delta
+                now = time.monotonic()
+                if now - last_edit >= self.edit_interval and text.strip() != shown:
+                    shown = self._edit(chat_id, placeholder.message_id, text.strip(), shown)
+                    last_edit = now
+        except Exception as e:
+            DEPENDENCY_ERRORS.labels("openai", "chat_stream").inc()
+            print(f"⚠️ Ошибка OpenAI (чат {chat_id}): {e}")
+            # текст ошибки пользователю не показываем — заготовленный ответ вместо заглушки
+            self._edit(chat_id, placeholder.message_id, self.guard.fallback(), shown)
+            raise
+        finally:
+            DEPENDENCY_LATENCY.labels("openai", "chat_stream").observe(time.perf_counter() - start)
+
+        answer = text.strip()
+        self._edit(chat_id, placeholder.message_id, answer or "…", shown)
+        return answer
+
+    def _edit(self, chat_id: int, message_id: int, text: str, shown: str) -> str:
+        if text == shown:
+            return shown
+        # не ждём доставки: ошибки правки («message is not modified», сеть) логирует очередь
+        self.sender.edit_message_text(text, chat_id, message_id)
+        return text
+
+    @dependency_metrics("openai", "chat")
+    def complete(self, messages: list, max_tokens: int = None) -> str:
+        """Обычный (не стриминговый) запрос — для служебных задач вроде саммари."""
+        with self.guard.call():
+            response = _openai(self.api_key).ChatCompletion.create(
+                model=self.model,
+                messages=messages,
+                temperature=0.3,
+                max_tokens=max_tokens or self.max_tokens,
+                request_timeout=self.guard.timeout,
+            )
+        return response["choices"][0]["message"]["content"].strip()
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False)
+
+
+class AsyncGptPipeline:
+    """Тот же стриминг ответа в сообщение-заглушку, но в event loop (aiogram).
+
+    Ожидающий ответа чат — это корутина, а не поток: одновременно к API
+    идут не больше max_concurrency запросов, всего ждут не больше
+    max_pending. Запросы одного чата выполняются по очереди. Ограничения
+    guard (OpenAIGuard) — те же, что у GptPipeline, но ответ на отказ
+    (GptRateLimitError, GptBusyError, GptUnavailableError) шлёт хэндлер.
+    """
+
+    def __init__(self, sender, model: str = "gpt-4o-mini", temperature: float = 0.8, max_tokens: int = 500,
+                 max_concurrency: int = 50, max_pending: int = 5000, edit_interval: float = 1.0,
+                 placeholder: str = "💭 …", api_key: str = None, guard: OpenAIGuard = None):
+        self.sender = sender
+        self.api_key = api_key
+        self.guard = guard if guard is not None else OpenAIGuard()
+        self.model = model
+        self.temperature = temperature
+        self.max_tokens = max_tokens
+        self.max_pending = max_pending
+        self.edit_interval = edit_interval
+        self.placeholder = placeholder
+
+        self._semaphore = asyncio.Semaphore(max_concurrency)
+        self._chat_locks = {}  # chat_id -> [asyncio.Lock, сколько запросов его ждут]
+        self._pending = 0
+
+    # саммари истории — обычный запрос из потока HistoryManager
+    complete = GptPipeline.complete
+
+    async def answer(self, chat_id: int, build_messages, reply_markup=None) -> str:
+        """build_messages — корутина-фабрика истории на момент старта запроса."""
+        self.guard.check_chat(chat_id)
+        if self._pending >= self.max_pending:
+            raise GptBusyError("GPT queue is full")
+        self._pending += 1
+        entry = self._chat_locks.get(chat_id)
+        if entry is None:
+            entry = self._chat_locks[chat_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                messages = await build_messages()
+                async with self._semaphore:
+                    with self.guard.call():
+                        return await self._complete(chat_id, messages, reply_markup)
+        finally:
+            self._pending -= 1
+            entry[1] -= 1
+            if not entry[1]:
+                del self._chat_locks[chat_id]
+
+    async def _complete(self, chat_id: int, messages: list, reply_markup) -> str:
+        placeholder = await self.sender.send_message(chat_id, self.placeholder, reply_markup=reply_markup)
+        text = ""
+        shown = ""
+        last_edit = time.monotonic()
+        start = time.perf_counter()
+        deadline = self.guard.deadline()
+        first_token = True
+        try:
+            # у aiohttp второе число — предел на весь стрим
+            stream = await _openai(self.api_key).ChatCompletion.acreate(
+                model=self.model,
+                messages=messages,
+                temperature=self.temperature,
+                max_tokens=self.max_tokens,
+                stream=True,
+                request_timeout=(self.guard.timeout, self.guard.stream_timeout),
+            )
+            async for chunk in stream:
+                self.guard.check_deadline(deadline)
+                delta = chunk["choices"][0].get("delta", {}).get("content")
+                if not delta:
+                    continue
+                if first_token:
+                    DEPENDENCY_LATENCY.labels("openai", "first_token").observe(time.perf_counter() - start)
+                    first_token = False
+                text += delta
+                now = time.monotonic()
+                if now - last_edit >= self.edit_interval and text.strip() != shown:
+                    shown = self._edit(chat_id, placeholder.message_id, text.strip(), shown)
+                    last_edit = now
+        except Exception as e:
+            DEPENDENCY_ERRORS.labels("openai", "chat_stream").inc()
+            print(f"⚠️ Ошибка OpenAI (чат {chat_id}): {e}")
+            self._edit(chat_id, placeholder.message_id, self.guard.fallback(), shown)
+            raise
+        finally:
+            DEPENDENCY_LATENCY.labels("openai", "chat_stream").observe(time.perf_counter() - start)
+
+        answer = text.strip()
+        self._edit(chat_id, placeholder.message_id, answer or "…", shown)
+        return answer
+
+    def _edit(self, chat_id: int, message_id: int, text: str, shown: str) -> str:
+        if text == shown:
+            return shown
+        # правка уходит отдельной задачей: стрим не ждёт Telegram, порядок держит очередь чата
+        task = asyncio.ensure_future(self.sender.edit_message_text(text, chat_id, message_id))
+        task.add_done_callback(_ignore_result)
+        return text
+
+
+def _ignore_result(task):
+    # ошибки правки («message is not modified», сеть) уже залогировала очередь
+    if not task.cancelled():
+        task.exception()
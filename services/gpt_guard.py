@@ -0,0 +1,169 @@
+import random
+import threading
+import time
+from contextlib import contextmanager
+
+from services.metrics import REGISTRY, Counter
+from services.ratelimit import TokenBucket
+
+GPT_SHED = REGISTRY.register(Counter(
+    "psyinc_gpt_shed_total", "Запросы к GPT, отклонённые без обращения к OpenAI", ("reason",)))
+GPT_CIRCUIT_TRANSITIONS = REGISTRY.register(Counter(
+    "psyinc_gpt_circuit_transitions_total", "Переключения предохранителя OpenAI", ("state",)))
+
+# ошибки самого запроса (слишком длинный контекст и т.п.) — не признак недоступности OpenAI
+_CLIENT_ERRORS = ("InvalidRequestError",)
+
+
+class GptBusyError(Exception):
+    """Нет свободного места: очередь или лимит одновременных запросов к OpenAI."""
+
+
+class GptRateLimitError(GptBusyError):
+    """Чат исчерпал свой лимит запросов к GPT."""
+
+
+class GptUnavailableError(Exception):
+    """Предохранитель разомкнут: OpenAI сейчас не спрашиваем."""
+
+
+class GptTimeoutError(TimeoutError):
+    pass
+
+
+class OpenAIGuard:
+    """Защита вокруг вызовов OpenAI: общий лимит одновременных запросов,
+    лимит запросов на чат (token bucket), таймауты и предохранитель.
+
+    Лишний запрос не ждёт, а отклоняется сразу (GptBusyError /
+    GptRateLimitError). После failure_threshold ошибок подряд
+    предохранитель размыкается на cooldown секунд: запросы не уходят в
+    OpenAI, пользователь получает заготовленный ответ fallback(). Затем
+    пропускается один пробный запрос: успех замыкает предохранитель,
+    ошибка — снова размыкает. Потокобезопасен, годится и для asyncio
+    (внутри только счётчики под блокировкой).
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, max_in_flight: int = 32, chat_rate: float = 6 / 60, chat_burst: float = 3.0,
+                 timeout: float = 30.0, stream_timeout: float = 90.0, failure_threshold: int = 5,
+                 cooldown: float = 30.0, fallback_texts=(), max_buckets: int = 10000):
+        self.max_in_flight = max_in_flight
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.timeout = timeout                # соединение и пауза между кусками ответа
+        self.stream_timeout = stream_timeout  # весь стрим целиком
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.fallback_texts = tuple(fallback_texts)
+        self.max_buckets = max_buckets
+        self.in_flight = 0
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+        self._buckets = {}  # chat_id -> TokenBucket
+
+    # ---------- лимит на чат ----------
+    def allow(self, chat_id: int) -> bool:
+        with self._lock:
+            bucket = self._buckets.get(chat_id)
+            if bucket is None:
+                if len(self._buckets) >= self.max_buckets:
+                    self._buckets.clear()
+                bucket = self._buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+            allowed = bucket.take()
+        if not allowed:
+            GPT_SHED.labels("chat_rate").inc()
+        return allowed
+
+    def check_chat(self, chat_id: int):
+        if not self.allow(chat_id):
+            raise GptRateLimitError(f"GPT rate limit for chat {chat_id}")
+
+    # ---------- слот и предохранитель ----------
+    def acquire(self):
+        """Слот под один запрос; GptUnavailableError — предохранитель разомкнут,
+           GptBusyError — заняты все max_in_flight слотов."""
+        with self._lock:
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.cooldown:
+                self._switch(self.HALF_OPEN)
+            if self.state == self.OPEN or (self.state == self.HALF_OPEN and self._probing):
+                reason = "circuit_open"
+            elif self.in_flight >= self.max_in_flight:
+                reason = "in_flight"
+            else:
+                reason = None
+                self.in_flight += 1
+                if self.state == self.HALF_OPEN:
+                    self._probing = True
+        if reason == "circuit_open":
+            GPT_SHED.labels(reason).inc()
+            raise GptUnavailableError("OpenAI circuit is open")
+        if reason == "in_flight":
+            GPT_SHED.labels(reason).inc()
+            raise GptBusyError("Too many OpenAI requests in flight")
+
+    def release(self, error: Exception = None, cancelled: bool = False):
+        """Освобождает слот; error — чем закончился запрос, cancelled — не закончился
+           (отмена задачи, остановка): такой исход предохранитель не учитывает."""
+        failed = error is not None and type(error).__name__ not in _CLIENT_ERRORS
+        with self._lock:
+            self.in_flight -= 1
+            probe = self.state == self.HALF_OPEN and self._probing
+            if probe:
+                self._probing = False
+            if cancelled:
+                return
+            if probe:
+                if failed:
+                    self._open()
+                else:
+                    self._failures = 0
+                    self._switch(self.CLOSED)
+            elif failed:
+                self._failures += 1
+                if self.state == self.CLOSED and self._failures >= self.failure_threshold:
+                    self._open()
+            elif error is None:
+                self._failures = 0
+
+    @contextmanager
+    def call(self):
+        """with guard.call(): ... — слот на время запроса, исход идёт в предохранитель."""
+        self.acquire()
+        try:
+            yield
+        except Exception as e:
+            self.release(e)
+            raise
+        except BaseException:
+            self.release(cancelled=True)
+            raise
+        else:
+            self.release()
+
+    def deadline(self) -> float:
+        return time.monotonic() + self.stream_timeout
+
+    @staticmethod
+    def check_deadline(deadline: float):
+        if time.monotonic() > deadline:
+            raise GptTimeoutError("OpenAI stream took too long")
+
+    def _open(self):
+        self._opened_at = time.monotonic()
+        self._switch(self.OPEN)
+
+    def _switch(self, state: str):
+        # вызывается под self._lock
+        if state != self.state:
+            self.state = state
+            GPT_CIRCUIT_TRANSITIONS.labels(state).inc()
+            print(f"🔌 Предохранитель OpenAI: {state}")
+
+    # ---------- ответ без OpenAI ----------
+    def fallback(self) -> str:
+        return random.choice(self.fallback_texts) if self.fallback_texts else "⏳ Помощник временно недоступен."
@@ -0,0 +1,124 @@
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import tiktoken
+except ImportError:  # точный подсчёт — опционально
+    tiktoken = None
+
+# служебные токены на одно сообщение в формате chat completion
+MESSAGE_OVERHEAD_TOKENS = 4
+
+SUMMARY_PROMPT = (
+    "Сожми переписку пользователя с помощником психологической поддержки в краткое содержание "
+    "(до 120 слов): ключевые переживания, обстоятельства, что уже обсуждали и советовали. "
+    "Пиши в третьем лице, без оценок и без новых советов."
+)
+
+_encoding = None
+_encoding_failed = False
+
+
+def count_tokens(text: str) -> int:
+    global _encoding, _encoding_failed
+    if tiktoken is not None and not _encoding_failed:
+        if _encoding is None:
+            try:
+                _encoding = tiktoken.get_encoding("o200k_base")
+            except Exception:
+                _encoding_failed = True
+        if _encoding is not None:
+            return len(_encoding.encode(text))
+    # грубая оценка: ~3 символа на токен для смешанного ru/en текста
+    return len(text) // 3 + 1
+
+
+def message_tokens(message: dict) -> int:
+    return count_tokens(message["content"]) + MESSAGE_OVERHEAD_TOKENS
+
+
+class HistoryManager:
+    """Окно истории для GPT в пределах бюджета токенов.
+
+    В запрос идут системный промпт, краткое содержание старой части
+    разговора и самые свежие реплики, умещающиеся в budget. Когда
+    история превышает бюджет, старые реплики в фоне сворачиваются в
+    саммари и удаляются из памяти и из базы — по содержимому, а не
+    по количеству: сброшенный за время запроса чат не теряет реплик.
+    """
+
+    def __init__(self, store, gpt, system_prompt: str, budget: int = 3000,
+                 keep_ratio: float = 0.5):
+        self.store = store
+        self.gpt = gpt
+        self.system_prompt = system_prompt
+        self.budget = budget
+        self.keep_ratio = keep_ratio
+        self._system_tokens = count_tokens(system_prompt) + MESSAGE_OVERHEAD_TOKENS
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="history-summary")
+        self._lock = threading.Lock()
+        self._summarizing = set()
+
+    @staticmethod
+    def _turns(history: list) -> list:
+        return [m for m in history if m["role"] != "system"]
+
+    def _tail(self, turns: list, budget: int) -> list:
+        """Самые свежие реплики, умещающиеся в budget (последняя — всегда)."""
+        tail = []
+        used = 0
+        for m in reversed(turns):
+            cost = message_tokens(m)
+            if tail and used + cost > budget:
+                break
+            tail.append(m)
+            used += cost
+        tail.reverse()
+        return tail
+
+    def build_messages(self, chat_id: int) -> list:
+        messages = [{"role": "system", "content": self.system_prompt}]
+        budget = self.budget - self._system_tokens
+        summary = self.store.get_summary(chat_id)
+        if summary:
+            note = {"role": "system", "content": f"Краткое содержание предыдущего разговора: {summary}"}
+            messages.append(note)
+            budget -= message_tokens(note)
+        turns = self._turns(self.store.get_history(chat_id))
+        return messages + self._tail(turns, budget)
+
+    def maybe_compact(self, chat_id: int):
+        turns = self._turns(self.store.get_history(chat_id))
+        if sum(message_tokens(m) for m in turns) <= self.budget:
+            return
+        with self._lock:
+            if chat_id in self._summarizing:
+                return
+            self._summarizing.add(chat_id)
+        self._executor.submit(self._compact, chat_id)
+
+    def _compact(self, chat_id: int):
+        try:
+            turns = self._turns(self.store.get_history(chat_id))
+            keep = self._tail(turns, int(self.budget * self.keep_ratio))
+            old = turns[:len(turns) - len(keep)]
+            if not old:
+                return
+
+            previous = self.store.get_summary(chat_id)
+            transcript = "\n".join(f"{m['role']}: {m['content']}" for m in old)
+            if previous:
+                transcript = f"Прежнее краткое содержание: {previous}\n\n{transcript}"
+            summary = self.gpt.complete(
+                [{"role": "system", "content": SUMMARY_PROMPT}, {"role": "user", "content": transcript}],
+                max_tokens=300,
+            )
+            # без блокировки на время запроса к GPT: хранилище само проверит, что история
+            # всё ещё начинается с old (иначе — /reset или чужая свёртка, пропускаем)
+            self.store.fold_into_summary(chat_id, summary, old)
+        except Exception as e:
+            # не вышло — окно всё равно ограничено бюджетом, попробуем в следующий раз
+            print(f"⚠️ Не удалось свернуть историю чата {chat_id}: {e}")
+        finally:
+            with self._lock:
+                self._summarizing.discard(chat_id)
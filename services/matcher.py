@@ -0,0 +1,126 @@
+import heapq
+import itertools
+import threading
+import time
+
+
+class ListenerMatcher:
+    """Автоподбор слушателя для ожидающих заявок (включается AUTO_MATCH).
+
+    Заявки — heap по порядку создания: первой уходит та, что ждёт дольше
+    всех. Из доступных слушателей, у которых нагрузка меньше ёмкости,
+    выбирается наименее загруженный (при равенстве — тот, кто дольше без
+    новой заявки). Назначение — тот же compare-and-set claim, что и у
+    кнопки «Взять в работу», поэтому ручной захват остаётся
+    переопределением: если заявку уже взяли, она просто выпадает из
+    очереди. Нагрузка берётся из RelayRoutes, доступность и ёмкость
+    слушателей хранятся в таблице listeners; всё пересобирается при старте.
+    Без AUTO_MATCH (enabled=False) очередь не ведётся: заявки берут кнопкой.
+    """
+
+    def __init__(self, sessions, routes, default_capacity: int = 1, max_capacity: int = 3,
+                 enabled: bool = True):
+        self.sessions = sessions
+        self.routes = routes
+        self.enabled = enabled
+        self.default_capacity = default_capacity
+        self.max_capacity = max_capacity
+        self._lock = threading.Lock()
+        self._seq = itertools.count()
+        self._waiting = []      # heap (seq, ticket); закрытые/взятые удаляются лениво
+        self._capacity = {}     # listener_id -> ёмкость
+        self._available = set()
+        self._last_assigned = {}  # listener_id -> monotonic() последнего назначения
+
+    def rebuild(self):
+        rows = self.sessions.open_sessions()
+        listeners = self.sessions.listeners()
+        with self._lock:
+            self._waiting = [(next(self._seq), ticket) for ticket, _, listener_id in rows
+                             if not listener_id and self.enabled]
+            heapq.heapify(self._waiting)
+            self._capacity = {lid: capacity for lid, _, capacity in listeners}
+            self._available = {lid for lid, available, _ in listeners if available}
+
+    def capacity(self, listener_id: int) -> int:
+        return self._capacity.get(listener_id, self.default_capacity)
+
+    def is_available(self, listener_id: int) -> bool:
+        return listener_id in self._available
+
+    def available_count(self) -> int:
+        return len(self._available)
+
+    def set_available(self, listener_id: int, available: bool, capacity: int = None) -> int:
+        """Включает/выключает слушателя; возвращает итоговую ёмкость."""
+        capacity = self.capacity(listener_id) if capacity is None else capacity
+        capacity = max(1, min(capacity, self.max_capacity))
+        self.sessions.set_listener(listener_id, available, capacity)
+        with self._lock:
+            self._capacity[listener_id] = capacity
+            if available:
+                self._available.add(listener_id)
+            else:
+                self._available.discard(listener_id)
+        return capacity
+
+    def enqueue(self, ticket: str):
+        if not self.enabled:
+            return
+        with self._lock:
+            heapq.heappush(self._waiting, (next(self._seq), ticket))
+            # взятые вручную и закрытые заявки выпадают лениво в match(); если назначений
+            # давно не было (нет свободных слушателей), чистим heap сами
+            if len(self._waiting) > 2 * self.routes.waiting_count() + 64:
+                self._waiting = [entry for entry in self._waiting if self.routes.is_waiting(entry[1])]
+                heapq.heapify(self._waiting)
+
+    def match(self) -> list:
+        """Раздаёт ожидающие заявки; [(ticket, user_id, listener_id)] успешных назначений.
+           Под self._lock — только очередь и кандидаты; claim/get_by_ticket (запросы к базе)
+           идут без неё, чтобы enqueue() и set_available() не ждали базу."""
+        matched = []
+        with self._lock:
+            candidates = [
+                (self.routes.load(lid), self._last_assigned.get(lid, 0.0), lid)
+                for lid in self._available
+                if self.routes.load(lid) < self.capacity(lid)
+            ]
+        heapq.heapify(candidates)
+        while candidates:
+            ticket = self._head()
+            if ticket is None:
+                break
+            load, _, listener_id = heapq.heappop(candidates)
+            user_id = self.sessions.claim(ticket, listener_id, self.capacity(listener_id))
+            if user_id is None:
+                row = self.sessions.get_by_ticket(ticket)
+                if row is None or row[4] != "waiting":
+                    self._drop(ticket)  # заявку взяли в другом процессе
+                    heapq.heappush(candidates, (load, self._last_assigned.get(listener_id, 0.0), listener_id))
+                # иначе слушатель заполнился в другом процессе — без него
+                continue
+            self.routes.assign(ticket, listener_id)
+            self._drop(ticket)
+            with self._lock:
+                self._last_assigned[listener_id] = assigned_at = time.monotonic()
+            matched.append((ticket, user_id, listener_id))
+            if load + 1 < self.capacity(listener_id):
+                heapq.heappush(candidates, (load + 1, assigned_at, listener_id))
+        return matched
+
+    def _head(self):
+        """Заявка, ждущая дольше всех; взятые вручную и закрытые выкидываются по пути."""
+        with self._lock:
+            while self._waiting:
+                ticket = self._waiting[0][1]
+                if self.routes.is_waiting(ticket):
+                    return ticket
+                heapq.heappop(self._waiting)
+        return None
+
+    def _drop(self, ticket: str):
+        # заявку могли уже снять параллельным match() — тогда её выкинет _head()
+        with self._lock:
+            if self._waiting and self._waiting[0][1] == ticket:
+                heapq.heappop(self._waiting)
@@ -0,0 +1,206 @@
+"""Метрики в текстовом формате Prometheus без внешних зависимостей.
+
+Запись — несколько операций над списком без блокировок (под GIL возможна
+потеря единичного инкремента при гонке, для мониторинга это допустимо),
+поэтому её можно ставить и на горячий путь пересылки сообщений.
+"""
+import functools
+import inspect
+import time
+from bisect import bisect_left
+
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(names, values) -> str:
+    if not names:
+        return ""
+    pairs = ",".join(f'{n}="{str(v)}"' for n, v in zip(names, values))
+    return "{" + pairs + "}"
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._children = {}
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            child = self._children.setdefault(values, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def render(self) -> list:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for values, child in list(self._children.items()):
+            lines.extend(self._render_child(_format_labels(self.labelnames, values), values, child))
+        return lines
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0):
+        self.value += amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def _new_child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1.0):
+        self.labels().inc(amount)
+
+    def _render_child(self, labels, values, child):
+        return [f"{self.name}{labels} {child.value}"]
+
+
+class Gauge(_Metric):
+    """Значение задаётся set() или функцией, которая вызывается при выдаче /metrics."""
+    kind = "gauge"
+
+    def __init__(self, name, help_text, labelnames=(), func=None):
+        super().__init__(name, help_text, labelnames)
+        self._func = func
+
+    def _new_child(self):
+        return _Value()
+
+    def set(self, value: float):
+        self.labels().set(value)
+
+    def set_function(self, func):
+        self._func = func
+
+    def render(self) -> list:
+        if self._func is not None:
+            try:
+                self.labels().set(self._func())
+            except Exception:
+                pass
+        return super().render()
+
+    def _render_child(self, labels, values, child):
+        return [f"{self.name}{labels} {child.value}"]
+
+
+class _HistogramChild:
+    __slots__ = ("bounds", "counts", "sum", "count")
+
+    def __init__(self, bounds):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(buckets)
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def _render_child(self, labels, values, child):
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), child.counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            bucket_labels = _format_labels(self.labelnames + ("le",), values + (le,))
+            lines.append(f"{self.name}_bucket{bucket_labels} {cumulative}")
+        lines.append(f"{self.name}_sum{labels} {child.sum}")
+        lines.append(f"{self.name}_count{labels} {child.count}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = []
+
+    def register(self, metric):
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+HANDLER_LATENCY = REGISTRY.register(Histogram(
+    "psyinc_handler_seconds", "Время обработки апдейта хэндлером", ("handler",)))
+HANDLER_ERRORS = REGISTRY.register(Counter(
+    "psyinc_handler_errors_total", "Исключения в хэндлерах", ("handler",)))
+DEPENDENCY_LATENCY = REGISTRY.register(Histogram(
+    "psyinc_dependency_seconds", "Время вызова внешней зависимости", ("dependency", "operation")))
+DEPENDENCY_ERRORS = REGISTRY.register(Counter(
+    "psyinc_dependency_errors_total", "Ошибки внешних зависимостей", ("dependency", "operation")))
+
+
+def timed(histogram: Histogram, errors: Counter, *labels):
+    """Декоратор: длительность вызова в histogram, исключения — в errors.
+       Работает и для корутин (async-хэндлеры aiogram)."""
+    child = histogram.labels(*labels)
+    error_child = errors.labels(*labels)
+
+    def decorator(func):
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return await func(*args, **kwargs)
+                except Exception:
+                    error_child.inc()
+                    raise
+                finally:
+                    child.observe(time.perf_counter() - start)
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            except Exception:
+                error_child.inc()
+                raise
+            finally:
+                child.observe(time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+
+def handler_metrics(name: str):
+    return timed(HANDLER_LATENCY, HANDLER_ERRORS, name)
+
+
+def dependency_metrics(dependency: str, operation: str):
+    return timed(DEPENDENCY_LATENCY, DEPENDENCY_ERRORS, dependency, operation)
@@ -0,0 +1,76 @@
+import time
+
+
+class TokenBucket:
+    """Классический token bucket: rate токенов в секунду, не больше capacity."""
+
+    __slots__ = ("rate", "capacity", "tokens", "updated")
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def _refill(self, now: float):
+        if now > self.updated:
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+
+    def delay(self, now: float = None, cost: float = 1.0) -> float:
+        """Сколько секунд ждать, пока хватит cost токенов (0 — можно сейчас)."""
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        if self.tokens >= cost:
+            return 0.0
+        return (cost - self.tokens) / self.rate
+
+    def take(self, now: float = None, cost: float = 1.0) -> bool:
+        now = time.monotonic() if now is None else now
+        self._refill(now)
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return True
+        return False
+
+
+class TelegramLimits:
+    """Лимиты Telegram: общий на бота, на личный чат и на группу (chat_id < 0),
+       плюс пауза чата на retry_after после ответа 429."""
+
+    def __init__(self, global_rate: float = 25.0, chat_rate: float = 1.0, chat_burst: float = 3.0,
+                 group_rate: float = 20 / 60, group_burst: float = 3.0, max_buckets: int = 10000):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.group_rate = group_rate
+        self.group_burst = group_burst
+        self.max_buckets = max_buckets
+        self._global = TokenBucket(global_rate, global_rate)
+        self._buckets = {}        # chat_id -> TokenBucket
+        self._blocked_until = {}  # chat_id -> monotonic(), после 429
+
+    def _bucket(self, chat_id: int) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            if len(self._buckets) >= self.max_buckets:
+                self._buckets.clear()
+            if chat_id < 0:
+                bucket = TokenBucket(self.group_rate, self.group_burst)
+            else:
+                bucket = TokenBucket(self.chat_rate, self.chat_burst)
+            self._buckets[chat_id] = bucket
+        return bucket
+
+    def global_delay(self, now: float) -> float:
+        return self._global.delay(now)
+
+    def chat_delay(self, chat_id: int, now: float) -> float:
+        return max(self._blocked_until.get(chat_id, 0) - now, self._bucket(chat_id).delay(now))
+
+    def take(self, chat_id: int, now: float):
+        self._global.take(now)
+        self._bucket(chat_id).take(now)
+        self._blocked_until.pop(chat_id, None)
+
+    def block(self, chat_id: int, seconds: float):
+        self._blocked_until[chat_id] = time.monotonic() + seconds
@@ -0,0 +1,266 @@
+import json
+import threading
+import time
+
+from services.chat_store import ChatData
+from services.compact_history import CompactHistory
+
+# свёртка в саммари: старые реплики срезаются и саммари пишется, только если список всё ещё
+# начинается со свёрнутых (ARGV[2..] — роль и текст попарно): пока GPT писал саммари, чат
+# могли сбросить. Системное сообщение в начале (его писали старые версии; get() убирает
+# такую копию промпта) остаётся на месте
+_FOLD_LUA = """
+local count = (#ARGV - 1) / 2
+local turns = redis.call('LRANGE', KEYS[1], 0, count)
+local offset = 0
+if turns[1] and cjson.decode(turns[1]).role == 'system' then
+    offset = 1
+end
+for i = 1, count do
+    local turn = turns[i + offset]
+    if not turn then
+        return 0
+    end
+    turn = cjson.decode(turn)
+    if turn.role ~= ARGV[2 * i] or turn.content ~= ARGV[2 * i + 1] then
+        return 0
+    end
+end
+if offset == 1 then
+    redis.call('LTRIM', KEYS[1], count + 1, -1)
+    redis.call('LPUSH', KEYS[1], turns[1])
+else
+    redis.call('LTRIM', KEYS[1], count, -1)
+end
+redis.call('HSET', KEYS[2], 'summary', ARGV[1])
+return 1
+"""
+
+# новый тикет чата: прежний тикет узнаётся и отвязывается на сервере, без чтения перед записью
+_BIND_TICKET_LUA = """
+local old = redis.call('HGET', KEYS[1], 'ticket')
+if old then
+    redis.call('DEL', ARGV[3] .. old)
+end
+redis.call('SET', ARGV[3] .. ARGV[1], ARGV[2], 'EX', ARGV[4])
+redis.call('HSET', KEYS[1], 'ticket', ARGV[1])
+return 1
+"""
+
+
+class RedisChatStore:
+    """Горячее состояние чатов в Redis (включается USE_REDIS).
+
+    API тот же, что у ChatStore. Любая операция — не больше одного
+    round-trip: чтение — один pipeline (режим, тикет, саммари и реплики),
+    запись — один MULTI/EXEC с продлением TTL, без чтения перед ней.
+    Локально данные держатся не дольше local_ttl, чтобы несколько
+    процессов видели изменения друг друга; если свежей копии нет, запись
+    перечитывает чат в том же MULTI. Скрипты идут через EVAL внутри
+    pipeline: EVALSHA заставил бы pipeline сначала спросить SCRIPT EXISTS.
+    """
+
+    def __init__(self, url: str, ttl: int = 30 * 24 * 3600, local_ttl: float = 2.0, client=None):
+        if client is None:
+            import redis
+
+            client = redis.Redis.from_url(url, decode_responses=True)
+        self.redis = client
+        self.ttl = ttl
+        self.local_ttl = local_ttl
+        self._lock = threading.Lock()
+        self._local = {}  # chat_id -> (expires_at, ChatData)
+
+    @staticmethod
+    def _chat_key(chat_id: int) -> str:
+        return f"chat:{chat_id}"
+
+    @staticmethod
+    def _turns_key(chat_id: int) -> str:
+        return f"chat:{chat_id}:turns"
+
+    def _touch(self, pipe, chat_id: int):
+        pipe.expire(self._chat_key(chat_id), self.ttl)
+        pipe.expire(self._turns_key(chat_id), self.ttl)
+
+    def _queue_read(self, pipe, chat_id: int):
+        pipe.hgetall(self._chat_key(chat_id))
+        pipe.lrange(self._turns_key(chat_id), 0, -1)
+
+    def _fresh(self, chat_id: int):
+        """Локальная копия чата, если она моложе local_ttl, иначе None."""
+        cached = self._local.get(chat_id)
+        if cached is not None and cached[0] > time.monotonic():
+            return cached[1]
+        return None
+
+    def _remember(self, chat_id: int, fields: dict, turns: list) -> ChatData:
+        messages = [json.loads(t) for t in turns]
+        if messages and messages[0].get("role") == "system":
+            # LREM по значению, а не LPOP: другой процесс мог убрать копию промпта раньше
+            self.redis.lrem(self._turns_key(chat_id), 1, turns[0])
+        step = None
+        if fields.get("step"):
+            step = (fields["step"], json.loads(fields.get("step_data") or "{}"), float(fields.get("step_until") or 0))
+        data = ChatData(
+            mode=fields.get("mode"),
+            ticket=fields.get("ticket"),
+            history=CompactHistory.from_messages(messages),
+            summary=fields.get("summary"),
+            step=step,
+        )
+        now = time.monotonic()
+        with self._lock:
+            if len(self._local) > 10000:
+                self._local = {k: v for k, v in self._local.items() if v[0] > now}
+            self._local[chat_id] = (now + self.local_ttl, data)
+        return data
+
+    # ---------- чтение ----------
+    def get(self, chat_id: int) -> ChatData:
+        cached = self._fresh(chat_id)
+        if cached is not None:
+            return cached
+        pipe = self.redis.pipeline(transaction=False)
+        self._queue_read(pipe, chat_id)
+        return self._remember(chat_id, *pipe.execute())
+
+    def evict_idle(self, mode_before: str, history_before: str, keep=()) -> tuple:
+        """В Redis брошенные чаты удаляет TTL (ttl продлевается каждой записью),
+           здесь — только локальные копии с истёкшим local_ttl."""
+        now = time.monotonic()
+        with self._lock:
+            self._local = {k: v for k, v in self._local.items() if v[0] > now}
+        return 0, 0
+
+    def expire_steps(self, before: str) -> int:
+        """Срок шага проверяет get_step(), а брошенные чаты удаляет TTL."""
+        return 0
+
+    def cache_stats(self) -> dict:
+        chats = [data for _, data in list(self._local.values())]
+        return {"chats": len(chats), "messages": sum(len(c.history) for c in chats),
+                "history_bytes": sum(c.history.nbytes() for c in chats)}
+
+    def get_mode(self, chat_id: int):
+        return self.get(chat_id).mode
+
+    def get_ticket(self, user_id: int):
+        return self.get(user_id).ticket
+
+    def ticket_owner(self, ticket: str):
+        owner = self.redis.get(f"ticket:{ticket}")
+        return int(owner) if owner is not None else None
+
+    def get_history(self, chat_id: int) -> list:
+        return self.get(chat_id).history.messages()
+
+    def get_summary(self, chat_id: int):
+        return self.get(chat_id).summary
+
+    def get_step(self, chat_id: int):
+        step = self.get(chat_id).step
+        if step is None or step[2] <= time.time():
+            return None
+        return step[0], dict(step[1])
+
+    # ---------- запись ----------
+    def _commit(self, chat_id: int, pipe, cached):
+        """Выполняет запись из pipe (MULTI/EXEC) с продлением TTL — один round-trip.
+           Без свежей копии (cached is None) чат перечитывается в том же MULTI, уже после
+           записи, и возвращается None; иначе — результаты команд: копия есть, изменение
+           в неё вносит вызывающий."""
+        self._touch(pipe, chat_id)
+        if cached is None:
+            self._queue_read(pipe, chat_id)
+        results = pipe.execute()
+        if cached is None:
+            self._remember(chat_id, *results[-2:])
+            return None
+        return results
+
+    def _set_field(self, pipe, chat_id: int, field: str, value):
+        if value is None:
+            pipe.hdel(self._chat_key(chat_id), field)
+        else:
+            pipe.hset(self._chat_key(chat_id), field, value)
+
+    def set_mode(self, chat_id: int, mode):
+        cached = self._fresh(chat_id)
+        if cached is not None and cached.mode == mode:
+            return
+        pipe = self.redis.pipeline(transaction=True)
+        self._set_field(pipe, chat_id, "mode", mode)
+        if self._commit(chat_id, pipe, cached):
+            cached.mode = mode
+
+    def bind_ticket(self, user_id: int, ticket: str):
+        cached = self._fresh(user_id)
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.eval(_BIND_TICKET_LUA, 1, self._chat_key(user_id), ticket, user_id, "ticket:", self.ttl)
+        if self._commit(user_id, pipe, cached):
+            cached.ticket = ticket
+
+    def append_message(self, chat_id: int, role: str, content: str):
+        cached = self._fresh(chat_id)
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.rpush(self._turns_key(chat_id), json.dumps({"role": role, "content": content}, ensure_ascii=False))
+        if self._commit(chat_id, pipe, cached):
+            cached.history.append(role, content)
+
+    def set_history(self, chat_id: int, messages: list):
+        cached = self._fresh(chat_id)
+        history = CompactHistory.from_messages(messages)
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.delete(self._turns_key(chat_id))
+        if history:
+            pipe.rpush(self._turns_key(chat_id), *[json.dumps(m, ensure_ascii=False) for m in history.messages()])
+        if self._commit(chat_id, pipe, cached):
+            cached.history = history
+
+    def clear_history(self, chat_id: int):
+        cached = self._fresh(chat_id)
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.delete(self._turns_key(chat_id))
+        pipe.hdel(self._chat_key(chat_id), "summary")
+        if self._commit(chat_id, pipe, cached):
+            cached.history = CompactHistory()
+            cached.summary = None
+
+    def set_step(self, chat_id: int, name: str, data: dict, ttl: float):
+        cached = self._fresh(chat_id)
+        data_json = json.dumps(data, ensure_ascii=False)
+        until = time.time() + ttl
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.hset(self._chat_key(chat_id), mapping={"step": name, "step_data": data_json, "step_until": until})
+        if self._commit(chat_id, pipe, cached):
+            cached.step = (name, json.loads(data_json), until)
+
+    def clear_step(self, chat_id: int):
+        cached = self._fresh(chat_id)
+        if cached is not None and cached.step is None:
+            return
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.hdel(self._chat_key(chat_id), "step", "step_data", "step_until")
+        if self._commit(chat_id, pipe, cached):
+            cached.step = None
+
+    def set_summary(self, chat_id: int, summary):
+        cached = self._fresh(chat_id)
+        pipe = self.redis.pipeline(transaction=True)
+        self._set_field(pipe, chat_id, "summary", summary)
+        if self._commit(chat_id, pipe, cached):
+            cached.summary = summary
+
+    def fold_into_summary(self, chat_id: int, summary: str, old: list):
+        """Саммари вместо свёрнутых реплик old — если история всё ещё с них начинается."""
+        if not old:
+            return
+        cached = self._fresh(chat_id)
+        pipe = self.redis.pipeline(transaction=True)
+        pipe.eval(_FOLD_LUA, 2, self._turns_key(chat_id), self._chat_key(chat_id), summary,
+                  *[part for m in old for part in (m["role"], m["content"])])
+        results = self._commit(chat_id, pipe, cached)
+        if results and results[0]:
+            cached.summary = summary
+            cached.history = cached.history.without_oldest(len(old))
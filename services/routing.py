@@ -0,0 +1,223 @@
+import threading
+import time
+from collections import OrderedDict
+
+# пересылка в анонимном диалоге: медиа копируется copy_message на стороне Telegram
+# (без «Переслано от» и без скачивания к нам); контакт и геопозиция раскрывают
+# отправителя — их не пересылаем
+RELAY_CONTENT_TYPES = ["animation", "audio", "dice", "document", "photo", "poll", "sticker",
+                       "video", "video_note", "voice"]
+PRIVATE_CONTENT_TYPES = ["contact", "location", "venue"]
+CAPTION_CONTENT_TYPES = {"animation", "audio", "document", "photo", "video", "voice"}
+
+
+class Route:
+    __slots__ = ("ticket", "counterpart", "role")
+
+    def __init__(self, ticket: str, counterpart, role: str):
+        self.ticket = ticket
+        self.counterpart = counterpart  # None, пока слушатель не подключился
+        self.role = role                # "user" | "listener"
+
+
+class RelayRoutes:
+    """Маршруты открытых анонимных сессий в памяти: chat_id -> Route.
+
+    Обновляется write-through из db_create_session/db_assign_listener/
+    db_close_session и пересобирается из таблицы sessions при старте,
+    так что пересылка сообщения — это поиск в словаре.
+
+    Сессии открывает и закрывает любой процесс бота на общей базе, поэтому
+    чат, не сверявшийся с базой дольше ttl секунд, перечитывается из неё
+    перед пересылкой (refresh()): заявка, взятая или закрытая в другом
+    процессе, видна здесь не позже чем через ttl.
+
+    У слушателя может быть несколько открытых сессий (ёмкость при
+    автоподборе). Тогда сообщение уходит только туда, куда слушатель
+    указал сам: ответом (reply) на пересланное сообщение или выбором
+    диалога кнопкой (select()), см. resolve(). Новый диалог текущим
+    не становится — иначе сообщение, начатое для одного пользователя,
+    ушло бы другому.
+    """
+
+    def __init__(self, max_messages: int = 50000, ttl: float = 5.0):
+        self._lock = threading.Lock()
+        self._routes = {}    # chat_id -> текущий Route
+        self._chosen = set()  # чаты, где текущий диалог выбран явно (select())
+        self._open = {}      # chat_id -> {ticket: Route}, все открытые сессии чата
+        self._tickets = {}   # ticket -> (user_id, listener_id)
+        self._messages = OrderedDict()  # (chat_id, message_id) -> ticket пересланного сообщения
+        self._activity = {}  # ticket -> time() последнего сообщения, ещё не сохранённое в базу
+        self._synced = OrderedDict()  # chat_id -> time() последней сверки с базой
+        self.max_messages = max_messages
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, chat_id: int):
+        route = self._routes.get(chat_id)
+        if route is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return route
+
+    def _add(self, chat_id: int, route: Route):
+        self._open.setdefault(chat_id, {})[route.ticket] = route
+        current = self._routes.get(chat_id)
+        if current is None or current.ticket == route.ticket:
+            self._routes[chat_id] = route
+
+    def _remove(self, chat_id: int, ticket: str):
+        chat_routes = self._open.get(chat_id)
+        if not chat_routes or chat_routes.pop(ticket, None) is None:
+            return
+        if not chat_routes:
+            del self._open[chat_id]
+            self._routes.pop(chat_id, None)
+            self._chosen.discard(chat_id)
+        elif self._routes[chat_id].ticket == ticket:
+            self._routes[chat_id] = next(reversed(chat_routes.values()))
+            self._chosen.discard(chat_id)
+
+    def open(self, ticket: str, user_id: int):
+        with self._lock:
+            self._tickets[ticket] = (user_id, None)
+            self._add(user_id, Route(ticket, None, "user"))
+
+    def assign(self, ticket: str, listener_id: int):
+        with self._lock:
+            user_id, _ = self._tickets.get(ticket, (None, None))
+            if user_id is None:
+                return
+            self._tickets[ticket] = (user_id, listener_id)
+            self._add(user_id, Route(ticket, listener_id, "user"))
+            self._add(listener_id, Route(ticket, user_id, "listener"))
+
+    def close(self, ticket: str):
+        with self._lock:
+            user_id, listener_id = self._tickets.pop(ticket, (None, None))
+            self._activity.pop(ticket, None)
+            for chat_id in (user_id, listener_id):
+                if chat_id is not None:
+                    self._remove(chat_id, ticket)
+
+    def rebuild(self, rows):
+        """rows — (ticket, user_id, listener_id) открытых сессий."""
+        with self._lock:
+            self._routes.clear()
+            self._chosen.clear()
+            self._open.clear()
+            self._tickets.clear()
+            self._messages.clear()
+            self._activity.clear()
+            self._synced.clear()
+        for ticket, user_id, listener_id in rows:
+            self.open(ticket, user_id)
+            if listener_id:
+                self.assign(ticket, listener_id)
+
+    # ---------- сверка с базой (несколько процессов) ----------
+    def stale(self, chat_id: int) -> bool:
+        synced = self._synced.get(chat_id)
+        return synced is None or time.time() - synced >= self.ttl
+
+    def sync(self, chat_id: int, rows):
+        """rows — (ticket, user_id, listener_id) открытых сессий чата по базе: сессии, которых
+           там уже нет, закрываются, новые и назначенные в другом процессе — добавляются."""
+        found = {ticket for ticket, _, _ in rows}
+        for ticket in set(self.tickets(chat_id)) - found:
+            self.close(ticket)
+        for ticket, user_id, listener_id in rows:
+            state = self._tickets.get(ticket)
+            if state is not None and state[1] not in (None, listener_id):
+                self.close(ticket)  # заявку переназначили — старому слушателю она не видна
+                state = None
+            if state is None:
+                self.open(ticket, user_id)
+            if listener_id and (state is None or state[1] != listener_id):
+                self.assign(ticket, listener_id)
+        with self._lock:
+            self._synced[chat_id] = time.time()
+            self._synced.move_to_end(chat_id)
+            if len(self._synced) > self.max_messages:
+                self._synced.popitem(last=False)
+
+    def refresh(self, chat_id: int, fetch):
+        """Сверяет чат с базой, если сверка устарела; fetch(chat_id) — его открытые сессии."""
+        if self.stale(chat_id):
+            self.sync(chat_id, fetch(chat_id))
+
+    # ---------- несколько сессий у слушателя ----------
+    def load(self, chat_id: int) -> int:
+        """Сколько открытых сессий у чата (для слушателя — текущая нагрузка)."""
+        return len(self._open.get(chat_id, ()))
+
+    def is_waiting(self, ticket: str) -> bool:
+        state = self._tickets.get(ticket)
+        return state is not None and state[1] is None
+
+    def tickets(self, chat_id: int) -> list:
+        """Открытые сессии чата в порядке подключения."""
+        with self._lock:
+            return list(self._open.get(chat_id, ()))
+
+    def select(self, chat_id: int, ticket: str):
+        """Явный выбор диалога: ticket становится текущим для чата; None, если сессия уже закрыта."""
+        with self._lock:
+            route = self._open.get(chat_id, {}).get(ticket)
+            if route is not None:
+                self._routes[chat_id] = route
+                self._chosen.add(chat_id)
+            return route
+
+    def resolve(self, chat_id: int, ticket: str = None):
+        """Куда отправить сообщение чата: ticket — диалог сообщения, на которое ответили (reply).
+           Без него — единственный открытый диалог или выбранный select(). None, если диалога
+           нет или непонятно, какой из нескольких имелся в виду (load() > 0 — надо спросить)."""
+        with self._lock:
+            chat_routes = self._open.get(chat_id)
+            if not chat_routes:
+                self.misses += 1
+                return None
+            self.hits += 1
+            if ticket is not None:
+                return chat_routes.get(ticket)  # ответ в закрытый диалог не уходит в другой
+            if len(chat_routes) == 1 or chat_id in self._chosen:
+                return self._routes[chat_id]
+            return None
+
+    def remember(self, chat_id: int, message_id: int, ticket: str):
+        """Запоминает, из какой сессии пришло пересланное сообщение — чтобы ответ reply ушёл туда же."""
+        with self._lock:
+            self._messages[(chat_id, message_id)] = ticket
+            if len(self._messages) > self.max_messages:
+                self._messages.popitem(last=False)
+
+    def ticket_for_message(self, chat_id: int, message_id: int):
+        return self._messages.get((chat_id, message_id))
+
+    # ---------- активность (для чистки зависших сессий) ----------
+    def touch(self, ticket: str):
+        """Сообщение в диалоге: только запись в словарь, в базу уходит пачкой из ExpirySweeper."""
+        self._activity[ticket] = time.time()
+
+    def pop_activity(self) -> dict:
+        with self._lock:
+            activity, self._activity = self._activity, {}
+        return activity
+
+    def chats(self) -> set:
+        """Чаты с открытыми сессиями."""
+        with self._lock:
+            return set(self._open)
+
+    def waiting_count(self) -> int:
+        return sum(1 for _, listener_id in list(self._tickets.values()) if listener_id is None)
+
+    def active_count(self) -> int:
+        return len(self._tickets) - self.waiting_count()
+
+    def stats(self) -> dict:
+        return {"routes": len(self._routes), "sessions": len(self._tickets),
+                "hits": self.hits, "misses": self.misses}
@@ -0,0 +1,258 @@
+import asyncio
+import heapq
+import itertools
+import threading
+import time
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from services.metrics import DEPENDENCY_ERRORS, DEPENDENCY_LATENCY
+from services.ratelimit import TelegramLimits
+
+# чем меньше число, тем раньше уходит сообщение
+PRIORITY_RELAY = 0      # живой диалог пользователь ↔ слушатель
+PRIORITY_NORMAL = 1     # ответы на команды, GPT
+PRIORITY_LOW = 2        # уведомления группы, отзывы
+
+
+class _Job:
+    __slots__ = ("priority", "seq", "chat_id", "method", "args", "kwargs", "future", "attempts")
+
+    def __init__(self, priority, seq, chat_id, method, args, kwargs):
+        self.priority = priority
+        self.seq = seq
+        self.chat_id = chat_id
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+        self.attempts = 0
+
+
+class OutboundQueue:
+    """Единая очередь исходящих вызовов Telegram.
+
+    Лимиты — token bucket на весь бот, на личный чат и на группу; ответ
+    429 откладывает чат на retry_after. У каждого чата своя FIFO-очередь:
+    вызовы одного чата идут по одному и строго в порядке постановки.
+    Приоритет выбирает только между чатами — по первому вызову в очереди
+    чата. Чаты, которые держит собственный лимит или 429, лежат в
+    отдельном heap по времени разблокировки и не перебираются, пока
+    срок не вышел. Обработчик получает Future и не ждёт сеть.
+    """
+
+    def __init__(self, bot, global_rate: float = 25.0, chat_rate: float = 1.0, chat_burst: float = 3.0,
+                 group_rate: float = 20 / 60, group_burst: float = 3.0, workers: int = 4,
+                 max_attempts: int = 5, max_buckets: int = 10000):
+        self.bot = bot
+        self.max_attempts = max_attempts
+        self._limits = TelegramLimits(global_rate, chat_rate, chat_burst, group_rate, group_burst, max_buckets)
+        self._queues = {}        # chat_id -> deque(_Job), пока у чата есть неотправленное
+        self._in_flight = set()  # чаты, чей вызов сейчас выполняется
+        self._ready = []         # heap (priority, seq, chat_id) чатов, которые можно отправлять
+        self._blocked = []       # heap (monotonic() разблокировки, chat_id)
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="tg-send")
+        self._thread = None
+
+    # ---------- API для обработчиков ----------
+    def call(self, method: str, chat_id: int, *args, priority: int = PRIORITY_NORMAL, **kwargs) -> Future:
+        job = _Job(priority, next(self._seq), chat_id, method, args, kwargs)
+        with self._cond:
+            queue = self._queues.get(chat_id)
+            if queue is None:
+                queue = self._queues[chat_id] = deque()
+            queue.append(job)
+            # чат с уже непустой очередью или вызовом в работе уже учтён в _ready/_blocked
+            if len(queue) == 1 and chat_id not in self._in_flight:
+                self._schedule(chat_id, time.monotonic())
+                self._cond.notify()
+        return job.future
+
+    def send_message(self, chat_id: int, text: str, priority: int = PRIORITY_NORMAL, **kwargs) -> Future:
+        return self.call("send_message", chat_id, chat_id, text, priority=priority, **kwargs)
+
+    def edit_message_text(self, text: str, chat_id: int, message_id: int, priority: int = PRIORITY_NORMAL,
+                          **kwargs) -> Future:
+        return self.call("edit_message_text", chat_id, text, chat_id, message_id, priority=priority, **kwargs)
+
+    def copy_message(self, chat_id: int, from_chat_id: int, message_id: int, priority: int = PRIORITY_NORMAL,
+                     **kwargs) -> Future:
+        """Копия сообщения на стороне Telegram: файл не проходит через наш сервер."""
+        return self.call("copy_message", chat_id, chat_id, from_chat_id, message_id, priority=priority, **kwargs)
+
+    # ---------- диспетчер ----------
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, name="tg-dispatcher", daemon=True)
+            self._thread.start()
+
+    def _schedule(self, chat_id: int, now: float):
+        """Чат с непустой очередью и без вызова в работе — в _ready или в _blocked (под _cond)."""
+        delay = self._limits.chat_delay(chat_id, now)
+        if delay > 0:
+            heapq.heappush(self._blocked, (now + delay, chat_id))
+        else:
+            head = self._queues[chat_id][0]
+            heapq.heappush(self._ready, (head.priority, head.seq, chat_id))
+
+    def _pick(self, now: float):
+        """Следующая задача, которую можно отправить прямо сейчас, или (None, сколько ждать)."""
+        delay = self._limits.global_delay(now)
+        if delay > 0:
+            return None, delay
+
+        # разблокированные чаты — в _ready (лимит чата мог опять не пустить — тогда обратно)
+        while self._blocked and self._blocked[0][0] <= now:
+            _, chat_id = heapq.heappop(self._blocked)
+            self._schedule(chat_id, now)
+        if not self._ready:
+            return None, (self._blocked[0][0] - now if self._blocked else None)
+
+        _, _, chat_id = heapq.heappop(self._ready)
+        queue = self._queues[chat_id]
+        job = queue.popleft()
+        if not queue:
+            del self._queues[chat_id]
+        self._limits.take(chat_id, now)
+        self._in_flight.add(chat_id)
+        return job, None
+
+    def _finish(self, job: _Job, requeue: bool):
+        """Вызов чата завершён (под _cond): 429 возвращает задачу в начало очереди чата."""
+        chat_id = job.chat_id
+        self._in_flight.discard(chat_id)
+        if requeue:
+            queue = self._queues.get(chat_id)
+            if queue is None:
+                queue = self._queues[chat_id] = deque()
+            queue.appendleft(job)
+        if chat_id in self._queues:
+            self._schedule(chat_id, time.monotonic())
+        self._cond.notify()
+
+    def _loop(self):
+        while True:
+            with self._cond:
+                job, wait = self._pick(time.monotonic())
+                if job is None:
+                    self._cond.wait(wait)
+                    continue
+            self._pool.submit(self._execute, job)
+
+    def _execute(self, job: _Job):
+        requeue = False
+        start = time.perf_counter()
+        try:
+            job.attempts += 1
+            result = getattr(self.bot, job.method)(*job.args, **job.kwargs)
+            DEPENDENCY_LATENCY.labels("telegram", job.method).observe(time.perf_counter() - start)
+            job.future.set_result(result)
+        except Exception as e:
+            DEPENDENCY_LATENCY.labels("telegram", job.method).observe(time.perf_counter() - start)
+            DEPENDENCY_ERRORS.labels("telegram", job.method).inc()
+            retry_after = _retry_after(e)
+            if retry_after is not None and job.attempts < self.max_attempts:
+                with self._cond:
+                    self._limits.block(job.chat_id, retry_after)
+                requeue = True
+            else:
+                print(f"⚠️ Telegram {job.method} → {job.chat_id}: {e}")
+                job.future.set_exception(e)
+        finally:
+            with self._cond:
+                self._finish(job, requeue)
+
+
+class AsyncOutboundQueue:
+    """Исходящие вызовы Telegram для aiogram с теми же лимитами, что у OutboundQueue.
+
+    Ожидание токенов — asyncio.sleep внутри корутины обработчика, без
+    потоков. Вызовы одного чата идут по очереди (asyncio.Lock на чат);
+    общий лимит бота первым получает вызов с меньшим priority из тех,
+    кого не держит собственный лимит чата.
+    """
+
+    def __init__(self, bot, global_rate: float = 25.0, chat_rate: float = 1.0, chat_burst: float = 3.0,
+                 group_rate: float = 20 / 60, group_burst: float = 3.0, max_attempts: int = 5,
+                 max_buckets: int = 10000):
+        self.bot = bot
+        self.max_attempts = max_attempts
+        self._limits = TelegramLimits(global_rate, chat_rate, chat_burst, group_rate, group_burst, max_buckets)
+        self._locks = {}     # chat_id -> [asyncio.Lock, сколько вызовов его ждут]
+        self._ready = {}     # priority -> сколько вызовов ждут только общий лимит
+
+    async def call(self, method: str, chat_id: int, *args, priority: int = PRIORITY_NORMAL, **kwargs):
+        entry = self._locks.get(chat_id)
+        if entry is None:
+            entry = self._locks[chat_id] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                for attempt in range(1, self.max_attempts + 1):
+                    await self._acquire(chat_id, priority)
+                    start = time.perf_counter()
+                    try:
+                        result = await getattr(self.bot, method)(*args, **kwargs)
+                        DEPENDENCY_LATENCY.labels("telegram", method).observe(time.perf_counter() - start)
+                        return result
+                    except Exception as e:
+                        DEPENDENCY_LATENCY.labels("telegram", method).observe(time.perf_counter() - start)
+                        DEPENDENCY_ERRORS.labels("telegram", method).inc()
+                        retry_after = _retry_after(e)
+                        if retry_after is None or attempt == self.max_attempts:
+                            print(f"⚠️ Telegram {method} → {chat_id}: {e}")
+                            raise
+                        self._limits.block(chat_id, retry_after)
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[chat_id]
+
+    async def _acquire(self, chat_id: int, priority: int):
+        limits = self._limits
+        counted = False
+        try:
+            while True:
+                now = time.monotonic()
+                delay = limits.chat_delay(chat_id, now)
+                if delay > 0:
+                    await asyncio.sleep(delay)
+                    continue
+                if not counted:
+                    self._ready[priority] = self._ready.get(priority, 0) + 1
+                    counted = True
+                delay = limits.global_delay(now)
+                ahead = any(n for p, n in self._ready.items() if p < priority)
+                if delay <= 0 and not ahead:
+                    limits.take(chat_id, now)
+                    return
+                await asyncio.sleep(delay if delay > 0 else 0.01)
+        finally:
+            if counted:
+                self._ready[priority] -= 1
+
+    async def send_message(self, chat_id: int, text: str, priority: int = PRIORITY_NORMAL, **kwargs):
+        return await self.call("send_message", chat_id, chat_id, text, priority=priority, **kwargs)
+
+    async def edit_message_text(self, text: str, chat_id: int, message_id: int, priority: int = PRIORITY_NORMAL,
+                                **kwargs):
+        return await self.call("edit_message_text", chat_id, text, chat_id, message_id, priority=priority,
+                               **kwargs)
+
+    async def copy_message(self, chat_id: int, from_chat_id: int, message_id: int,
+                           priority: int = PRIORITY_NORMAL, **kwargs):
+        return await self.call("copy_message", chat_id, chat_id, from_chat_id, message_id, priority=priority,
+                               **kwargs)
+
+
+def _retry_after(error: Exception):
+    """retry_after из ответа 429 (ApiTelegramException или RetryAfter aiogram), иначе None."""
+    timeout = getattr(error, "timeout", None)
+    if type(error).__name__ == "RetryAfter" and timeout is not None:
+        return float(timeout)
+    if getattr(error, "error_code", None) != 429:
+        return None
+    result = getattr(error, "result_json", None) or {}
+    return float(result.get("parameters", {}).get("retry_after", 1))
@@ -0,0 +1,504 @@
+from abc import ABC, abstractmethod
+from contextlib import contextmanager
+from datetime import datetime
+
+from services.db import Database
+
+# колонки строки сессии (last_activity в строку не входит — он нужен только чистке)
+SESSION_COLUMNS = ("id", "ticket", "user_id", "listener_id", "status", "created_at")
+_SELECT = "SELECT " + ", ".join(SESSION_COLUMNS) + " FROM sessions"
+# строка переноса между базами (iter_rows/import_rows): без last_activity чистка
+# закрыла бы перенесённые диалоги по времени создания
+EXPORT_COLUMNS = SESSION_COLUMNS + ("last_activity",)
+_EXPORT = "SELECT " + ", ".join(EXPORT_COLUMNS) + " FROM sessions"
+
+
+def _now() -> str:
+    return datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+
+
+class SessionStore(ABC):
+    """Хранилище анонимных сессий (таблица sessions).
+
+    Строки возвращаются кортежами в порядке SESSION_COLUMNS, как раньше
+    отдавал SELECT * по SQLite. Время (created_at, last_activity) — строки
+    "%Y-%m-%d %H:%M:%S", поэтому сравнивается как текст.
+    """
+
+    IntegrityError = Exception
+
+    @abstractmethod
+    def create(self, ticket: str, user_id: int, created_at: str):
+        ...
+
+    @abstractmethod
+    def assign(self, ticket: str, listener_id: int):
+        ...
+
+    @abstractmethod
+    def claim(self, ticket: str, listener_id: int, capacity: int = 1):
+        """Compare-and-set: user_id победителю, None — заявка занята/закрыта
+           или у слушателя уже capacity открытых сессий. Простой диалога
+           (last_activity) отсчитывается с подключения, а не с создания заявки."""
+
+    @abstractmethod
+    def close(self, ticket: str):
+        ...
+
+    @abstractmethod
+    def get_by_ticket(self, ticket: str):
+        ...
+
+    @abstractmethod
+    def active_for_user(self, user_id: int):
+        ...
+
+    @abstractmethod
+    def active_for_listener(self, listener_id: int):
+        ...
+
+    @abstractmethod
+    def participant(self, chat_id: int):
+        """(ticket, role, counterpart_id, status) открытой сессии чата или None."""
+
+    @abstractmethod
+    def open_for_chat(self, chat_id: int) -> list:
+        """(ticket, user_id, listener_id) незакрытых сессий, где чат — пользователь или слушатель."""
+
+    @abstractmethod
+    def open_sessions(self) -> list:
+        """(ticket, user_id, listener_id) всех незакрытых сессий, от старых к новым."""
+
+    @abstractmethod
+    def waiting(self) -> list:
+        """(ticket, created_at) заявок, ждущих слушателя, от старых к новым."""
+
+    @abstractmethod
+    def set_listener(self, listener_id: int, available: bool, capacity: int):
+        ...
+
+    @abstractmethod
+    def listeners(self) -> list:
+        """(listener_id, available, capacity) всех слушателей, включавших автоподбор."""
+
+    @abstractmethod
+    def touch_many(self, items: list):
+        """items — (last_activity, ticket): время последнего сообщения в диалоге."""
+
+    @abstractmethod
+    def expire_stale(self, waiting_before: str, idle_before: str) -> list:
+        """Закрывает заявки, ждущие слушателя с waiting_before, и диалоги без сообщений
+           с idle_before; (ticket, user_id, listener_id) закрытых. "" — не закрывать."""
+
+    @abstractmethod
+    def iter_rows(self, batch: int = 5000):
+        """Все строки (EXPORT_COLUMNS) по возрастанию id — для переноса между базами."""
+
+    @abstractmethod
+    def import_rows(self, rows: list):
+        ...
+
+    @abstractmethod
+    def import_listeners(self, rows: list):
+        """rows — (listener_id, available, capacity), как отдаёт listeners()."""
+
+
+# ------------------ SQLite ------------------
+# миграция — SQL-скрипт или функция от Database
+SQLITE_MIGRATIONS = [
+    # 1: частичные покрывающие индексы по открытым сессиям — поиск участника
+    #    не зависит от числа закрытых строк
+    """
+    CREATE INDEX IF NOT EXISTS idx_sessions_user_open
+        ON sessions(user_id, listener_id, ticket, status) WHERE status!='closed';
+    CREATE INDEX IF NOT EXISTS idx_sessions_listener_open
+        ON sessions(listener_id, user_id, ticket, status) WHERE status!='closed';
+    """,
+    # 2: доступность и ёмкость слушателей для автоподбора
+    """
+    CREATE TABLE IF NOT EXISTS listeners (
+        listener_id INTEGER PRIMARY KEY,
+        available INTEGER NOT NULL DEFAULT 0,
+        capacity INTEGER NOT NULL DEFAULT 1,
+        updated_at TEXT
+    );
+    """,
+    # 3: время последнего сообщения в диалоге — для чистки зависших сессий; через
+    #    ensure_column: базы, где прежний код успел добавить колонку, но не номер, тоже проходят
+    lambda db: db.ensure_column("sessions", "last_activity", "TEXT"),
+    # 4: чистка перебирает только открытые сессии, а не всю таблицу под блокировкой записи
+    """
+    CREATE INDEX IF NOT EXISTS idx_sessions_open_created
+        ON sessions(status, created_at) WHERE status!='closed';
+    """,
+]
+
+
+class SqliteSessionStore(SessionStore):
+    IntegrityError = Database.IntegrityError
+
+    def __init__(self, db: Database):
+        self.db = db
+        db.executescript("""
+        CREATE TABLE IF NOT EXISTS sessions (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            ticket TEXT UNIQUE,
+            user_id INTEGER,
+            listener_id INTEGER,
+            status TEXT,            -- waiting | active | closed
+            created_at TEXT
+        )
+        """)
+        self._migrate()
+
+    def _migrate(self):
+        # номер применённой миграции хранится в PRAGMA user_version. Он общий на весь файл
+        # базы, но версионирует схему только это хранилище (ChatStore и UpdateJournal создают
+        # таблицы через IF NOT EXISTS); понадобятся миграции им — заводить таблицу версий
+        # по хранилищам, а не делить user_version.
+        # Миграция и её номер — одна транзакция: падение посередине не оставит
+        # применённый ALTER TABLE с прежним номером (повтор упал бы на duplicate column).
+        # BEGIN IMMEDIATE заодно не даёт двум процессам мигрировать одновременно.
+        with self.db.transaction():
+            version = self.db.fetchone("PRAGMA user_version")[0]
+            for number, script in enumerate(SQLITE_MIGRATIONS[version:], start=version + 1):
+                if callable(script):
+                    script(self.db)
+                else:
+                    self.db.execute_statements(script)
+                self.db.execute(f"PRAGMA user_version = {number}")
+
+    def create(self, ticket, user_id, created_at):
+        self.db.execute(
+            "INSERT INTO sessions (ticket, user_id, status, created_at) VALUES (?, ?, 'waiting', ?)",
+            (ticket, user_id, created_at)
+        )
+
+    def assign(self, ticket, listener_id):
+        self.db.execute("UPDATE sessions SET listener_id=?, status='active', last_activity=? WHERE ticket=?",
+                        (listener_id, _now(), ticket))
+
+    def claim(self, ticket, listener_id, capacity=1):
+        row = self.db.fetchone(
+            "UPDATE sessions SET listener_id=?, status='active', last_activity=? "
+            "WHERE ticket=? AND status='waiting' "
+            "AND (SELECT COUNT(*) FROM sessions WHERE listener_id=? AND status!='closed') < ? "
+            "RETURNING user_id",
+            (listener_id, _now(), ticket, listener_id, capacity)
+        )
+        return row[0] if row else None
+
+    def close(self, ticket):
+        self.db.execute("UPDATE sessions SET status='closed' WHERE ticket=?", (ticket,))
+
+    def get_by_ticket(self, ticket):
+        return self.db.fetchone(_SELECT + " WHERE ticket=?", (ticket,))
+
+    def active_for_user(self, user_id):
+        return self.db.fetchone(_SELECT + " WHERE user_id=? AND status!='closed'", (user_id,))
+
+    def active_for_listener(self, listener_id):
+        return self.db.fetchone(_SELECT + " WHERE listener_id=? AND status!='closed'", (listener_id,))
+
+    def participant(self, chat_id):
+        return self.db.fetchone(
+            "SELECT ticket, 'user', listener_id, status FROM sessions "
+            "WHERE user_id=? AND status!='closed' "
+            "UNION ALL "
+            "SELECT ticket, 'listener', user_id, status FROM sessions "
+            "WHERE listener_id=? AND status!='closed' "
+            "LIMIT 1",
+            (chat_id, chat_id)
+        )
+
+    def open_for_chat(self, chat_id):
+        return self.db.fetchall(
+            "SELECT ticket, user_id, listener_id FROM sessions "
+            "WHERE (user_id=? OR listener_id=?) AND status!='closed' ORDER BY id",
+            (chat_id, chat_id)
+        )
+
+    def open_sessions(self):
+        return self.db.fetchall(
+            "SELECT ticket, user_id, listener_id FROM sessions WHERE status!='closed' ORDER BY id"
+        )
+
+    def waiting(self):
+        return self.db.fetchall("SELECT ticket, created_at FROM sessions WHERE status='waiting' ORDER BY id")
+
+    def set_listener(self, listener_id, available, capacity):
+        self.db.execute(
+            "INSERT INTO listeners (listener_id, available, capacity, updated_at) VALUES (?, ?, ?, ?) "
+            "ON CONFLICT(listener_id) DO UPDATE SET available=excluded.available, capacity=excluded.capacity, "
+            "updated_at=excluded.updated_at",
+            (listener_id, int(available), capacity, _now())
+        )
+
+    def listeners(self):
+        return [(lid, bool(available), capacity) for lid, available, capacity
+                in self.db.fetchall("SELECT listener_id, available, capacity FROM listeners")]
+
+    def touch_many(self, items):
+        with self.db.transaction() as conn:
+            conn.executemany("UPDATE sessions SET last_activity=? WHERE ticket=? AND status!='closed'", items)
+
+    def expire_stale(self, waiting_before, idle_before):
+        # одним UPDATE: сессия, которую в этот момент взяли или закрыли, не подходит под условие
+        return self.db.fetchall(
+            "UPDATE sessions SET status='closed' "
+            "WHERE status!='closed' AND ((status='waiting' AND created_at<?) "
+            "OR (status='active' AND COALESCE(last_activity, created_at)<?)) "
+            "RETURNING ticket, user_id, listener_id",
+            (waiting_before, idle_before)
+        )
+
+    def iter_rows(self, batch=5000):
+        last_id = 0
+        while True:
+            rows = self.db.fetchall(_EXPORT + " WHERE id>? ORDER BY id LIMIT ?", (last_id, batch))
+            if not rows:
+                return
+            yield from rows
+            last_id = rows[-1][0]
+
+    def import_rows(self, rows):
+        with self.db.transaction() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO sessions (id, ticket, user_id, listener_id, status, created_at, "
+                "last_activity) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                rows
+            )
+
+    def import_listeners(self, rows):
+        with self.db.transaction():
+            for listener_id, available, capacity in rows:
+                self.set_listener(listener_id, available, capacity)
+
+
+# ------------------ PostgreSQL ------------------
+POSTGRES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS sessions (
+    id BIGSERIAL PRIMARY KEY,
+    ticket TEXT UNIQUE,
+    user_id BIGINT,
+    listener_id BIGINT,
+    status TEXT,            -- waiting | active | closed
+    created_at TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_sessions_user_open
+    ON sessions(user_id) INCLUDE (listener_id, ticket, status) WHERE status<>'closed';
+CREATE INDEX IF NOT EXISTS idx_sessions_listener_open
+    ON sessions(listener_id) INCLUDE (user_id, ticket, status) WHERE status<>'closed';
+CREATE INDEX IF NOT EXISTS idx_sessions_open_created
+    ON sessions(status, created_at) WHERE status<>'closed';
+CREATE TABLE IF NOT EXISTS listeners (
+    listener_id BIGINT PRIMARY KEY,
+    available BOOLEAN NOT NULL DEFAULT FALSE,
+    capacity INTEGER NOT NULL DEFAULT 1,
+    updated_at TIMESTAMPTZ DEFAULT now()
+);
+ALTER TABLE sessions ADD COLUMN IF NOT EXISTS last_activity TEXT;
+"""
+
+# горячие запросы готовятся один раз на соединение (PREPARE) и дальше идут через EXECUTE
+POSTGRES_PREPARED = {
+    "s_participant": (
+        "(bigint)",
+        "SELECT ticket, 'user', listener_id, status FROM sessions WHERE user_id=$1 AND status<>'closed' "
+        "UNION ALL "
+        "SELECT ticket, 'listener', user_id, status FROM sessions WHERE listener_id=$1 AND status<>'closed' "
+        "LIMIT 1",
+    ),
+    "s_by_ticket": ("(text)", _SELECT + " WHERE ticket=$1"),
+    "s_for_user": ("(bigint)", _SELECT + " WHERE user_id=$1 AND status<>'closed' LIMIT 1"),
+    "s_for_listener": ("(bigint)", _SELECT + " WHERE listener_id=$1 AND status<>'closed' LIMIT 1"),
+    "s_create": (
+        "(text, bigint, text)",
+        "INSERT INTO sessions (ticket, user_id, status, created_at) VALUES ($1, $2, 'waiting', $3)",
+    ),
+    "s_claim": (
+        "(bigint, text, integer, text)",
+        "UPDATE sessions SET listener_id=$1, status='active', last_activity=$4 "
+        "WHERE ticket=$2 AND status='waiting' "
+        "AND (SELECT COUNT(*) FROM sessions WHERE listener_id=$1 AND status<>'closed') < $3 "
+        "RETURNING user_id",
+    ),
+    "s_close": ("(text)", "UPDATE sessions SET status='closed' WHERE ticket=$1"),
+}
+
+
+class PostgresSessionStore(SessionStore):
+    def __init__(self, host: str, user: str, password: str, database: str, port: int = 5432,
+                 min_connections: int = None, max_connections: int = 10):
+        import psycopg2
+        from psycopg2.extensions import connection
+        from psycopg2.pool import ThreadedConnectionPool
+
+        class PreparedConnection(connection):
+            prepared = False  # PREPARE уже выполнен — флаг живёт и умирает вместе с соединением
+
+        self.IntegrityError = psycopg2.IntegrityError
+        # putconn закрывает соединения сверх minconn — по умолчанию держим открытыми все,
+        # иначе пул и подготовленные запросы пересоздаются на каждый всплеск нагрузки
+        self._pool = ThreadedConnectionPool(
+            min_connections or max_connections, max_connections,
+            host=host, port=port, user=user, password=password, dbname=database,
+            connection_factory=PreparedConnection,
+        )
+        with self._cursor() as cur:
+            cur.execute(POSTGRES_SCHEMA)
+
+    @contextmanager
+    def _cursor(self):
+        conn = self._pool.getconn()
+        try:
+            with conn:  # commit / rollback
+                with conn.cursor() as cur:
+                    self._prepare(conn, cur)
+                    yield cur
+        finally:
+            self._pool.putconn(conn)
+
+    @staticmethod
+    def _prepare(conn, cur):
+        if conn.prepared:
+            return
+        for name, (types, sql) in POSTGRES_PREPARED.items():
+            cur.execute(f"PREPARE {name} {types} AS {sql}")
+        conn.prepared = True
+
+    def _one(self, name: str, params: tuple):
+        with self._cursor() as cur:
+            cur.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+            return cur.fetchone()
+
+    def create(self, ticket, user_id, created_at):
+        with self._cursor() as cur:
+            cur.execute("EXECUTE s_create (%s, %s, %s)", (ticket, user_id, created_at))
+
+    def assign(self, ticket, listener_id):
+        with self._cursor() as cur:
+            cur.execute("UPDATE sessions SET listener_id=%s, status='active', last_activity=%s WHERE ticket=%s",
+                        (listener_id, _now(), ticket))
+
+    def claim(self, ticket, listener_id, capacity=1):
+        with self._cursor() as cur:
+            # в READ COMMITTED подсчёт открытых сессий не видит параллельный захват другой
+            # заявки тем же слушателем — сериализуем захваты слушателя advisory-локом
+            cur.execute("SELECT pg_advisory_xact_lock(%s)", (listener_id,))
+            cur.execute("EXECUTE s_claim (%s, %s, %s, %s)", (listener_id, ticket, capacity, _now()))
+            row = cur.fetchone()
+        return row[0] if row else None
+
+    def close(self, ticket):
+        with self._cursor() as cur:
+            cur.execute("EXECUTE s_close (%s)", (ticket,))
+
+    def get_by_ticket(self, ticket):
+        return self._one("s_by_ticket", (ticket,))
+
+    def active_for_user(self, user_id):
+        return self._one("s_for_user", (user_id,))
+
+    def active_for_listener(self, listener_id):
+        return self._one("s_for_listener", (listener_id,))
+
+    def participant(self, chat_id):
+        return self._one("s_participant", (chat_id,))
+
+    def open_for_chat(self, chat_id):
+        with self._cursor() as cur:
+            cur.execute("SELECT ticket, user_id, listener_id FROM sessions "
+                        "WHERE (user_id=%s OR listener_id=%s) AND status<>'closed' ORDER BY id",
+                        (chat_id, chat_id))
+            return cur.fetchall()
+
+    def open_sessions(self):
+        with self._cursor() as cur:
+            cur.execute("SELECT ticket, user_id, listener_id FROM sessions WHERE status<>'closed' ORDER BY id")
+            return cur.fetchall()
+
+    def waiting(self):
+        with self._cursor() as cur:
+            cur.execute("SELECT ticket, created_at FROM sessions WHERE status='waiting' ORDER BY id")
+            return cur.fetchall()
+
+    def set_listener(self, listener_id, available, capacity):
+        with self._cursor() as cur:
+            cur.execute(
+                "INSERT INTO listeners (listener_id, available, capacity, updated_at) VALUES (%s, %s, %s, now()) "
+                "ON CONFLICT (listener_id) DO UPDATE SET available=EXCLUDED.available, "
+                "capacity=EXCLUDED.capacity, updated_at=now()",
+                (listener_id, bool(available), capacity)
+            )
+
+    def listeners(self):
+        with self._cursor() as cur:
+            cur.execute("SELECT listener_id, available, capacity FROM listeners")
+            return cur.fetchall()
+
+    def touch_many(self, items):
+        with self._cursor() as cur:
+            cur.executemany("UPDATE sessions SET last_activity=%s WHERE ticket=%s AND status<>'closed'", items)
+
+    def expire_stale(self, waiting_before, idle_before):
+        with self._cursor() as cur:
+            cur.execute(
+                "UPDATE sessions SET status='closed' "
+                "WHERE status<>'closed' AND ((status='waiting' AND created_at<%s) "
+                "OR (status='active' AND COALESCE(last_activity, created_at)<%s)) "
+                "RETURNING ticket, user_id, listener_id",
+                (waiting_before, idle_before)
+            )
+            return cur.fetchall()
+
+    def iter_rows(self, batch=5000):
+        last_id = 0
+        while True:
+            with self._cursor() as cur:
+                cur.execute(_EXPORT + " WHERE id>%s ORDER BY id LIMIT %s", (last_id, batch))
+                rows = cur.fetchall()
+            if not rows:
+                return
+            yield from rows
+            last_id = rows[-1][0]
+
+    def import_rows(self, rows):
+        with self._cursor() as cur:
+            cur.executemany(
+                "INSERT INTO sessions (id, ticket, user_id, listener_id, status, created_at, last_activity) "
+                "VALUES (%s, %s, %s, %s, %s, %s, %s) "
+                "ON CONFLICT (id) DO UPDATE SET ticket=EXCLUDED.ticket, user_id=EXCLUDED.user_id, "
+                "listener_id=EXCLUDED.listener_id, status=EXCLUDED.status, created_at=EXCLUDED.created_at, "
+                "last_activity=EXCLUDED.last_activity",
+                rows
+            )
+            # id переносим как есть — двигаем последовательность за максимум
+            cur.execute("SELECT setval(pg_get_serial_sequence('sessions', 'id'), "
+                        "GREATEST((SELECT MAX(id) FROM sessions), 1))")
+
+    def import_listeners(self, rows):
+        with self._cursor() as cur:
+            cur.executemany(
+                "INSERT INTO listeners (listener_id, available, capacity, updated_at) VALUES (%s, %s, %s, now()) "
+                "ON CONFLICT (listener_id) DO UPDATE SET available=EXCLUDED.available, "
+                "capacity=EXCLUDED.capacity, updated_at=now()",
+                [(listener_id, bool(available), capacity) for listener_id, available, capacity in rows]
+            )
+
+    def close_pool(self):
+        self._pool.closeall()
+
+
+def create_session_store(db_config, db: Database) -> SessionStore:
+    """SQLite (по умолчанию) или PostgreSQL — по DB_ENGINE из конфига."""
+    if db_config.engine == "postgres":
+        return PostgresSessionStore(
+            host=db_config.host,
+            port=db_config.port,
+            user=db_config.user,
+            password=db_config.password,
+            database=db_config.database,
+            max_connections=db_config.pool_size,
+        )
+    return SqliteSessionStore(db)
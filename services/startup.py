@@ -0,0 +1,39 @@
+import time
+from contextlib import contextmanager
+
+from services.metrics import REGISTRY, Gauge
+
+STARTUP_SECONDS = REGISTRY.register(Gauge(
+    "psyinc_startup_seconds", "Длительность этапов запуска", ("stage",)))
+
+
+class StartupTimer:
+    """Замер этапов запуска: with timer.stage("db"): ...
+
+    Этапы попадают в psyinc_startup_seconds{stage}; report() — таблица
+    для лога: где уходит время от старта процесса до приёма апдейтов.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.stages = []  # (name, seconds)
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.mark(name, time.perf_counter() - start)
+
+    def mark(self, name: str, seconds: float):
+        self.stages.append((name, seconds))
+        STARTUP_SECONDS.labels(name).set(seconds)
+
+    def since_start(self) -> float:
+        return time.perf_counter() - self.started
+
+    def report(self, title: str = "Запуск") -> str:
+        lines = [f"⏱ {title}: {self.since_start() * 1000:.0f} мс"]
+        lines += [f"   {name:<16}{seconds * 1000:>9.1f} мс" for name, seconds in self.stages]
+        return "\n".join(lines)
@@ -0,0 +1,158 @@
+import json
+import os
+import threading
+
+
+class JournaledStateStore:
+    """Снимок состояния + журнал изменений (append-only).
+
+    Каждое изменение пишется одной строкой JSON в журнал, полный снимок
+    пересобирается в фоне (temp-файл + os.replace), после чего журнал
+    обрезается. При старте снимок «догоняется» журналом.
+    """
+
+    def __init__(self, path: str, key_types: dict, compact_interval: float = 60.0,
+                 compact_min_ops: int = 500):
+        self.path = path
+        self.journal_path = path + ".journal"
+        self.old_journal_path = path + ".journal.old"
+        self.key_types = key_types
+        self.compact_interval = compact_interval
+        self.compact_min_ops = compact_min_ops
+
+        self.data = {section: {} for section in key_types}
+        self._lock = threading.RLock()
+        self._journal = None
+        self._seq = 0
+        self._ops_since_compact = 0
+        self._stop = threading.Event()
+        self._thread = None
+
+    # ---------- загрузка ----------
+    def load(self, open_journal: bool = True) -> dict:
+        snapshot_seq = 0
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, "r", encoding="utf-8") as f:
+                    raw = json.load(f)
+                snapshot_seq = int(raw.get("_seq", 0))
+                for section, key_type in self.key_types.items():
+                    self.data[section] = {key_type(k): v for k, v in raw.get(section, {}).items()}
+            except Exception as e:
+                print(f"⚠️ Не удалось прочитать {self.path}: {e}")
+
+        self._seq = snapshot_seq
+        replayed = 0
+        for path in (self.old_journal_path, self.journal_path):
+            replayed += self._replay(path, snapshot_seq)
+        self._ops_since_compact = replayed
+
+        if open_journal:
+            self._journal = open(self.journal_path, "a", encoding="utf-8")
+        return self.data
+
+    def _replay(self, path: str, snapshot_seq: int) -> int:
+        if not os.path.exists(path):
+            return 0
+        count = 0
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    op = json.loads(line)
+                except ValueError:
+                    # недописанная строка после падения — пропускаем
+                    continue
+                seq = op.get("n", 0)
+                if seq <= snapshot_seq:
+                    continue
+                self._apply(op)
+                self._seq = max(self._seq, seq)
+                count += 1
+        return count
+
+    def _apply(self, op: dict):
+        section = self.data.get(op["s"])
+        if section is None:
+            return
+        key = self.key_types[op["s"]](op["k"])
+        kind = op["op"]
+        if kind == "set":
+            section[key] = op["v"]
+        elif kind == "del":
+            section.pop(key, None)
+        elif kind == "append":
+            section.setdefault(key, []).append(op["v"])
+
+    # ---------- изменения ----------
+    def _write(self, op: dict):
+        with self._lock:
+            self._seq += 1
+            op["n"] = self._seq
+            self._apply(op)
+            if self._journal is not None:
+                try:
+                    self._journal.write(json.dumps(op, ensure_ascii=False) + "\n")
+                    self._journal.flush()
+                except Exception as e:
+                    print(f"⚠️ Не удалось записать журнал {self.journal_path}: {e}")
+            self._ops_since_compact += 1
+
+    def set(self, section: str, key, value):
+        self._write({"op": "set", "s": section, "k": key, "v": value})
+
+    def delete(self, section: str, key):
+        if key in self.data[section]:
+            self._write({"op": "del", "s": section, "k": key})
+
+    def append(self, section: str, key, item):
+        self._write({"op": "append", "s": section, "k": key, "v": item})
+
+    # ---------- компактификация ----------
+    def compact(self):
+        with self._lock:
+            snapshot = dict(self.data)
+            snapshot["_seq"] = self._seq
+            payload = json.dumps(snapshot, ensure_ascii=False)
+            # текущий журнал уходит в .old, новые записи — в свежий файл
+            if self._journal is not None:
+                self._journal.close()
+                if os.path.exists(self.old_journal_path):
+                    # прошлая компактификация не дошла до конца — дописываем, а не затираем
+                    with open(self.journal_path, "r", encoding="utf-8") as src, \
+                            open(self.old_journal_path, "a", encoding="utf-8") as dst:
+                        dst.write(src.read())
+                    os.remove(self.journal_path)
+                elif os.path.exists(self.journal_path):
+                    os.replace(self.journal_path, self.old_journal_path)
+                self._journal = open(self.journal_path, "a", encoding="utf-8")
+            self._ops_since_compact = 0
+
+        tmp_path = self.path + ".tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(payload)
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            if os.path.exists(self.old_journal_path):
+                os.remove(self.old_journal_path)
+        except Exception as e:
+            print(f"⚠️ Не удалось сохранить снимок {self.path}: {e}")
+
+    def _compact_loop(self):
+        while not self._stop.wait(self.compact_interval):
+            if self._ops_since_compact >= self.compact_min_ops:
+                self.compact()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._compact_loop, name="state-compactor", daemon=True)
+            self._thread.start()
+
+    def close(self):
+        self._stop.set()
+        self.compact()
+        with self._lock:
+            if self._journal is not None:
+                self._journal.close()
+                self._journal = None
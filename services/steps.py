@@ -0,0 +1,48 @@
+from typing import NamedTuple
+
+
+class Step(NamedTuple):
+    """Шаг диалога: имя (ключ обработчика в StepMachine) и сколько он ждёт ответа, секунд."""
+    name: str
+    ttl: float
+
+
+class StepMachine:
+    """Многошаговые диалоги telebot вместо bot.register_next_step_handler.
+
+    Ожидаемый шаг хранится в хранилище чатов рядом с режимом (ChatStore —
+    колонки chats.step*, RedisChatStore — поля хэша): имя шага, данные в
+    JSON и срок. Обработчики задаются таблицей {Step: func(message, **data)}
+    и ищутся по имени — функции не сериализуются, шаг переживает перезапуск
+    и виден всем процессам. Проверка на апдейт — один поиск в кэше чатов.
+    """
+
+    def __init__(self, store, handlers: dict):
+        self.store = store
+        self._handlers = {step.name: func for step, func in handlers.items()}
+
+    def enter(self, chat_id: int, step: Step, **data):
+        """Следующее сообщение чата уйдёт в обработчик step (если успеет до ttl)."""
+        self.store.set_step(chat_id, step.name, data, step.ttl)
+
+    def leave(self, chat_id: int):
+        self.store.clear_step(chat_id)
+
+    def pending(self, chat_id: int) -> bool:
+        return self.store.get_step(chat_id) is not None
+
+    def dispatch(self, message) -> bool:
+        """Отдаёт сообщение обработчику ожидаемого шага; False — шага нет.
+           Шаг одноразовый, как next_step_handler: снимается до вызова обработчика."""
+        chat_id = message.chat.id
+        current = self.store.get_step(chat_id)
+        if current is None:
+            return False
+        name, data = current
+        self.store.clear_step(chat_id)
+        handler = self._handlers.get(name)
+        if handler is None:
+            print(f"⚠️ Нет обработчика шага {name} (чат {chat_id})")
+            return False
+        handler(message, **data)
+        return True
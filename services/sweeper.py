@@ -0,0 +1,91 @@
+import threading
+import time
+from datetime import datetime
+
+from services.metrics import REGISTRY, Counter
+
+RECLAIMED = REGISTRY.register(Counter(
+    "psyinc_sweeper_reclaimed_total", "Что освободила фоновая чистка", ("kind",)))
+SWEEP_ERRORS = REGISTRY.register(Counter(
+    "psyinc_sweeper_errors_total", "Ошибки фоновой чистки"))
+
+
+class ExpirySweeper:
+    """Фоновая чистка того, что никто не завершил кнопкой.
+
+    Раз в interval секунд: сохраняет активность диалогов из RelayRoutes
+    (одним executemany), закрывает заявки, ждущие слушателя дольше
+    wait_timeout, и диалоги без сообщений дольше idle_timeout; сбрасывает
+    режим чатов без активности дольше mode_timeout и удаляет историю GPT
+    чатов без активности дольше history_ttl. Таймаут 0 — не чистить.
+    Просроченные шаги диалогов (services/steps.py) снимаются всегда.
+    Закрытые сессии отдаются в on_expired — уведомления идут через
+    очередь отправки, с её лимитами.
+    """
+
+    def __init__(self, sessions, chat_store, routes, wait_timeout: float = 24 * 3600,
+                 idle_timeout: float = 6 * 3600, mode_timeout: float = 24 * 3600,
+                 history_ttl: float = 30 * 24 * 3600, interval: float = 300):
+        self.sessions = sessions
+        self.chat_store = chat_store
+        self.routes = routes
+        self.wait_timeout = wait_timeout
+        self.idle_timeout = idle_timeout
+        self.mode_timeout = mode_timeout
+        self.history_ttl = history_ttl
+        self.interval = interval
+        self._thread = None
+
+    @staticmethod
+    def _before(now: float, timeout: float) -> str:
+        # "" меньше любой даты — условие "< ''" никогда не выполняется
+        if timeout <= 0:
+            return ""
+        return datetime.fromtimestamp(now - timeout).strftime("%Y-%m-%d %H:%M:%S")
+
+    def sweep(self) -> list:
+        """Один проход; (ticket, user_id, listener_id) закрытых сессий."""
+        activity = self.routes.pop_activity()
+        if activity:
+            self.sessions.touch_many([
+                (datetime.fromtimestamp(ts).strftime("%Y-%m-%d %H:%M:%S"), ticket)
+                for ticket, ts in activity.items()
+            ])
+
+        now = time.time()
+        expired = self.sessions.expire_stale(self._before(now, self.wait_timeout),
+                                             self._before(now, self.idle_timeout))
+        for ticket, user_id, listener_id in expired:
+            self.routes.close(ticket)
+            if not self.routes.load(user_id):
+                self.chat_store.set_mode(user_id, None)
+            RECLAIMED.labels("session_waiting" if listener_id is None else "session_idle").inc()
+
+        modes, histories = self.chat_store.evict_idle(self._before(now, self.mode_timeout),
+                                                      self._before(now, self.history_ttl),
+                                                      keep=self.routes.chats())
+        steps = self.chat_store.expire_steps(datetime.fromtimestamp(now).strftime("%Y-%m-%d %H:%M:%S"))
+        RECLAIMED.labels("mode").inc(modes)
+        RECLAIMED.labels("history").inc(histories)
+        RECLAIMED.labels("step").inc(steps)
+        if expired or modes or histories or steps:
+            print(f"🧹 Чистка: сессий {len(expired)}, режимов {modes}, историй {histories}, шагов {steps}")
+        return expired
+
+    # ---------- поток (bot_v03.py) ----------
+    def start(self, on_expired=None):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._loop, args=(on_expired,), name="expiry-sweeper",
+                                            daemon=True)
+            self._thread.start()
+
+    def _loop(self, on_expired):
+        while True:
+            time.sleep(self.interval)
+            try:
+                expired = self.sweep()
+                if expired and on_expired is not None:
+                    on_expired(expired)
+            except Exception as e:
+                SWEEP_ERRORS.inc()
+                print(f"⚠️ Ошибка фоновой чистки: {e}")
@@ -0,0 +1,155 @@
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+from services.metrics import REGISTRY, Counter
+
+UPDATES_SKIPPED = REGISTRY.register(Counter(
+    "psyinc_updates_skipped_total", "Апдейты, не отданные хэндлерам", ("reason",)))
+
+# апдейты с датой сообщения; у callback_query и прочих даты нет — они не устаревают
+_DATED = ("message", "edited_message", "channel_post", "edited_channel_post")
+
+
+def update_time(update):
+    """time() сообщения в апдейте (telebot — int, aiogram — datetime) или None."""
+    for kind in _DATED:
+        message = getattr(update, kind, None)
+        if message is not None:
+            date = getattr(message, "edit_date", None) or message.date
+            return date.timestamp() if isinstance(date, datetime) else float(date)
+    return None
+
+
+class UpdateJournal:
+    """Смещение long polling и журнал апдейтов в SQLite (доставка «хотя бы раз»).
+
+    offset()/checkpoint() — с какого апдейта продолжать после перезапуска.
+    accept() пропускает дальше только апдейты, которых ещё не было, и тем же
+    коммитом кладёт их исходный JSON в pending_updates; обработанным апдейт
+    становится в done(), после хэндлеров. Поэтому смещение можно сдвигать
+    сразу после accept(): то, что к падению ещё стояло в очереди или
+    исполнялось, лежит в pending_updates и отдаётся хэндлерам заново
+    (pending() при старте, либо повторная доставка вебхука). Хэндлер,
+    упавший с исключением, тоже отмечается done() и не повторяется.
+    Хранятся последние keep обработанных update_id — в таблице и в
+    множестве в памяти для быстрого отказа. Сообщения старше max_age
+    секунд (пролежавшие в Telegram, пока бот лежал) отбрасываются;
+    0 — без ограничения.
+    """
+
+    def __init__(self, db, name: str = "polling", max_age: float = 15 * 60, keep: int = 10000):
+        self.db = db
+        self.name = name
+        self.max_age = max_age
+        self.keep = keep
+        self._lock = threading.Lock()
+        self._seen = set()
+        self._order = deque()
+        self._running = set()  # приняты этим процессом, хэндлеры ещё не закончили
+        self._create_schema()
+
+    def _create_schema(self):
+        self.db.executescript("""
+        CREATE TABLE IF NOT EXISTS update_offsets (
+            name TEXT PRIMARY KEY,
+            next_offset INTEGER NOT NULL,
+            updated_at TEXT
+        );
+        CREATE TABLE IF NOT EXISTS processed_updates (
+            update_id INTEGER PRIMARY KEY
+        );
+        CREATE TABLE IF NOT EXISTS pending_updates (
+            update_id INTEGER PRIMARY KEY,
+            payload TEXT NOT NULL
+        );
+        """)
+
+    # ---------- смещение ----------
+    def offset(self):
+        """Первый ещё не подтверждённый update_id или None (первый запуск)."""
+        row = self.db.fetchone("SELECT next_offset FROM update_offsets WHERE name=?", (self.name,))
+        return row[0] if row else None
+
+    def checkpoint(self, next_offset: int):
+        self.db.execute(
+            "INSERT INTO update_offsets (name, next_offset, updated_at) VALUES (?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET next_offset=excluded.next_offset, updated_at=excluded.updated_at",
+            (self.name, next_offset, datetime.now().strftime("%Y-%m-%d %H:%M:%S")),
+        )
+
+    # ---------- повторы и устаревшие ----------
+    def accept(self, updates, payloads) -> list:
+        """Новые и свежие апдейты из пачки, в исходном порядке. payloads — их
+           исходный JSON (строки, в том же порядке): сохраняется до done().
+           Устаревшие сразу отмечаются обработанными; всё — одним коммитом."""
+        if not updates:
+            return []
+        with self._lock:
+            candidates = [(u, payload) for u, payload in zip(updates, payloads)
+                          if u.update_id not in self._seen and u.update_id not in self._running]
+        duplicates, stale, fresh = len(updates) - len(candidates), 0, []
+        since = time.time() - self.max_age if self.max_age > 0 else None
+
+        if candidates:
+            with self.db.transaction() as conn:
+                for update, payload in candidates:
+                    if conn.execute("SELECT 1 FROM processed_updates WHERE update_id=?",
+                                    (update.update_id,)).fetchone():
+                        duplicates += 1
+                        continue
+                    sent = update_time(update)
+                    if since is not None and sent is not None and sent < since:
+                        stale += 1
+                        self._finish(conn, update.update_id)
+                        continue
+                    # остался в pending_updates после падения — принимаем заново
+                    conn.execute("INSERT OR REPLACE INTO pending_updates (update_id, payload) VALUES (?, ?)",
+                                 (update.update_id, payload))
+                    fresh.append(update)
+                # update_id растут — держим только последние keep
+                top = max(u.update_id for u, _ in candidates)
+                conn.execute("DELETE FROM processed_updates WHERE update_id <= ?", (top - self.keep,))
+            accepted = {u.update_id for u in fresh}
+            with self._lock:
+                for update, _ in candidates:
+                    if update.update_id in accepted:
+                        self._running.add(update.update_id)
+                    else:
+                        self._remember(update.update_id)
+
+        if duplicates:
+            UPDATES_SKIPPED.labels("duplicate").inc(duplicates)
+        if stale:
+            UPDATES_SKIPPED.labels("stale").inc(stale)
+        return fresh
+
+    def done(self, update_id: int):
+        """Хэндлеры апдейта закончили (или упали) — повторно он не обрабатывается."""
+        with self.db.transaction() as conn:
+            self._finish(conn, update_id)
+        with self._lock:
+            self._running.discard(update_id)
+            self._remember(update_id)
+
+    def pending(self) -> list:
+        """(update_id, payload) апдейтов, принятых до падения, но не обработанных, по порядку."""
+        with self._lock:
+            running = set(self._running)
+        return [row for row in self.db.fetchall("SELECT update_id, payload FROM pending_updates ORDER BY update_id")
+                if row[0] not in running]
+
+    @staticmethod
+    def _finish(conn, update_id: int):
+        conn.execute("DELETE FROM pending_updates WHERE update_id=?", (update_id,))
+        conn.execute("INSERT OR IGNORE INTO processed_updates (update_id) VALUES (?)", (update_id,))
+
+    def _remember(self, update_id: int):
+        # вызывается под self._lock
+        if update_id in self._seen:
+            return
+        self._seen.add(update_id)
+        self._order.append(update_id)
+        if len(self._order) > self.keep:
+            self._seen.discard(self._order.popleft())
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# корень репозитория — пакеты services, misc и т.д. импортируются, как в bot.py
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,73 @@
+import json
+import time
+
+from services import event_log
+from services.event_log import EventLog
+
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        assert time.monotonic() < deadline, "не дождались"
+        time.sleep(0.01)
+
+
+def read_events(path):
+    with open(path, encoding="utf-8") as f:
+        return [json.loads(line)["event"] for line in f]
+
+
+def test_rotation_error_keeps_writer_alive(tmp_path, monkeypatch, capsys):
+    path = str(tmp_path / "requests.jsonl")
+    log = EventLog(path, flush_interval=0.01, max_bytes=1)
+    failures = []
+
+    def broken_replace(src, dst):
+        failures.append(dst)
+        raise PermissionError("read-only")
+
+    monkeypatch.setattr(event_log.os, "replace", broken_replace)
+    log.start()
+    log.log("first")
+    wait_for(lambda: log.rotate_errors == 1)
+    assert "Не удалось ротировать" in capsys.readouterr().out
+
+    # ротация не удалась — файл пишется дальше, поток жив
+    log.log("second")
+    wait_for(lambda: log.written == 2)
+    assert log._thread.is_alive()
+    assert read_events(path) == ["first", "second"]
+    assert len(failures) == 1  # повтор — не раньше ROTATE_RETRY
+
+
+def test_rotation_compresses_old_part(tmp_path):
+    path = str(tmp_path / "feedback.jsonl")
+    log = EventLog(path, flush_interval=0.01, max_bytes=1)
+    log.start()
+    log.log("first")
+    wait_for(lambda: list(tmp_path.glob("feedback.jsonl.*.gz")))
+    log.log("second")
+    wait_for(lambda: log.written == 2)
+    assert log.rotate_errors == 0
+
+
+def test_stop_flushes_queue(tmp_path):
+    path = str(tmp_path / "logs" / "requests.jsonl")
+    log = EventLog(path, flush_interval=60)  # писатель ждёт событий дольше, чем идёт тест
+    log.start()
+    log.log("first")
+    wait_for(lambda: log.written == 1)
+    for n in range(1200):
+        log.log("event", n=n)
+    log.stop()
+    assert log.written == 1201 and log._file is None
+    assert len(read_events(path)) == 1201
+    assert not log._thread.is_alive()
+
+
+def test_stop_without_writer(tmp_path):
+    path = str(tmp_path / "feedback.jsonl")
+    log = EventLog(path)
+    log.log("feedback")
+    log.stop()
+    assert read_events(path) == ["feedback"]
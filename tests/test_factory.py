@@ -0,0 +1,37 @@
+"""services.factory: одни и те же сервисы для bot_v03.py и bot.py."""
+from contextlib import nullcontext
+
+from services.factory import build_services
+from tgbot.config import Config, DbConfig, Miscellaneous, TgBot
+
+
+def make_config(admin_group_id=-100):
+    return Config(
+        tg_bot=TgBot(token="1:AAA", admin_ids=[1], use_redis=False, admin_group_id=admin_group_id),
+        db=DbConfig(host="x", password="x", user="x", database="x"),
+        misc=Miscellaneous(),
+        openai_api_key="sk-test",
+    )
+
+
+def test_settings_come_from_config_and_env(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setenv("AUTO_MATCH", "1")
+    monkeypatch.setenv("QUEUE_BOARD", "1")
+    monkeypatch.delenv("TICKET_CARDS", raising=False)
+    monkeypatch.setenv("ROUTES_TTL", "2.5")
+    stages = []
+
+    def stage(name):
+        stages.append(name)
+        return nullcontext()
+
+    services = build_services(make_config(admin_group_id=-42), stage=stage)
+    try:
+        assert stages == ["storage", "services"]
+        assert services.matcher.enabled and services.routes.ttl == 2.5
+        assert services.board.chat_id == -42 and not services.ticket_cards
+        assert (tmp_path / "psyinc.db").exists()
+    finally:
+        services.request_log.stop()
+        services.feedback_log.stop()
@@ -0,0 +1,114 @@
+"""OpenAIGuard против локального фейкового OpenAI (utils/fake_openai.py) на свободном порту."""
+import threading
+import time
+
+import openai
+import pytest
+
+from services.gpt import GptPipeline
+from services.gpt_guard import GptRateLimitError, GptUnavailableError, OpenAIGuard
+from utils.fake_openai import FakeOpenAI
+
+MESSAGES = [{"role": "user", "content": "тревожно"}]
+
+
+@pytest.fixture
+def fake(monkeypatch):
+    fake = FakeOpenAI(port=0, chunk_delay=0)
+    monkeypatch.setattr(openai, "api_base", fake.start())
+    yield fake
+    fake.stop()
+
+
+def pipeline(**guard):
+    guard.setdefault("failure_threshold", 3)
+    guard.setdefault("cooldown", 0.2)
+    guard.setdefault("timeout", 5)
+    return GptPipeline(sender=None, api_key="sk-test", guard=OpenAIGuard(**guard))
+
+
+def fail(gpt, times: int):
+    for _ in range(times):
+        with pytest.raises(openai.error.OpenAIError):
+            gpt.complete(MESSAGES)
+
+
+@pytest.mark.parametrize("status", [500, 429])
+def test_breaker_opens_fails_fast_and_recovers(fake, status):
+    gpt = pipeline()
+    fake.configure(error_rate=1, status=status)
+    fail(gpt, 2)
+    assert gpt.guard.state == OpenAIGuard.CLOSED
+    fail(gpt, 1)
+    assert gpt.guard.state == OpenAIGuard.OPEN
+
+    # разомкнут: в OpenAI не ходим, отказ сразу
+    started = time.monotonic()
+    with pytest.raises(GptUnavailableError):
+        gpt.complete(MESSAGES)
+    assert time.monotonic() - started < 0.1
+    assert fake.stats["requests"] == 3
+
+    # после cooldown один пробный запрос; успех замыкает предохранитель
+    fake.configure(error_rate=0)
+    time.sleep(0.2)
+    assert gpt.complete(MESSAGES).startswith("Я вас слышу")
+    assert gpt.guard.state == OpenAIGuard.CLOSED
+    assert fake.stats["requests"] == 4
+    assert gpt.guard.in_flight == 0
+
+
+def test_failed_probe_reopens_and_is_the_only_request(fake):
+    gpt = pipeline()
+    fake.configure(error_rate=1)
+    fail(gpt, 3)
+    time.sleep(0.2)
+
+    fake.configure(latency=0.3)
+    errors = []
+
+    def run_probe():
+        try:
+            gpt.complete(MESSAGES)
+        except Exception as e:
+            errors.append(e)
+
+    probe = threading.Thread(target=run_probe)
+    probe.start()
+    time.sleep(0.1)
+    assert gpt.guard.state == OpenAIGuard.HALF_OPEN
+    with pytest.raises(GptUnavailableError):  # пока идёт пробный — остальные сразу отказ
+        gpt.complete(MESSAGES)
+    probe.join()
+
+    assert isinstance(errors[0], openai.error.OpenAIError)
+    assert gpt.guard.state == OpenAIGuard.OPEN
+    assert fake.stats["requests"] == 4
+
+
+def test_timeout_counts_as_failure(fake):
+    gpt = pipeline(failure_threshold=2, timeout=0.2)
+    fake.configure(latency=1)
+    fail(gpt, 2)
+    assert gpt.guard.state == OpenAIGuard.OPEN
+
+
+def test_bad_request_does_not_open_breaker(fake):
+    gpt = pipeline()
+    fake.configure(error_rate=1, status=400)
+    for _ in range(5):
+        with pytest.raises(openai.error.InvalidRequestError):
+            gpt.complete(MESSAGES)
+    assert gpt.guard.state == OpenAIGuard.CLOSED
+
+
+def test_chat_token_bucket():
+    guard = OpenAIGuard(chat_rate=1 / 60, chat_burst=2)
+    guard.check_chat(1)
+    guard.check_chat(1)
+    with pytest.raises(GptRateLimitError):
+        guard.check_chat(1)
+    guard.check_chat(2)  # у другого чата своё ведро
+    guard._buckets[1].updated -= 60  # прошла минута — один запрос снова можно
+    guard.check_chat(1)
+    assert not guard.allow(1)
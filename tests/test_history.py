@@ -0,0 +1,65 @@
+"""Свёртка истории в саммари, когда чат меняется, пока GPT пишет саммари."""
+import pytest
+
+from services.chat_store import ChatStore
+from services.db import Database
+from services.history import HistoryManager
+from services.redis_state import RedisChatStore
+
+
+@pytest.fixture(params=["sqlite", "redis"])
+def store(request, tmp_path):
+    if request.param == "sqlite":
+        return ChatStore(Database(str(tmp_path / "psyinc.db")))
+    fakeredis = pytest.importorskip("fakeredis")
+    return RedisChatStore("", local_ttl=60, client=fakeredis.FakeRedis(decode_responses=True))
+
+
+class FakeGpt:
+    def __init__(self, during=None):
+        self.during = during  # что происходит с чатом, пока «идёт запрос»
+
+    def complete(self, messages, max_tokens=None):
+        if self.during:
+            self.during()
+        return "итог"
+
+
+def fill(store, count=6):
+    for n in range(count):
+        store.append_message(1, "user" if n % 2 == 0 else "assistant", f"реплика {n} " + "x" * 40)
+
+
+def compact(store, gpt):
+    history = HistoryManager(store, gpt, "промпт", budget=60, keep_ratio=0.5)
+    history._compact(1)
+    return history
+
+
+def test_fold_drops_summarized_turns(store):
+    fill(store)
+    compact(store, FakeGpt())
+    contents = [m["content"] for m in store.get_history(1)]
+    assert store.get_summary(1) == "итог"
+    assert contents and contents[-1].startswith("реплика 5")
+    assert not any(c.startswith("реплика 0") for c in contents)
+
+
+def test_reset_during_summary_keeps_new_conversation(store):
+    fill(store)
+
+    def reset_and_talk():
+        store.clear_history(1)
+        store.append_message(1, "user", "новый разговор")
+
+    compact(store, FakeGpt(reset_and_talk))
+    assert store.get_history(1) == [{"role": "user", "content": "новый разговор"}]
+    assert store.get_summary(1) is None
+
+
+def test_new_messages_during_summary_are_kept(store):
+    fill(store)
+    compact(store, FakeGpt(lambda: store.append_message(1, "user", "пока думали")))
+    contents = [m["content"] for m in store.get_history(1)]
+    assert contents[-1] == "пока думали"
+    assert any(c.startswith("реплика 5") for c in contents)
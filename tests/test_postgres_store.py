@@ -0,0 +1,159 @@
+"""PostgresSessionStore на настоящем PostgreSQL.
+
+Сервер берётся из TEST_POSTGRES_DSN (например, контейнер db из docker-compose.yml:
+TEST_POSTGRES_DSN="host=127.0.0.1 user=... password=... dbname=postgres"), иначе
+поднимается одноразовый кластер через initdb/pg_ctl, если они есть в PATH.
+Тесты работают в отдельной базе psyinc_test, которая пересоздаётся на каждый тест.
+Без сервера тесты пропускаются.
+"""
+import os
+import shutil
+import socket
+import subprocess
+import threading
+
+import psycopg2
+import pytest
+from psycopg2.extensions import parse_dsn
+
+from services.db import Database
+from services.session_store import PostgresSessionStore, SqliteSessionStore
+
+TEST_DATABASE = "psyinc_test"
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+@pytest.fixture(scope="session")
+def server(tmp_path_factory):
+    """Параметры подключения к служебной базе сервера (dict для psycopg2.connect)."""
+    dsn = os.getenv("TEST_POSTGRES_DSN")
+    if dsn:
+        yield parse_dsn(dsn)
+        return
+    if not (shutil.which("initdb") and shutil.which("pg_ctl")):
+        pytest.skip("нет TEST_POSTGRES_DSN и initdb/pg_ctl в PATH")
+
+    data = tmp_path_factory.mktemp("pgdata")
+    port = _free_port()
+    subprocess.run(["initdb", "-D", str(data), "-U", "postgres", "--auth=trust"],
+                   check=True, capture_output=True)
+    subprocess.run(["pg_ctl", "-D", str(data), "-w", "-l", str(data / "server.log"),
+                    "-o", f"-p {port} -k {data} -c listen_addresses=127.0.0.1", "start"],
+                   check=True, capture_output=True)
+    try:
+        yield {"host": "127.0.0.1", "port": port, "user": "postgres", "password": "", "dbname": "postgres"}
+    finally:
+        subprocess.run(["pg_ctl", "-D", str(data), "-m", "immediate", "stop"], capture_output=True)
+
+
+def _admin(server, sql: str):
+    conn = psycopg2.connect(**server)
+    conn.autocommit = True
+    try:
+        with conn.cursor() as cur:
+            cur.execute(sql)
+    finally:
+        conn.close()
+
+
+@pytest.fixture
+def store(server):
+    _admin(server, f"DROP DATABASE IF EXISTS {TEST_DATABASE}")
+    _admin(server, f"CREATE DATABASE {TEST_DATABASE}")
+    store = PostgresSessionStore(
+        host=server.get("host", "127.0.0.1"),
+        port=int(server.get("port", 5432)),
+        user=server.get("user"),
+        password=server.get("password", ""),
+        database=TEST_DATABASE,
+        max_connections=8,
+    )
+    yield store
+    store.close_pool()
+    _admin(server, f"DROP DATABASE IF EXISTS {TEST_DATABASE}")
+
+
+def test_session_lifecycle(store):
+    store.create("T-1", 100, "2024-01-01 00:00:00")
+    assert store.participant(100) == ("T-1", "user", None, "waiting")
+    assert store.waiting() == [("T-1", "2024-01-01 00:00:00")]
+
+    assert store.claim("T-1", 200) == 100
+    assert store.claim("T-1", 201) is None
+    assert store.participant(200) == ("T-1", "listener", 100, "active")
+    assert store.active_for_user(100)[1:5] == ("T-1", 100, 200, "active")
+
+    store.close("T-1")
+    assert store.participant(100) is None
+    assert store.get_by_ticket("T-1")[4] == "closed"
+
+
+def test_idle_is_counted_from_claim(store):
+    store.create("T-1", 100, "2000-01-01 00:00:00")
+    store.create("T-2", 101, "2000-01-01 00:00:00")
+    store.claim("T-1", 200)
+    store.assign("T-2", 201)
+    assert store.expire_stale("", "2000-01-02 00:00:00") == []
+    assert store.get_by_ticket("T-1")[4] == "active"
+
+
+def test_prepared_statements_survive_pool_churn(store):
+    """Подготовленные запросы выполняются на любом соединении пула, сколько бы их ни брали разом."""
+    store.create("T-1", 100, "2024-01-01 00:00:00")
+    for _ in range(20):
+        with store._cursor() as first, store._cursor() as second, store._cursor() as third:
+            for cur in (first, second, third):
+                cur.execute("EXECUTE s_by_ticket (%s)", ("T-1",))
+                assert cur.fetchone()[1] == "T-1"
+        assert store.get_by_ticket("T-1")[1] == "T-1"
+
+
+def test_concurrent_claims(store):
+    threads, capacity = 8, 3
+    store.create("SHARED", 100, "2024-01-01 00:00:00")
+    for n in range(threads):
+        store.create(f"T-{n}", 200 + n, "2024-01-01 00:00:00")
+
+    barrier = threading.Barrier(threads)
+    shared, own = [None] * threads, [None] * threads
+
+    def worker(n):
+        barrier.wait()
+        shared[n] = store.claim("SHARED", 1000 + n)
+        own[n] = store.claim(f"T-{n}", 7, capacity=capacity)
+
+    workers = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    for thread in workers:
+        thread.start()
+    for thread in workers:
+        thread.join()
+
+    assert sum(user_id is not None for user_id in shared) == 1
+    assert sum(user_id is not None for user_id in own) == capacity
+    with store._cursor() as cur:
+        cur.execute("SELECT COUNT(*) FROM sessions WHERE listener_id=7 AND status<>'closed'")
+        assert cur.fetchone()[0] == capacity
+
+
+def test_rows_round_trip_between_backends(store, tmp_path):
+    sqlite_store = SqliteSessionStore(Database(str(tmp_path / "psyinc.db")))
+    sqlite_store.create("T-1", 100, "2024-01-01 00:00:00")
+    sqlite_store.create("T-2", 101, "2024-01-01 00:00:01")
+    sqlite_store.claim("T-2", 200)
+    sqlite_store.set_listener(200, True, 2)
+    rows = [tuple(row) for row in sqlite_store.iter_rows()]
+    assert rows[1][-1] is not None  # last_activity с подключения слушателя
+
+    store.import_rows(rows)
+    store.import_listeners(sqlite_store.listeners())
+    assert [tuple(row) for row in store.iter_rows(batch=1)] == rows
+    assert store.listeners() == [(200, True, 2)]
+    assert store.expire_stale("", "2024-01-01 00:00:00") == []
+    # последовательность сдвинута за перенесённые id
+    store.create("T-3", 102, "2024-01-01 00:00:02")
+    assert store.get_by_ticket("T-3")[0] == rows[-1][0] + 1
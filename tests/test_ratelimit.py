@@ -0,0 +1,39 @@
+"""TokenBucket, лимиты Telegram и пауза чата по retry_after."""
+import time
+
+from aiogram.utils.exceptions import RetryAfter
+from telebot.apihelper import ApiTelegramException
+
+from services.ratelimit import TelegramLimits, TokenBucket
+from services.sender import _retry_after
+
+
+def test_token_bucket_refills_to_capacity():
+    bucket = TokenBucket(rate=2, capacity=3)
+    now = bucket.updated
+    assert [bucket.take(now) for _ in range(4)] == [True, True, True, False]
+    assert bucket.delay(now) == 0.5
+    assert bucket.take(now + 0.5)
+    # за долгий простой копится не больше capacity
+    assert [bucket.take(now + 100) for _ in range(4)] == [True, True, True, False]
+
+
+def test_retry_after_blocks_only_that_chat():
+    limits = TelegramLimits(chat_rate=1000, chat_burst=1000)
+    now = time.monotonic()
+    limits.block(1, 30)
+    assert 29 < limits.chat_delay(1, now) < 31
+    assert limits.chat_delay(2, now) == 0
+    limits.take(1, now + 30)  # отправили после паузы — блокировка снята
+    assert limits.chat_delay(1, now + 30) == 0
+
+
+def test_retry_after_from_telegram_errors():
+    flood = ApiTelegramException("sendMessage", None, {
+        "ok": False, "error_code": 429, "description": "Too Many Requests: retry after 17",
+        "parameters": {"retry_after": 17}})
+    assert _retry_after(flood) == 17
+    assert _retry_after(RetryAfter(5)) == 5
+    forbidden = ApiTelegramException("sendMessage", None, {
+        "ok": False, "error_code": 403, "description": "Forbidden: bot was blocked by the user"})
+    assert _retry_after(forbidden) is None
@@ -0,0 +1,138 @@
+"""RedisChatStore на redis-server (TEST_REDIS_URL, база очищается) или на fakeredis в процессе."""
+import json
+import os
+
+import pytest
+import redis
+
+from services.redis_state import RedisChatStore
+
+
+@pytest.fixture
+def client():
+    url = os.getenv("TEST_REDIS_URL")
+    if url:
+        client = redis.Redis.from_url(url, decode_responses=True)
+    else:
+        fakeredis = pytest.importorskip("fakeredis")
+        client = fakeredis.FakeRedis(decode_responses=True)
+    client.flushdb()
+    yield client
+    client.flushdb()
+
+
+@pytest.fixture
+def round_trips(monkeypatch):
+    """Счётчик обращений к серверу: одиночные команды и выполнение pipeline."""
+    calls = []
+    command, execute = redis.Redis.execute_command, redis.client.Pipeline.execute
+
+    def counted_command(self, *args, **kwargs):
+        calls.append(args[0])
+        return command(self, *args, **kwargs)
+
+    def counted_execute(self, *args, **kwargs):
+        calls.append("PIPELINE")
+        return execute(self, *args, **kwargs)
+
+    monkeypatch.setattr(redis.Redis, "execute_command", counted_command)
+    monkeypatch.setattr(redis.client.Pipeline, "execute", counted_execute)
+    return calls
+
+
+def store(client, local_ttl=2.0):
+    return RedisChatStore("", ttl=3600, local_ttl=local_ttl, client=client)
+
+
+def test_state_round_trip(client):
+    chats = store(client)
+    chats.set_mode(1, "self_help")
+    chats.bind_ticket(1, "U-1")
+    chats.bind_ticket(1, "U-2")
+    chats.append_message(1, "user", "привет")
+    chats.append_message(1, "assistant", "здравствуйте")
+    chats.set_step(1, "FeedbackForm:text", {"ticket": "U-2"}, ttl=60)
+
+    # другой процесс видит всё, что записано
+    other = store(client)
+    assert other.get_mode(1) == "self_help"
+    assert other.get_ticket(1) == "U-2"
+    assert other.ticket_owner("U-2") == 1
+    assert other.ticket_owner("U-1") is None
+    assert other.get_history(1) == [{"role": "user", "content": "привет"},
+                                    {"role": "assistant", "content": "здравствуйте"}]
+    assert other.get_step(1) == ("FeedbackForm:text", {"ticket": "U-2"})
+    assert 0 < client.ttl("chat:1") <= 3600
+    assert 0 < client.ttl("chat:1:turns") <= 3600
+
+    chats.clear_step(1)
+    chats.fold_into_summary(1, "поздоровались", [{"role": "user", "content": "привет"}])
+    other = store(client)
+    assert other.get_step(1) is None
+    assert other.get_summary(1) == "поздоровались"
+    assert other.get_history(1) == [{"role": "assistant", "content": "здравствуйте"}]
+
+    chats.clear_history(1)
+    assert store(client).get_history(1) == []
+    assert store(client).get_summary(1) is None
+
+
+def test_expired_step_is_ignored(client):
+    chats = store(client)
+    chats.set_step(1, "TicketReply:text", {}, ttl=-1)
+    assert chats.get_step(1) is None
+
+
+def test_legacy_system_message_is_removed(client):
+    client.rpush("chat:1:turns",
+                 json.dumps({"role": "system", "content": "промпт"}, ensure_ascii=False),
+                 json.dumps({"role": "user", "content": "тревога"}, ensure_ascii=False))
+    client.rpush("chat:2:turns", json.dumps({"role": "system", "content": "промпт"}, ensure_ascii=False),
+                 json.dumps({"role": "user", "content": "a"}, ensure_ascii=False),
+                 json.dumps({"role": "user", "content": "b"}, ensure_ascii=False))
+    chats = store(client)
+    assert chats.get_history(1) == [{"role": "user", "content": "тревога"}]
+    assert client.llen("chat:1:turns") == 1
+
+    # fold_into_summary по старой истории срезает реплики, а не копию промпта
+    chats_stale = store(client, local_ttl=0)
+    chats_stale.fold_into_summary(2, "итог", [{"role": "user", "content": "a"}])
+    assert [json.loads(t)["content"] for t in client.lrange("chat:2:turns", 0, -1)] == ["b"]
+
+
+@pytest.mark.parametrize("local_ttl", [0, 60])
+def test_each_operation_is_one_round_trip(client, round_trips, local_ttl):
+    """Со свежей локальной копией и без неё: запись не читает чат отдельным запросом."""
+    chats = store(client, local_ttl=local_ttl)
+    chats.get(1)
+    operations = [
+        lambda: chats.set_mode(1, "self_help"),
+        lambda: chats.bind_ticket(1, "U-1"),
+        lambda: chats.bind_ticket(1, "U-2"),
+        lambda: chats.append_message(1, "user", "привет"),
+        lambda: chats.set_history(1, [{"role": "user", "content": "привет"}]),
+        lambda: chats.set_step(1, "FeedbackForm:text", {}, ttl=60),
+        lambda: chats.clear_step(1),
+        lambda: chats.set_summary(1, "итог"),
+        lambda: chats.fold_into_summary(1, "итог 2", [{"role": "user", "content": "привет"}]),
+        lambda: chats.clear_history(1),
+        lambda: chats.get_mode(1),
+    ]
+    for operation in operations:
+        round_trips.clear()
+        operation()
+        assert len(round_trips) <= 1, round_trips
+
+    # после записи без свежей копии локальное состояние перечитано из того же MULTI
+    assert chats.get_ticket(1) == "U-2"
+    assert chats.get_mode(1) == "self_help"
+
+
+def test_write_without_local_copy_rereads_chat(client):
+    store(client).set_mode(1, "listener")
+    reader = store(client)  # локальной копии нет
+    reader.append_message(1, "user", "x")
+    cached = reader._fresh(1)
+    assert cached is not None
+    assert cached.mode == "listener"
+    assert cached.history.messages() == [{"role": "user", "content": "x"}]
@@ -0,0 +1,143 @@
+"""RelayRoutes с несколькими диалогами у слушателя и очередь ListenerMatcher."""
+from services.db import Database
+from services.matcher import ListenerMatcher
+from services.routing import RelayRoutes
+from services.session_store import SqliteSessionStore
+
+LISTENER = 500
+
+
+def test_second_dialog_needs_reply_or_choice():
+    routes = RelayRoutes()
+    routes.open("T-1", 100)
+    routes.assign("T-1", LISTENER)
+    assert routes.resolve(LISTENER).counterpart == 100
+
+    routes.open("T-2", 101)
+    routes.assign("T-2", LISTENER)
+    # новый диалог не перехватывает сообщения без reply
+    assert routes.resolve(LISTENER) is None
+    assert routes.load(LISTENER) == 2
+    assert routes.tickets(LISTENER) == ["T-1", "T-2"]
+    # reply выбирает диалог, но не делает его текущим
+    assert routes.resolve(LISTENER, "T-2").counterpart == 101
+    assert routes.resolve(LISTENER) is None
+    # у пользователя диалог один — без вопросов
+    assert routes.resolve(101).counterpart == LISTENER
+
+    assert routes.select(LISTENER, "T-2").counterpart == 101
+    assert routes.resolve(LISTENER).counterpart == 101
+
+    # выбранный диалог закрыли — снова спрашиваем, пока диалогов больше одного
+    routes.open("T-3", 102)
+    routes.assign("T-3", LISTENER)
+    routes.close("T-2")
+    assert routes.resolve(LISTENER) is None
+    routes.close("T-3")
+    assert routes.resolve(LISTENER).counterpart == 100
+
+
+def test_reply_to_closed_dialog_is_not_rerouted():
+    routes = RelayRoutes()
+    for n, ticket in enumerate(("T-1", "T-2")):
+        routes.open(ticket, 100 + n)
+        routes.assign(ticket, LISTENER)
+    routes.close("T-1")
+    assert routes.resolve(LISTENER, "T-1") is None
+    assert routes.resolve(LISTENER).counterpart == 101
+    assert routes.select(LISTENER, "T-1") is None
+
+
+def test_waiting_queue_is_bounded(tmp_path):
+    sessions = SqliteSessionStore(Database(str(tmp_path / "psyinc.db")))
+    routes = RelayRoutes()
+
+    def open_and_take(matcher, n):
+        ticket = f"T-{n}"
+        sessions.create(ticket, 1000 + n, "2024-01-01 00:00:00")
+        routes.open(ticket, 1000 + n)
+        matcher.enqueue(ticket)
+        sessions.claim(ticket, LISTENER, capacity=10 ** 6)  # взяли кнопкой, match() не вызывался
+        routes.assign(ticket, LISTENER)
+
+    disabled = ListenerMatcher(sessions, routes, enabled=False)
+    for n in range(100):
+        open_and_take(disabled, n)
+    assert disabled._waiting == []
+
+    enabled = ListenerMatcher(sessions, routes)
+    for n in range(100, 1100):
+        open_and_take(enabled, n)
+    assert len(enabled._waiting) <= 2 * routes.waiting_count() + 65
+
+
+def test_routes_follow_other_process(tmp_path):
+    sessions = SqliteSessionStore(Database(str(tmp_path / "psyinc.db")))
+    here, there = RelayRoutes(ttl=0), RelayRoutes(ttl=0)  # два процесса на одной базе
+
+    sessions.create("T-1", 100, "2024-01-01 00:00:00")
+    there.open("T-1", 100)
+    here.refresh(100, sessions.open_for_chat)
+    assert here.resolve(100).counterpart is None
+
+    # слушатель взял заявку в другом процессе — сообщение пользователя уходит ему
+    sessions.claim("T-1", LISTENER)
+    there.assign("T-1", LISTENER)
+    here.refresh(100, sessions.open_for_chat)
+    assert here.resolve(100).counterpart == LISTENER
+    here.refresh(LISTENER, sessions.open_for_chat)
+    assert here.resolve(LISTENER).counterpart == 100
+
+    # закрыли там — здесь маршрута больше нет ни у одной стороны
+    sessions.close("T-1")
+    there.close("T-1")
+    here.refresh(LISTENER, sessions.open_for_chat)
+    assert here.get(LISTENER) is None and here.get(100) is None
+
+
+def test_fresh_routes_are_not_reread(tmp_path):
+    sessions = SqliteSessionStore(Database(str(tmp_path / "psyinc.db")))
+    routes = RelayRoutes(ttl=60)
+    calls = []
+
+    def fetch(chat_id):
+        calls.append(chat_id)
+        return sessions.open_for_chat(chat_id)
+
+    routes.refresh(100, fetch)
+    sessions.create("T-1", 100, "2024-01-01 00:00:00")
+    routes.refresh(100, fetch)  # до истечения ttl — из памяти
+    assert calls == [100] and routes.get(100) is None
+    routes._synced[100] -= 60
+    routes.refresh(100, fetch)
+    assert calls == [100, 100] and routes.get(100).ticket == "T-1"
+
+
+def test_match_claims_without_holding_lock(tmp_path):
+    sessions = SqliteSessionStore(Database(str(tmp_path / "psyinc.db")))
+    routes = RelayRoutes()
+    matcher = ListenerMatcher(sessions, routes, default_capacity=2)
+    claim = sessions.claim
+    locked = []
+
+    def watched_claim(ticket, listener_id, capacity=1):
+        locked.append(matcher._lock.locked())
+        if ticket == "T-0":
+            sessions.create("T-9", 109, "2024-01-01 00:00:09")  # новая заявка, пока идёт claim
+            routes.open("T-9", 109)
+            matcher.enqueue("T-9")
+        if ticket == "T-1":
+            claim(ticket, 777)  # заявку успели взять в другом процессе
+            return None
+        return claim(ticket, listener_id, capacity)
+
+    sessions.claim = watched_claim
+    for n in range(3):
+        sessions.create(f"T-{n}", 100 + n, f"2024-01-01 00:00:0{n}")
+        routes.open(f"T-{n}", 100 + n)
+        matcher.enqueue(f"T-{n}")
+    matcher.set_available(LISTENER, True)
+
+    assert matcher.match() == [("T-0", 100, LISTENER), ("T-2", 102, LISTENER)]
+    assert locked and not any(locked)
+    assert [ticket for _, ticket in matcher._waiting] == ["T-9"]
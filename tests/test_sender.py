@@ -0,0 +1,86 @@
+import threading
+import time
+
+from services.sender import PRIORITY_LOW, PRIORITY_NORMAL, PRIORITY_RELAY, OutboundQueue
+
+
+class FakeBot:
+    def __init__(self, fail=None):
+        self.sent = []
+        self.fail = fail or {}  # text -> сколько раз ответить 429
+        self._lock = threading.Lock()
+
+    def send_message(self, chat_id, text, **kwargs):
+        with self._lock:
+            if self.fail.get(text):
+                self.fail[text] -= 1
+                raise TooManyRequests(0.05)
+            self.sent.append((chat_id, text))
+        return text
+
+
+class TooManyRequests(Exception):
+    error_code = 429
+
+    def __init__(self, retry_after):
+        super().__init__("Too Many Requests")
+        self.result_json = {"parameters": {"retry_after": retry_after}}
+
+
+def queue(bot=None, **kwargs):
+    limits = dict(global_rate=1e6, chat_rate=1e6, chat_burst=1e6)
+    limits.update(kwargs)
+    return OutboundQueue(bot or FakeBot(), **limits)
+
+
+def drain(sender, now):
+    """Задачи в порядке, в каком их выдал бы диспетчер (каждая сразу завершается)."""
+    picked = []
+    with sender._cond:
+        while True:
+            job, _ = sender._pick(now)
+            if job is None:
+                return picked
+            picked.append((job.chat_id, job.args[1]))
+            sender._finish(job, requeue=False)
+
+
+def test_chat_order_ignores_priority():
+    sender = queue()
+    sender.send_message(1, "диалог завершён", priority=PRIORITY_NORMAL)
+    sender.send_message(1, "реплика", priority=PRIORITY_RELAY)
+    sender.send_message(2, "уведомление", priority=PRIORITY_LOW)
+    sender.send_message(3, "ответ слушателя", priority=PRIORITY_RELAY)
+    order = drain(sender, time.monotonic())
+    # внутри чата — порядок постановки, между чатами — приоритет первого вызова чата
+    assert [text for chat, text in order if chat == 1] == ["диалог завершён", "реплика"]
+    assert order[0] == (3, "ответ слушателя")
+    assert order[-1] == (2, "уведомление")
+
+
+def test_blocked_chat_is_not_rescanned():
+    sender = queue()
+    sender._limits.block(1, 60)
+    for n in range(1000):
+        sender.send_message(1, f"m{n}")
+    sender.send_message(2, "свободный чат")
+    now = time.monotonic()
+    assert drain(sender, now) == [(2, "свободный чат")]
+    # заблокированный чат — одна запись в heap по времени разблокировки, а не 1000 задач
+    assert len(sender._blocked) == 1
+    job, wait = sender._pick(now)
+    assert job is None and 59 < wait <= 60
+    assert drain(sender, now + 61)[:2] == [(1, "m0"), (1, "m1")]
+
+
+def test_retry_after_keeps_chat_order():
+    bot = FakeBot(fail={"первое": 2})
+    sender = queue(bot)
+    sender.start()
+    futures = [sender.send_message(1, "первое"), sender.send_message(1, "второе"),
+               sender.send_message(2, "другой чат")]
+    for future in futures:
+        future.result(timeout=5)
+    assert [text for chat, text in bot.sent if chat == 1] == ["первое", "второе"]
+    # чат 2 не ждал, пока чат 1 отсиживал retry_after
+    assert bot.sent.index((2, "другой чат")) < bot.sent.index((1, "первое"))
@@ -0,0 +1,66 @@
+import threading
+
+import pytest
+
+from services.db import Database
+from services.session_store import SqliteSessionStore
+
+THREADS = 16
+ROUNDS = 20
+
+
+@pytest.fixture
+def store(tmp_path):
+    db = Database(str(tmp_path / "sessions.db"))
+    return SqliteSessionStore(db)
+
+
+def run_together(target, count=THREADS):
+    """count потоков стартуют одновременно (барьер) и вызывают target(n)."""
+    barrier = threading.Barrier(count)
+    results = [None] * count
+    errors = []
+
+    def worker(n):
+        barrier.wait()
+        try:
+            results[n] = target(n)
+        except Exception as e:
+            errors.append(e)
+
+    threads = [threading.Thread(target=worker, args=(n,)) for n in range(count)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert not errors
+    return results
+
+
+@pytest.mark.parametrize("round_", range(ROUNDS))
+def test_one_ticket_has_exactly_one_winner(store, round_):
+    store.create("T-1", 100, "2024-01-01 00:00:00")
+
+    results = run_together(lambda n: store.claim("T-1", 1000 + n, capacity=1))
+
+    winners = [n for n, user_id in enumerate(results) if user_id is not None]
+    assert len(winners) == 1
+    assert results[winners[0]] == 100
+    row = store.get_by_ticket("T-1")
+    assert row[3] == 1000 + winners[0]
+    assert row[4] == "active"
+
+
+@pytest.mark.parametrize("round_", range(ROUNDS))
+def test_listener_capacity_is_never_exceeded(store, round_):
+    capacity = 3
+    for n in range(THREADS):
+        store.create(f"T-{n}", 100 + n, "2024-01-01 00:00:00")
+
+    results = run_together(lambda n: store.claim(f"T-{n}", 7, capacity=capacity))
+
+    assert sum(user_id is not None for user_id in results) == capacity
+    open_for_listener = store.db.fetchone(
+        "SELECT COUNT(*) FROM sessions WHERE listener_id=7 AND status!='closed'")[0]
+    assert open_for_listener == capacity
+    assert len(store.waiting()) == THREADS - capacity
@@ -0,0 +1,51 @@
+from datetime import datetime, timedelta
+
+from services.db import Database
+from services.session_store import SqliteSessionStore
+
+
+def ago(hours: float) -> str:
+    return (datetime.now() - timedelta(hours=hours)).strftime("%Y-%m-%d %H:%M:%S")
+
+
+def expire(store):
+    """Как ExpirySweeper с SESSION_WAIT_TIMEOUT=24ч и SESSION_IDLE_TIMEOUT=6ч."""
+    return store.expire_stale(ago(24), ago(6))
+
+
+def test_idle_is_counted_from_claim(tmp_path):
+    store = SqliteSessionStore(Database(str(tmp_path / "sessions.db")))
+    store.create("CLAIMED", 100, ago(7))
+    store.create("ASSIGNED", 101, ago(7))
+    store.create("IDLE", 102, ago(30))
+    store.create("WAITING", 103, ago(30))
+    assert store.claim("CLAIMED", 200) == 100
+    store.assign("ASSIGNED", 201)
+    store.claim("IDLE", 202)
+    store.touch_many([(ago(7), "IDLE")])
+
+    # дождались слушателя дольше SESSION_IDLE_TIMEOUT, но сам диалог только начался
+    assert sorted(expire(store)) == [("IDLE", 102, 202), ("WAITING", 103, None)]
+    assert store.get_by_ticket("CLAIMED")[4] == "active"
+    assert store.get_by_ticket("ASSIGNED")[4] == "active"
+    assert expire(store) == []
+
+
+
+def test_migrated_session_keeps_activity(tmp_path):
+    """Перенос (utils/migrate_sessions.py) сохраняет last_activity и слушателей: недавно активный
+       диалог, созданный давно, чистка на новой базе не закрывает."""
+    source = SqliteSessionStore(Database(str(tmp_path / "source.db")))
+    source.create("RECENT", 100, ago(30))
+    source.claim("RECENT", 200)
+    source.touch_many([(ago(1), "RECENT")])
+    source.set_listener(200, True, 3)
+
+    target = SqliteSessionStore(Database(str(tmp_path / "target.db")))
+    target.create("RECENT", 100, ago(30))  # повторный перенос поверх старой строки
+    target.import_rows([tuple(row) for row in source.iter_rows(batch=1)])
+    target.import_listeners(source.listeners())
+
+    assert expire(target) == []
+    assert target.get_by_ticket("RECENT")[4] == "active"
+    assert target.listeners() == [(200, True, 3)]
@@ -0,0 +1,45 @@
+"""Миграции схемы SqliteSessionStore: номер в user_version меняется вместе со схемой."""
+import sqlite3
+
+import pytest
+
+from services import session_store
+from services.db import Database
+from services.session_store import SQLITE_MIGRATIONS, SqliteSessionStore
+
+
+def user_version(db: Database) -> int:
+    return db.fetchone("PRAGMA user_version")[0]
+
+
+def test_failed_migration_is_rolled_back(tmp_path, monkeypatch):
+    path = str(tmp_path / "psyinc.db")
+    SqliteSessionStore(Database(path))
+
+    broken = "CREATE TABLE half_done (x INTEGER);\nINSERT INTO missing_table VALUES (1);\n"
+    monkeypatch.setattr(session_store, "SQLITE_MIGRATIONS", SQLITE_MIGRATIONS + [broken])
+    db = Database(path)
+    with pytest.raises(sqlite3.OperationalError):
+        SqliteSessionStore(db)
+    assert user_version(db) == len(SQLITE_MIGRATIONS)
+    assert db.fetchone("SELECT name FROM sqlite_master WHERE name='half_done'") is None
+
+    # исправленная миграция применяется со следующего старта
+    monkeypatch.setattr(session_store, "SQLITE_MIGRATIONS",
+                        SQLITE_MIGRATIONS + ["CREATE TABLE half_done (x INTEGER);"])
+    SqliteSessionStore(Database(path))
+    assert user_version(Database(path)) == len(SQLITE_MIGRATIONS) + 1
+
+
+def test_column_added_without_version_bump(tmp_path):
+    """Прежний код мог упасть между ALTER TABLE и PRAGMA user_version: колонка есть, номер — 2."""
+    path = str(tmp_path / "psyinc.db")
+    db = Database(path)
+    SqliteSessionStore(db)
+    db.execute("PRAGMA user_version = 2")
+
+    db = Database(path)
+    store = SqliteSessionStore(db)
+    assert user_version(db) == len(SQLITE_MIGRATIONS)
+    store.create("T-1", 100, "2024-01-01 00:00:00")
+    store.touch_many([("2024-01-01 00:00:01", "T-1")])
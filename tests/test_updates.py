@@ -0,0 +1,43 @@
+import json
+import time
+from types import SimpleNamespace
+
+from services.db import Database
+from services.updates import UpdateJournal
+
+
+def update(update_id: int, age: float = 0):
+    return SimpleNamespace(update_id=update_id,
+                           message=SimpleNamespace(date=int(time.time() - age), edit_date=None))
+
+
+def accept(journal, *updates):
+    fresh = journal.accept(list(updates), [json.dumps({"update_id": u.update_id}) for u in updates])
+    return [u.update_id for u in fresh]
+
+
+def test_update_is_processed_only_after_done(tmp_path):
+    db = Database(str(tmp_path / "psyinc.db"))
+    journal = UpdateJournal(db)
+    assert accept(journal, update(1), update(2), update(3, age=3600)) == [1, 2]
+    # в работе — повтор отбрасывается, но обработанным апдейт ещё не считается
+    assert accept(journal, update(1)) == []
+    journal.done(1)
+    assert accept(journal, update(1)) == []
+
+    # «перезапуск»: 2 принят, но хэндлер не закончил — он в pending и принимается заново
+    restarted = UpdateJournal(db)
+    assert restarted.pending() == [(2, json.dumps({"update_id": 2}))]
+    assert accept(restarted, update(1), update(2), update(3)) == [2]
+    assert restarted.pending() == []
+    restarted.done(2)
+    assert UpdateJournal(db).pending() == []
+    assert accept(UpdateJournal(db), update(2)) == []
+
+
+def test_offset_checkpoint(tmp_path):
+    journal = UpdateJournal(Database(str(tmp_path / "psyinc.db")))
+    assert journal.offset() is None
+    journal.checkpoint(42)
+    journal.checkpoint(43)
+    assert journal.offset() == 43
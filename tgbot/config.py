@@ -9,6 +9,9 @@ class DbConfig:
     password: str
     user: str
     database: str
+    engine: str = "sqlite"   # sqlite | postgres — где хранить сессии
+    port: int = 5432
+    pool_size: int = 10
 
 
 @dataclass
@@ -16,6 +19,12 @@ class TgBot:
     token: str
     admin_ids: list[int]
     use_redis: bool
+    redis_url: str = "redis://localhost:6379/0"
+    webhook_url: str = ""         # пусто — работаем через polling
+    webhook_secret: str = ""      # X-Telegram-Bot-Api-Secret-Token
+    webhook_register: bool = True  # False — вебхук регистрируется снаружи
+    webhook_port: int = 8080
+    admin_group_id: int = 0       # группа слушателей (заявки, отзывы)
 
 
 @dataclass
@@ -39,12 +48,21 @@ def load_config(path: str = None):
             token=env.str("BOT_TOKEN"),
             admin_ids=list(map(int, env.list("ADMINS"))),
             use_redis=env.bool("USE_REDIS"),
+            redis_url=env.str("REDIS_URL", "redis://localhost:6379/0"),
+            webhook_url=env.str("WEBHOOK_URL", ""),
+            webhook_secret=env.str("WEBHOOK_SECRET", ""),
+            webhook_register=env.bool("WEBHOOK_REGISTER", True),
+            webhook_port=env.int("PORT", 8080),
+            admin_group_id=env.int("ADMIN_GROUP_ID", -1003083102736),
         ),
         db=DbConfig(
             host=env.str('DB_HOST'),
             password=env.str('DB_PASS'),
             user=env.str('DB_USER'),
-            database=env.str('DB_NAME')
+            database=env.str('DB_NAME'),
+            engine=env.str('DB_ENGINE', 'sqlite'),
+            port=env.int('DB_PORT', 5432),
+            pool_size=env.int('DB_POOL_SIZE', 10),
         ),
         misc=Miscellaneous(),
         openai_api_key=env.str("OPENAI_API_KEY")  # загрузка ключа API
@@ -0,0 +1,408 @@
+"""Микробенчмарки хранения состояния, поиска сессий и маршрутизации.
+
+    python utils/bench.py [--scale small|medium|large] [--out bench_results] [--compare bench_results/<файл>.json]
+
+На синтетических данных (1k/10k/100k чатов, длинные истории GPT, миллионы
+закрытых сессий на large) замеряет запись состояния, загрузку при старте,
+поиск сессий, создание тикетов, пересылку и память историй GPT на чат
+(прежние списки словарей с копией промпта против CompactHistory). Telegram и OpenAI заменены
+заглушками — сеть не нужна. Для каждого сценария печатаются ops/s, p50 и
+p99; результат сохраняется в JSON, --compare показывает разницу с прошлым
+прогоном.
+"""
+import argparse
+import json
+import os
+import random
+import shutil
+import sqlite3
+import sys
+import tempfile
+import time
+import tracemalloc
+import types
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SCALES = {
+    # чаты, длина истории GPT, закрытые сессии, операций на сценарий
+    "small": {"chats": [1000], "history": 50, "closed_sessions": 100_000, "ops": 2000},
+    "medium": {"chats": [1000, 10_000], "history": 100, "closed_sessions": 1_000_000, "ops": 5000},
+    "large": {"chats": [1000, 10_000, 100_000], "history": 200, "closed_sessions": 3_000_000, "ops": 10_000},
+}
+
+
+# ------------------ заглушки Telegram и OpenAI ------------------
+class FakeBot:
+    """Отвечает как telebot, но без сети."""
+
+    def __init__(self, latency: float = 0.0):
+        self.latency = latency
+        self.calls = 0
+        self._message_id = 0
+
+    def _reply(self):
+        self.calls += 1
+        self._message_id += 1
+        if self.latency:
+            time.sleep(self.latency)
+        return types.SimpleNamespace(message_id=self._message_id)
+
+    def send_message(self, chat_id, text, **kwargs):
+        return self._reply()
+
+    def edit_message_text(self, text, chat_id, message_id, **kwargs):
+        return self._reply()
+
+
+def install_fake_openai(chunks: int = 20):
+    """Подменяет модуль openai до импорта services.gpt: стрим из chunks кусочков."""
+
+    def create(model, messages, stream=False, **kwargs):
+        if not stream:
+            return {"choices": [{"message": {"content": "краткое содержание"}}]}
+        return ({"choices": [{"delta": {"content": "слово "}}]} for _ in range(chunks))
+
+    fake = types.ModuleType("openai")
+    fake.ChatCompletion = types.SimpleNamespace(create=create)
+    sys.modules["openai"] = fake
+
+
+# ------------------ замеры ------------------
+def measure(func, args_list) -> list:
+    samples = []
+    for args in args_list:
+        start = time.perf_counter()
+        func(*args)
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def summarize(samples: list, total: float = None) -> dict:
+    ordered = sorted(samples)
+    n = len(ordered)
+    total = total if total is not None else sum(ordered)
+    return {
+        "n": n,
+        "ops_per_sec": round(n / total, 1) if total else None,
+        "p50_ms": round(ordered[n // 2] * 1000, 4),
+        "p99_ms": round(ordered[min(n - 1, int(n * 0.99))] * 1000, 4),
+        "max_ms": round(ordered[-1] * 1000, 4),
+    }
+
+
+def report(results: dict, name: str, samples: list, total: float = None):
+    results[name] = summarize(samples, total)
+    r = results[name]
+    print(f"  {name:<42} {r['ops_per_sec'] or 0:>12,.1f} ops/s   p50 {r['p50_ms']:>9.3f} ms   "
+          f"p99 {r['p99_ms']:>9.3f} ms")
+
+
+# ------------------ синтетические данные ------------------
+def make_history(length: int) -> list:
+    history = [{"role": "system", "content": "Ты — заботливый помощник по самопомощи."}]
+    for i in range(length):
+        role = "user" if i % 2 == 0 else "assistant"
+        history.append({"role": role, "content": f"Реплика {i}: " + "мне тревожно и я не могу уснуть " * 4})
+    return history
+
+
+def populate_chats(db, chats: int, history_len: int, with_history: int):
+    """chats строк в chats/tickets, у первых with_history — история из history_len реплик."""
+    from services.chat_store import new_ticket_id
+
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    history = make_history(history_len)
+    used = set()
+    with db.transaction() as conn:
+        conn.executemany(
+            "INSERT INTO chats (chat_id, mode, updated_at) VALUES (?, ?, ?)",
+            [(chat_id, "self_help" if chat_id % 3 == 0 else None, now) for chat_id in range(1, chats + 1)]
+        )
+        tickets = []
+        for chat_id in range(1, chats + 1):
+            ticket = new_ticket_id()
+            while ticket in used:
+                ticket = new_ticket_id()
+            used.add(ticket)
+            tickets.append((ticket, chat_id))
+        conn.executemany("INSERT INTO tickets (ticket, user_id) VALUES (?, ?)", tickets)
+        for chat_id in range(1, with_history + 1):
+            conn.executemany(
+                "INSERT INTO messages (chat_id, role, content) VALUES (?, ?, ?)",
+                [(chat_id, m["role"], m["content"]) for m in history]
+            )
+
+
+def populate_sessions(sessions, closed: int, open_waiting: int, open_active: int, batch: int = 50_000):
+    """Закрытые сессии пользователей/слушателей и несколько тысяч открытых поверх них."""
+    now = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    rows = []
+    row_id = 0
+    for i in range(closed):
+        row_id += 1
+        rows.append((row_id, f"C-{i:08X}", 1 + i % 200_000, 500_000 + i % 5000, "closed", now, now))
+        if len(rows) >= batch:
+            sessions.import_rows(rows)
+            rows = []
+    for i in range(open_waiting):
+        row_id += 1
+        rows.append((row_id, f"W-{i:06X}", 1 + i, None, "waiting", now, None))
+    for i in range(open_active):
+        row_id += 1
+        rows.append((row_id, f"A-{i:06X}", 100_000 + i, 600_000 + i, "active", now, now))
+    sessions.import_rows(rows)
+
+
+def write_state_json(path: str, chats: int, history_len: int, with_history: int):
+    """Старый формат state.json — для замера разовой миграции при старте."""
+    from services.chat_store import new_ticket_id
+
+    history = make_history(history_len)
+    tickets = {chat_id: f"{new_ticket_id()}-{chat_id}" for chat_id in range(1, chats + 1)}
+    data = {
+        "user_state": {str(c): "self_help" for c in range(1, chats + 1)},
+        "user_conversations": {str(c): history for c in range(1, with_history + 1)},
+        "ticket_index": {t: c for c, t in tickets.items()},
+        "user_ticket": {str(c): t for c, t in tickets.items()},
+    }
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False)
+
+
+# ------------------ сценарии ------------------
+def bench_chat_store(results: dict, workdir: str, chats: int, history_len: int, ops: int):
+    from services.chat_store import ChatStore, create_fresh_ticket, migrate_state_json
+    from services.db import Database
+
+    with_history = min(chats, 2000)
+    db = Database(os.path.join(workdir, f"chats-{chats}.db"))
+    store = ChatStore(db, cache_size=1000)
+    start = time.perf_counter()
+    populate_chats(db, chats, history_len, with_history)
+    print(f"  (данные: {chats} чатов, {with_history} историй по {history_len} реплик "
+          f"за {time.perf_counter() - start:.1f} с)")
+
+    ids = [random.randint(1, chats) for _ in range(ops)]
+    hist_ids = [random.randint(1, with_history) for _ in range(ops)]
+
+    # загрузка при старте: первый доступ к чату поднимает его из базы
+    report(results, f"chats={chats} cold_get", measure(store.get, [(i,) for i in hist_ids[:min(ops, 1000)]]))
+    report(results, f"chats={chats} warm_get", measure(store.get, [(i,) for i in hist_ids[:min(ops, 1000)]]))
+
+    # запись состояния
+    modes = ["self_help", None, "waiting"]
+    report(results, f"chats={chats} set_mode",
+           measure(store.set_mode, [(i, modes[n % 3]) for n, i in enumerate(ids)]))
+    report(results, f"chats={chats} append_message",
+           measure(store.append_message, [(i, "user", "ещё одна реплика") for i in hist_ids]))
+    report(results, f"chats={chats} create_fresh_ticket",
+           measure(create_fresh_ticket, [(store, i) for i in ids]))
+
+    # разовая миграция state.json того же размера
+    state_file = os.path.join(workdir, f"state-{chats}.json")
+    write_state_json(state_file, chats, history_len, with_history)
+    migration_db = Database(os.path.join(workdir, f"migrate-{chats}.db"))
+    migration_store = ChatStore(migration_db)
+    start = time.perf_counter()
+    migrate_state_json(migration_store, state_file)
+    elapsed = time.perf_counter() - start
+    report(results, f"chats={chats} migrate_state_json", [elapsed], total=elapsed)
+    db.close()
+    migration_db.close()
+
+
+def bench_sessions(results: dict, workdir: str, closed: int, ops: int):
+    from services.db import Database
+    from services.routing import RelayRoutes
+    from services.session_store import SqliteSessionStore
+
+    db = Database(os.path.join(workdir, "sessions.db"))
+    sessions = SqliteSessionStore(db)
+    start = time.perf_counter()
+    populate_sessions(sessions, closed, open_waiting=2000, open_active=2000)
+    print(f"  (данные: {closed:,} закрытых сессий за {time.perf_counter() - start:.1f} с)")
+
+    open_users = [1 + random.randrange(2000) for _ in range(ops)]
+    listeners = [600_000 + random.randrange(2000) for _ in range(ops)]
+    idle = [900_000 + random.randrange(100_000) for _ in range(ops)]
+    tickets = [f"W-{random.randrange(2000):06X}" for _ in range(ops)]
+
+    report(results, f"sessions={closed} participant(open)", measure(sessions.participant, [(i,) for i in open_users]))
+    report(results, f"sessions={closed} participant(none)", measure(sessions.participant, [(i,) for i in idle]))
+    report(results, f"sessions={closed} active_for_user",
+           measure(sessions.active_for_user, [(i,) for i in open_users]))
+    report(results, f"sessions={closed} active_for_listener",
+           measure(sessions.active_for_listener, [(i,) for i in listeners]))
+    report(results, f"sessions={closed} get_by_ticket", measure(sessions.get_by_ticket, [(t,) for t in tickets]))
+
+    # старт: таблица маршрутов из открытых сессий
+    routes = RelayRoutes()
+    start = time.perf_counter()
+    routes.rebuild(sessions.open_sessions())
+    elapsed = time.perf_counter() - start
+    report(results, f"sessions={closed} rebuild_routes", [elapsed], total=elapsed)
+
+    # пересылка: поиск маршрута в памяти (попадание и промах)
+    report(results, "routes.get(hit)", measure(routes.get, [(i,) for i in listeners]))
+    report(results, "routes.get(miss)", measure(routes.get, [(i,) for i in idle]))
+
+    # claim: половина заявок уже занята
+    claim_args = [(f"W-{i:06X}", 700_000 + i) for i in range(min(ops, 2000))]
+    report(results, f"sessions={closed} claim", measure(sessions.claim, claim_args))
+    db.close()
+
+
+def bench_sender(results: dict, ops: int):
+    from services.sender import PRIORITY_RELAY, OutboundQueue
+
+    bot = FakeBot()
+    sender = OutboundQueue(bot, global_rate=1e9, chat_rate=1e9, chat_burst=1e9, workers=4)
+    sender.start()
+    chat_ids = [random.randrange(1, 1000) for _ in range(ops)]
+    start = time.perf_counter()
+    futures = [(time.perf_counter(), sender.send_message(c, "привет", priority=PRIORITY_RELAY)) for c in chat_ids]
+    done = []
+    for queued_at, future in futures:
+        future.result()
+        done.append(time.perf_counter() - queued_at)
+    total = time.perf_counter() - start
+    report(results, "sender relay (queue → stub bot)", done, total=total)
+
+
+def bench_gpt(results: dict, workdir: str, history_len: int, ops: int):
+    install_fake_openai()
+    from services.chat_store import ChatStore
+    from services.db import Database
+    from services.gpt import GptPipeline
+    from services.gpt_guard import OpenAIGuard
+    from services.history import HistoryManager
+    from services.sender import OutboundQueue
+
+    db = Database(os.path.join(workdir, "gpt.db"))
+    store = ChatStore(db)
+    chats = 200
+    for chat_id in range(1, chats + 1):
+        store.set_history(chat_id, make_history(history_len))
+
+    sender = OutboundQueue(FakeBot(), global_rate=1e9, chat_rate=1e9, chat_burst=1e9, workers=4)
+    sender.start()
+    # лимиты guard здесь не замеряем — только сам пайплайн
+    guard = OpenAIGuard(max_in_flight=ops + 1, chat_rate=1e9, chat_burst=1e9)
+    gpt = GptPipeline(sender, max_workers=8, max_pending=ops + 1, edit_interval=0.0, guard=guard)
+    histories = HistoryManager(store, gpt, "Ты — заботливый помощник.", budget=3000)
+
+    ids = [random.randint(1, chats) for _ in range(ops)]
+    report(results, f"history={history_len} build_messages", measure(histories.build_messages, [(i,) for i in ids]))
+
+    n = min(ops, 1000)
+    start = time.perf_counter()
+    futures = [(time.perf_counter(), gpt.submit(i, lambda i=i: histories.build_messages(i), on_answer=lambda a: None))
+               for i in ids[:n]]
+    done = []
+    for queued_at, future in futures:
+        future.result()
+        done.append(time.perf_counter() - queued_at)
+    report(results, "gpt stream (stub openai)", done, total=time.perf_counter() - start)
+    gpt.shutdown()
+    db.close()
+
+
+def bench_history_memory(results: dict, history_len: int, chats: int = 500):
+    """Байт на чат в памяти: прежний список словарей (с копией системного
+       промпта в каждой истории) против CompactHistory без промпта."""
+    from misc.texts import SELF_HELP_SYSTEM_PROMPT
+    from services.compact_history import CompactHistory
+
+    conn = sqlite3.connect(":memory:")
+    conn.execute("CREATE TABLE messages (id INTEGER PRIMARY KEY, chat_id INTEGER, role TEXT, content TEXT)")
+    history = [{"role": "system", "content": SELF_HELP_SYSTEM_PROMPT}] + make_history(history_len)[1:]
+    for chat_id in range(chats):
+        conn.executemany("INSERT INTO messages (chat_id, role, content) VALUES (?, ?, ?)",
+                         [(chat_id, m["role"], m["content"]) for m in history])
+
+    def rows(chat_id):
+        return conn.execute("SELECT role, content FROM messages WHERE chat_id=? ORDER BY id", (chat_id,)).fetchall()
+
+    def bytes_per_chat(load) -> float:
+        # как ChatStore._load: строки из SQLite → представление в кэше; считаем то, что осталось в памяти
+        tracemalloc.start()
+        before = tracemalloc.get_traced_memory()[0]
+        kept = [load(rows(chat_id)) for chat_id in range(chats)]
+        used = tracemalloc.get_traced_memory()[0] - before
+        tracemalloc.stop()
+        del kept
+        return used / chats
+
+    old = bytes_per_chat(lambda r: [{"role": role, "content": content} for role, content in r])
+    new = bytes_per_chat(CompactHistory)
+    text = sum(len(m["content"].encode("utf-8")) for m in history[1:])
+    conn.close()
+
+    results[f"history={history_len} memory"] = {"bytes_per_chat_before": round(old), "bytes_per_chat_after": round(new),
+                                                 "text_bytes_per_chat": text}
+    print(f"  {'history=' + str(history_len) + ' memory':<42} {old:>12,.0f} Б/чат → {new:,.0f} Б/чат "
+          f"(-{(1 - new / old) * 100:.0f}%, текст реплик {text:,} Б)")
+
+
+# ------------------ сравнение ------------------
+def compare(current: dict, previous_path: str):
+    with open(previous_path, "r", encoding="utf-8") as f:
+        previous = json.load(f)["results"]
+    print(f"\nСравнение с {previous_path} (p50 / p99, минус — быстрее):")
+    for name, r in current.items():
+        old = previous.get(name)
+        if not old or "p50_ms" not in r:
+            continue
+        d50 = (r["p50_ms"] - old["p50_ms"]) / old["p50_ms"] * 100 if old["p50_ms"] else 0.0
+        d99 = (r["p99_ms"] - old["p99_ms"]) / old["p99_ms"] * 100 if old["p99_ms"] else 0.0
+        print(f"  {name:<42} {d50:>+8.1f}%  {d99:>+8.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--scale", choices=sorted(SCALES), default="small")
+    parser.add_argument("--out", default="bench_results")
+    parser.add_argument("--compare", help="JSON прошлого прогона")
+    parser.add_argument("--keep", action="store_true", help="не удалять временные базы")
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    scale = SCALES[args.scale]
+    workdir = tempfile.mkdtemp(prefix="psyinc-bench-")
+    results = {}
+    try:
+        for chats in scale["chats"]:
+            print(f"\n📦 Состояние чатов: {chats}")
+            bench_chat_store(results, workdir, chats, scale["history"], scale["ops"])
+        print(f"\n🔎 Сессии: {scale['closed_sessions']:,} закрытых")
+        bench_sessions(results, workdir, scale["closed_sessions"], scale["ops"])
+        print("\n📤 Исходящие и GPT")
+        bench_sender(results, scale["ops"])
+        bench_gpt(results, workdir, scale["history"], scale["ops"])
+        print("\n🧠 Память историй GPT")
+        bench_history_memory(results, scale["history"])
+    finally:
+        if args.keep:
+            print(f"\nБазы оставлены в {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    os.makedirs(args.out, exist_ok=True)
+    path = os.path.join(args.out, f"bench-{args.scale}-{datetime.now():%Y%m%d-%H%M%S}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump({
+            "meta": {"scale": args.scale, "seed": args.seed, "python": sys.version.split()[0],
+                     "at": datetime.now().isoformat(timespec="seconds"), **scale},
+            "results": results,
+        }, f, ensure_ascii=False, indent=2)
+    print(f"\n💾 Результаты: {path}")
+
+    if args.compare:
+        compare(results, args.compare)
+
+
+if __name__ == "__main__":
+    main()
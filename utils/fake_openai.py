@@ -0,0 +1,152 @@
+"""Локальный сервер, отвечающий как OpenAI Chat Completions, — проверка лимитов,
+таймаутов и предохранителя (services/gpt_guard.py) без настоящего OpenAI.
+
+    python utils/fake_openai.py [--port 8999] [--latency 0.5] [--error-rate 0.3] [--status 500] [--stall 0]
+
+Бот направляется на него переменной окружения (openai читает её при импорте):
+
+    OPENAI_API_BASE=http://127.0.0.1:8999/v1 python bot_v03.py
+
+Поддерживается POST /v1/chat/completions — стрим (SSE) и обычный ответ.
+latency — пауза до ответа, chunk_delay — между кусками стрима,
+error_rate — доля запросов, получающих status с ошибкой, stall — пауза
+посреди стрима (для таймаутов). Настройки меняются на лету:
+
+    curl -X POST 127.0.0.1:8999/control -d '{"error_rate": 1}'
+    curl 127.0.0.1:8999/control        # текущие настройки и счётчики
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ANSWER = "Я вас слышу. Давайте попробуем разобраться, что именно сейчас тревожит сильнее всего."
+
+
+class FakeOpenAI:
+    """Сервер в фоновом потоке: start() → base_url для OPENAI_API_BASE, stop()."""
+
+    def __init__(self, port: int = 0, latency: float = 0.0, chunk_delay: float = 0.02, error_rate: float = 0.0,
+                 status: int = 500, stall: float = 0.0, answer: str = ANSWER):
+        self.config = {"latency": latency, "chunk_delay": chunk_delay, "error_rate": error_rate,
+                       "status": status, "stall": stall, "answer": answer}
+        self.stats = {"requests": 0, "errors": 0, "streams": 0}
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer(("127.0.0.1", port), _handler(self))
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        return f"http://127.0.0.1:{self._server.server_address[1]}/v1"
+
+    def configure(self, **changes):
+        with self._lock:
+            self.config.update({k: v for k, v in changes.items() if k in self.config})
+
+    def start(self) -> str:
+        self._thread = threading.Thread(target=self._server.serve_forever, name="fake-openai", daemon=True)
+        self._thread.start()
+        return self.base_url
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def _count(self, key: str):
+        with self._lock:
+            self.stats[key] += 1
+
+
+def _handler(fake: FakeOpenAI):
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, format, *args):
+            pass  # без строки в stderr на каждый запрос
+
+        def _json(self, status: int, payload: dict):
+            body = json.dumps(payload, ensure_ascii=False).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def _body(self) -> dict:
+            length = int(self.headers.get("Content-Length") or 0)
+            return json.loads(self.rfile.read(length) or b"{}")
+
+        def do_GET(self):
+            if self.path != "/control":
+                return self._json(404, {"error": {"message": "not found"}})
+            self._json(200, {"config": fake.config, "stats": fake.stats})
+
+        def do_POST(self):
+            if self.path == "/control":
+                fake.configure(**self._body())
+                return self._json(200, {"config": fake.config})
+            if not self.path.endswith("/chat/completions"):
+                return self._json(404, {"error": {"message": "not found"}})
+
+            request = self._body()
+            config = dict(fake.config)
+            fake._count("requests")
+            time.sleep(config["latency"])
+            if random.random() < config["error_rate"]:
+                fake._count("errors")
+                return self._json(config["status"], {"error": {
+                    "message": "Injected failure", "type": "server_error", "param": None, "code": None}})
+
+            words = [w + " " for w in config["answer"].split()]
+            if not request.get("stream"):
+                return self._json(200, {
+                    "id": "chatcmpl-fake", "object": "chat.completion", "created": int(time.time()),
+                    "model": request.get("model"),
+                    "choices": [{"index": 0, "finish_reason": "stop",
+                                 "message": {"role": "assistant", "content": "".join(words).strip()}}],
+                })
+
+            fake._count("streams")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/event-stream")
+            self.end_headers()
+            try:
+                for n, word in enumerate(words):
+                    if config["stall"] and n == len(words) // 2:
+                        time.sleep(config["stall"])
+                    chunk = {"id": "chatcmpl-fake", "object": "chat.completion.chunk", "created": int(time.time()),
+                             "model": request.get("model"),
+                             "choices": [{"index": 0, "delta": {"content": word}, "finish_reason": None}]}
+                    self.wfile.write(f"data: {json.dumps(chunk, ensure_ascii=False)}\n\n".encode())
+                    self.wfile.flush()
+                    time.sleep(config["chunk_delay"])
+                self.wfile.write(b"data: [DONE]\n\n")
+            except (BrokenPipeError, ConnectionResetError):
+                pass  # клиент ушёл по таймауту
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8999)
+    parser.add_argument("--latency", type=float, default=0.0, help="пауза до ответа, секунды")
+    parser.add_argument("--chunk-delay", type=float, default=0.02, help="пауза между кусками стрима")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="доля запросов с ошибкой, 0..1")
+    parser.add_argument("--status", type=int, default=500, help="HTTP-статус ошибки (429, 500, 503…)")
+    parser.add_argument("--stall", type=float, default=0.0, help="пауза посреди стрима, секунды")
+    args = parser.parse_args()
+
+    fake = FakeOpenAI(args.port, args.latency, args.chunk_delay, args.error_rate, args.status, args.stall)
+    print(f"🧪 Фейковый OpenAI: {fake.base_url}  (OPENAI_API_BASE={fake.base_url})")
+    try:
+        fake._server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        fake._server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+"""Перенос таблиц sessions и listeners между SQLite и PostgreSQL.
+
+    python utils/migrate_sessions.py sqlite-to-postgres [--sqlite psyinc.db]
+    python utils/migrate_sessions.py postgres-to-sqlite [--sqlite psyinc.db]
+
+Параметры PostgreSQL берутся из .env (DB_HOST, DB_PORT, DB_USER, DB_PASS, DB_NAME).
+Сессии переносятся с теми же id и временем последнего сообщения (last_activity),
+слушатели — с доступностью и ёмкостью; повторный запуск перезаписывает совпадающие.
+"""
+import argparse
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.db import Database
+from services.session_store import PostgresSessionStore, SqliteSessionStore
+from tgbot.config import load_config
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("direction", choices=["sqlite-to-postgres", "postgres-to-sqlite"])
+    parser.add_argument("--sqlite", default="psyinc.db")
+    parser.add_argument("--batch", type=int, default=5000)
+    args = parser.parse_args()
+
+    db_config = load_config().db
+    sqlite_store = SqliteSessionStore(Database(args.sqlite))
+    postgres_store = PostgresSessionStore(
+        host=db_config.host,
+        port=db_config.port,
+        user=db_config.user,
+        password=db_config.password,
+        database=db_config.database,
+    )
+    if args.direction == "sqlite-to-postgres":
+        source, target = sqlite_store, postgres_store
+    else:
+        source, target = postgres_store, sqlite_store
+
+    total = 0
+    batch = []
+    for row in source.iter_rows(args.batch):
+        batch.append(tuple(row))
+        if len(batch) >= args.batch:
+            target.import_rows(batch)
+            total += len(batch)
+            batch = []
+            print(f"… {total}")
+    if batch:
+        target.import_rows(batch)
+        total += len(batch)
+
+    listeners = source.listeners()
+    target.import_listeners(listeners)
+
+    postgres_store.close_pool()
+    print(f"✅ Перенесено сессий: {total}, слушателей: {len(listeners)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,39 @@
+"""Отправка записанных апдейтов Telegram в локальный вебхук.
+
+    python utils/post_update.py updates.json [--url http://127.0.0.1:8080/telegram/webhook] [--secret ...]
+
+Файл — один апдейт (JSON-объект), список апдейтов или JSON Lines.
+"""
+import argparse
+import json
+import os
+
+import requests
+
+
+def read_updates(path: str) -> list:
+    with open(path, "r", encoding="utf-8") as f:
+        raw = f.read().strip()
+    if raw.startswith("["):
+        return json.loads(raw)
+    try:
+        return [json.loads(raw)]
+    except ValueError:
+        return [json.loads(line) for line in raw.splitlines() if line.strip()]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("path")
+    parser.add_argument("--url", default=f"http://127.0.0.1:{os.getenv('PORT', '8080')}/telegram/webhook")
+    parser.add_argument("--secret", default=os.getenv("WEBHOOK_SECRET", ""))
+    args = parser.parse_args()
+
+    headers = {"X-Telegram-Bot-Api-Secret-Token": args.secret} if args.secret else {}
+    for update in read_updates(args.path):
+        response = requests.post(args.url, json=update, headers=headers, timeout=10)
+        print(f"{update.get('update_id')}: {response.status_code}")
+
+
+if __name__ == "__main__":
+    main()